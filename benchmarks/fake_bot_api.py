@@ -0,0 +1,212 @@
+"""
+Локальный фейковый сервер Telegram Bot API для бенчмарков
+"""
+import asyncio
+import itertools
+import json
+import time
+from collections import Counter
+from typing import Any, Callable, Optional
+
+from aiohttp import web
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+
+BOT_ID = 123456
+BOT_TOKEN = f"{BOT_ID}:FAKE-benchmark-token"
+
+
+class FakeBotAPI:
+    """
+    Минимальная имитация Bot API.
+
+    Отдаёт обновления через getUpdates (long polling) из внутренней очереди.
+    sendMessage, sendPhoto, sendDocument, editMessageText и copyMessage
+    возвращают правдоподобные объекты, остальные методы отвечают успехом.
+    Все вызовы считаются и передаются в on_call, если он задан; latency
+    добавляет задержку к каждому ответу, кроме getUpdates, имитируя сеть
+    до Telegram.
+    """
+
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 8081,
+        latency: float = 0.0,
+        on_call: Optional[Callable[[str, dict[str, Any]], None]] = None,
+    ):
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.on_call = on_call
+        self.calls: Counter[str] = Counter()
+        self._message_ids = itertools.count(1)
+        self._updates: list[dict[str, Any]] = []
+        self._new_updates = asyncio.Event()
+        self._next_update_id = 1
+        self._runner: Optional[web.AppRunner] = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    def create_bot(self, **kwargs: Any) -> Bot:
+        """Создает Bot, который ходит в этот сервер вместо api.telegram.org"""
+        session = AiohttpSession(api=TelegramAPIServer.from_base(self.base_url))
+        return Bot(BOT_TOKEN, session=session, **kwargs)
+
+    def push_update(self, payload: dict[str, Any]) -> int:
+        """
+        Ставит обновление в очередь getUpdates
+
+        Args:
+            payload: Тело обновления без update_id, например {"message": {...}}
+
+        Returns:
+            Присвоенный update_id
+        """
+        update_id = self._next_update_id
+        self._next_update_id += 1
+        self._updates.append({"update_id": update_id, **payload})
+        self._new_updates.set()
+        return update_id
+
+    async def start(self) -> None:
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self._handle)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+
+    async def stop(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        self.calls[method] += 1
+        params = dict(await request.post())
+        if self.on_call is not None:
+            self.on_call(method, params)
+
+        if self.latency and method != "getUpdates":
+            await asyncio.sleep(self.latency)
+        handler = getattr(self, f"_method_{method.lower()}", None)
+        result = await handler(params) if handler else True
+        return web.json_response({"ok": True, "result": result})
+
+    def _bot_message(self, params: dict[str, Any], message_id: Optional[int] = None) -> dict[str, Any]:
+        """Собирает сообщение от бота в чат из параметров запроса"""
+        chat_id = int(params["chat_id"])
+        return {
+            "message_id": message_id or next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private", "first_name": f"user{chat_id}"},
+            "from": {"id": BOT_ID, "is_bot": True, "first_name": "bench"},
+        }
+
+    async def _method_sendmessage(self, params: dict[str, Any]) -> dict[str, Any]:
+        message = self._bot_message(params)
+        message["text"] = params.get("text", "")
+        if params.get("reply_markup"):
+            message["reply_markup"] = json.loads(params["reply_markup"])
+        return message
+
+    async def _method_sendphoto(self, params: dict[str, Any]) -> dict[str, Any]:
+        message = self._bot_message(params)
+        file_id = str(params.get("photo", "photo"))
+        message["photo"] = [{"file_id": file_id, "file_unique_id": file_id[-32:], "width": 1280, "height": 720}]
+        return message
+
+    async def _method_senddocument(self, params: dict[str, Any]) -> dict[str, Any]:
+        message = self._bot_message(params)
+        file_id = str(params.get("document", "document"))
+        message["document"] = {"file_id": file_id, "file_unique_id": file_id[-32:]}
+        return message
+
+    async def _method_editmessagetext(self, params: dict[str, Any]) -> Any:
+        if "inline_message_id" in params:
+            return True
+        message = self._bot_message(params, message_id=int(params["message_id"]))
+        message["text"] = params.get("text", "")
+        message["edit_date"] = int(time.time())
+        return message
+
+    async def _method_copymessage(self, params: dict[str, Any]) -> dict[str, Any]:
+        return {"message_id": next(self._message_ids)}
+
+    async def _method_answercallbackquery(self, params: dict[str, Any]) -> bool:
+        return True
+
+    async def _method_getme(self, params: dict[str, Any]) -> dict[str, Any]:
+        return {"id": BOT_ID, "is_bot": True, "first_name": "bench", "username": "bench_bot"}
+
+    async def _method_getupdates(self, params: dict[str, Any]) -> list[dict[str, Any]]:
+        offset = int(params.get("offset") or 0)
+        timeout = float(params.get("timeout") or 0)
+
+        self._updates = [u for u in self._updates if u["update_id"] >= offset]
+        if not self._updates and timeout:
+            self._new_updates.clear()
+            try:
+                await asyncio.wait_for(self._new_updates.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return list(self._updates)
+
+
+def make_user(user_id: int, username: Optional[str] = None) -> dict[str, Any]:
+    """Собирает объект User"""
+    user = {"id": user_id, "is_bot": False, "first_name": f"user{user_id}"}
+    if username:
+        user["username"] = username
+    return user
+
+
+def make_message(
+    chat_id: int,
+    text: Optional[str],
+    message_id: int = 1,
+    username: Optional[str] = None,
+    photo_file_id: Optional[str] = None,
+    media_group_id: Optional[str] = None,
+) -> dict[str, Any]:
+    """
+    Собирает минимальный объект Message для обновления; photo_file_id делает
+    его фотографией, media_group_id - фотографией из альбома
+    """
+    user = make_user(chat_id, username)
+    message = {
+        "message_id": message_id,
+        "date": int(time.time()),
+        "chat": {"id": chat_id, "type": "private", "first_name": user["first_name"]},
+        "from": user,
+    }
+    if photo_file_id:
+        message["photo"] = [{"file_id": photo_file_id, "file_unique_id": photo_file_id[-32:], "width": 1280, "height": 720}]
+        if text:
+            message["caption"] = text
+        if media_group_id:
+            message["media_group_id"] = media_group_id
+    else:
+        message["text"] = text
+    return message
+
+
+def make_callback_query(user_id: int, data: str, message_id: int, query_id: Optional[str] = None) -> dict[str, Any]:
+    """Собирает CallbackQuery на кнопку под сообщением бота в чате пользователя"""
+    return {
+        "id": query_id or f"{user_id}-{message_id}-{time.monotonic_ns()}",
+        "from": make_user(user_id),
+        "chat_instance": str(user_id),
+        "data": data,
+        "message": {
+            "message_id": message_id,
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private", "first_name": f"user{user_id}"},
+            "from": {"id": BOT_ID, "is_bot": True, "first_name": "bench"},
+            "text": "panel",
+        },
+    }
@@ -0,0 +1,316 @@
+"""
+Нагрузочный тест бота целиком: настоящие Dispatcher, middleware,
+обработчики и БД, Telegram заменен фейковым Bot API
+
+Клиенты открывают сессии командой /start, операторы по очереди берут
+их сессии, обмениваются сообщениями (часть сообщений клиентов - фото)
+и закрывают сессии. Обновления доставляются через getUpdates фейкового
+сервера, как при обычном polling.
+
+Для каждой фазы выводятся обновления в секунду, p50/p99 времени
+обработчиков и полного времени обработки обновления, число запросов
+к БД и вызовов Bot API на одно обновление.
+
+Тест пишет в БД из переменных DB_* (.env) - используйте отдельную базу
+или встроенный SQLite: DB_BACKEND=sqlite SQLITE_PATH=/tmp/bench.db.
+ID операторов 1..N подставляются в ADMINS_ID. Лимиты Telegram на отправку
+по умолчанию выключены, --rate-limit их включает.
+
+Запуск:
+    python -m benchmarks.load_test --clients 1000 --operators 10 --attachments 0.3
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import re
+import statistics
+import time
+from collections import Counter
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject, Update
+
+os.environ.setdefault("TOKEN", "123456:FAKE-benchmark-token")
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+from benchmarks.fake_bot_api import FakeBotAPI, make_callback_query, make_message
+from utils.query_stats import QUERY_STATS
+
+_CLIENT_RE = re.compile(r"#(\d+)")
+_SESSION_RE = re.compile(r"^session:(\d+)$")
+
+
+class Phase:
+    """Замеры одной фазы сценария"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.updates = 0
+        self.errors = 0
+        self.handler_latencies: list[float] = []
+        self.update_latencies: list[float] = []
+        self.take_latencies: list[float] = []
+        self.started = time.perf_counter()
+        self.elapsed = 0.0
+        self.queries = 0
+        self.api_calls: Counter[str] = Counter()
+
+
+class Probe(BaseMiddleware):
+    """
+    Внешний middleware обновлений: отмечает завершение обработки
+    обновления. Регистрируется до middleware бота, поэтому в замер
+    попадает вся обработка, включая фиксацию транзакции.
+    """
+
+    def __init__(self):
+        self.phase: Optional[Phase] = None
+        self.pending: dict[int, tuple[float, asyncio.Future]] = {}
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: Update,
+        data: Dict[str, Any]
+    ) -> Any:
+        try:
+            return await handler(event, data)
+        except Exception:
+            self.phase.errors += 1
+            raise
+        finally:
+            pushed, future = self.pending.pop(event.update_id, (None, None))
+            if future is not None:
+                self.phase.updates += 1
+                self.phase.update_latencies.append(time.perf_counter() - pushed)
+                if not future.done():
+                    future.set_result(None)
+
+
+class HandlerTimer(BaseMiddleware):
+    """Внутренний middleware: время работы самого обработчика"""
+
+    def __init__(self, probe: Probe):
+        self.probe = probe
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        start = time.perf_counter()
+        try:
+            return await handler(event, data)
+        finally:
+            self.probe.phase.handler_latencies.append(time.perf_counter() - start)
+
+
+class Traffic:
+    """Генератор обновлений клиентов и операторов"""
+
+    def __init__(self, probe: Probe, args: argparse.Namespace):
+        self.api: Optional[FakeBotAPI] = None
+        self.probe = probe
+        self.args = args
+        self.random = random.Random(args.seed)
+        self.limit = asyncio.Semaphore(args.concurrency)
+        self.sessions: dict[int, int] = {}
+        self._message_ids = itertools.count(1)
+
+    def capture_session(self, method: str, params: dict[str, Any]) -> None:
+        """Запоминает id сессии из уведомления операторам о новой сессии"""
+        if method != "sendMessage" or "reply_markup" not in params:
+            return
+        client = _CLIENT_RE.search(params.get("text", ""))
+        markup = json.loads(params["reply_markup"])
+        for row in markup.get("inline_keyboard", []):
+            for button in row:
+                match = _SESSION_RE.match(button.get("callback_data") or "")
+                if client and match:
+                    self.sessions[int(client.group(1))] = int(match.group(1))
+
+    async def push(self, payload: dict[str, Any]) -> None:
+        """Отдает обновление боту и ждет окончания его обработки"""
+        async with self.limit:
+            future = asyncio.get_running_loop().create_future()
+            update_id = self.api.push_update(payload)
+            self.probe.pending[update_id] = (time.perf_counter(), future)
+            await asyncio.wait_for(future, self.args.timeout)
+
+    async def client_message(self, tgid: int) -> None:
+        message_id = next(self._message_ids)
+        attachment = self.random.random() < self.args.attachments
+        if attachment and self.args.album_size > 1:
+            # Альбом приходит пачкой обновлений с общим media_group_id
+            group = f"bench-album-{tgid}-{message_id}"
+            await asyncio.gather(*(
+                self.push({"message": make_message(
+                    tgid, "альбом" if n == 0 else None, message_id=next(self._message_ids),
+                    photo_file_id=f"{group}-{n}", media_group_id=group,
+                )})
+                for n in range(self.args.album_size)
+            ))
+            return
+        if attachment:
+            message = make_message(tgid, "фото", message_id=message_id, photo_file_id=f"bench-photo-{tgid}-{message_id}")
+        else:
+            message = make_message(tgid, f"Сообщение клиента {message_id}", message_id=message_id)
+        await self.push({"message": message})
+
+    async def operator_message(self, operator_id: int, text: str) -> None:
+        await self.push({"message": make_message(operator_id, text, message_id=next(self._message_ids))})
+
+    async def operator_callback(self, operator_id: int, data: str, panel_id: int) -> None:
+        await self.push({"callback_query": make_callback_query(operator_id, data, panel_id)})
+
+    async def serve(self, operator_id: int, clients: list[int]) -> None:
+        """Оператор по очереди обслуживает своих клиентов"""
+        for tgid in clients:
+            session_id = self.sessions.get(tgid)
+            if session_id is None:
+                continue
+            panel_id = next(self._message_ids)
+            start = time.perf_counter()
+            await self.operator_callback(operator_id, f"take:{session_id}", panel_id)
+            self.probe.phase.take_latencies.append(time.perf_counter() - start)
+            pending = []
+            for n in range(self.args.messages):
+                pending.append(asyncio.create_task(self.client_message(tgid)))
+                await self.operator_message(operator_id, f"Ответ оператора {n}")
+            await asyncio.gather(*pending)
+            await self.operator_callback(operator_id, f"close:{session_id}", panel_id)
+
+
+def _percentile(values: list[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def _total_queries() -> int:
+    return sum(row.count for row in QUERY_STATS.top(QUERY_STATS.max_statements + 1))
+
+
+async def _run_phase(name: str, probe: Probe, api: FakeBotAPI, work: Awaitable[Any]) -> Phase:
+    phase = probe.phase = Phase(name)
+    queries, calls = _total_queries(), Counter(api.calls)
+    await work
+    phase.elapsed = time.perf_counter() - phase.started
+    phase.queries = _total_queries() - queries
+    phase.api_calls = Counter(api.calls)
+    phase.api_calls.subtract(calls)
+    return phase
+
+
+def _report(phase: Phase) -> None:
+    updates = max(phase.updates, 1)
+    api_calls = sum(count for method, count in phase.api_calls.items() if method != "getUpdates")
+    print(f"\n{phase.name}")
+    print(f"  обновлений: {phase.updates} за {phase.elapsed:.2f} с -> {phase.updates / phase.elapsed:.1f} обн/с, ошибок: {phase.errors}")
+    print(f"  обработчик: p50={_percentile(phase.handler_latencies, 0.5) * 1000:.2f} мс  "
+          f"p99={_percentile(phase.handler_latencies, 0.99) * 1000:.2f} мс")
+    print(f"  обновление: p50={_percentile(phase.update_latencies, 0.5) * 1000:.2f} мс  "
+          f"p99={_percentile(phase.update_latencies, 0.99) * 1000:.2f} мс  "
+          f"mean={statistics.fmean(phase.update_latencies or [0]) * 1000:.2f} мс")
+    if phase.take_latencies:
+        print(f"  взятие сессии: p50={_percentile(phase.take_latencies, 0.5) * 1000:.2f} мс  "
+              f"p99={_percentile(phase.take_latencies, 0.99) * 1000:.2f} мс  "
+              f"mean={statistics.fmean(phase.take_latencies) * 1000:.2f} мс")
+    print(f"  запросов к БД на обновление: {phase.queries / updates:.2f}")
+    print(f"  вызовов Bot API на обновление: {api_calls / updates:.2f}")
+    top = ", ".join(f"{method}={count}" for method, count in phase.api_calls.most_common() if method != "getUpdates" and count > 0)
+    print(f"  Bot API: {top or '-'}")
+
+
+async def _start_all(traffic: Traffic, clients: list[int], post_send) -> None:
+    await asyncio.gather(*(traffic.push({"message": make_message(tgid, "/start", username=f"c{tgid}")}) for tgid in clients))
+    # Сессии операторы узнают из уведомлений, которые уходят в фоне
+    await post_send.join()
+
+
+async def _serve_all(traffic: Traffic, assignments: dict[int, list[int]], post_send) -> None:
+    await asyncio.gather(*(traffic.serve(operator, served) for operator, served in assignments.items()))
+    # Запросы фоновой записи ответов входят в фазу
+    await post_send.join()
+
+
+async def run(args: argparse.Namespace) -> None:
+    # ID операторов должны быть админами до импорта конфигурации
+    os.environ["OUTBOUND_RATE_LIMIT"] = "1" if args.rate_limit else "0"
+    operators = list(range(1, args.operators + 1))
+    os.environ["ADMINS_ID"] = ",".join(map(str, operators))
+    import main as bot_main
+
+    probe = Probe()
+    traffic = Traffic(probe, args)
+    api = traffic.api = FakeBotAPI(port=args.port, latency=args.api_latency / 1000, on_call=traffic.capture_session)
+    await api.start()
+    bot_main.bot = api.create_bot()
+
+    bot_main.dp.update.outer_middleware(probe)
+    pool = await bot_main.bot_init()
+    timer = HandlerTimer(probe)
+    bot_main.dp.message.middleware(timer)
+    bot_main.dp.callback_query.middleware(timer)
+
+    services = bot_main.dp["services"]
+    await services.database_service.migrate()
+    await services.session_service.load_counters()
+    services.session_service.start_counters_reconcile()
+
+    polling = asyncio.create_task(
+        bot_main.dp.start_polling(bot_main.bot, handle_signals=False, polling_timeout=1)
+    )
+    # Клиенты каждого прогона новые, чтобы сессии не пересекались с прошлыми
+    client_base = 10 ** 12 + int(time.time()) % 10 ** 6 * 10 ** 5
+    clients = [client_base + i for i in range(args.clients)]
+    print(
+        f"Сценарий: {args.clients} клиентов, {args.operators} операторов, "
+        f"{args.attachments:.0%} вложений{f' (альбомы по {args.album_size})' if args.album_size > 1 else ''}, {args.messages} сообщений клиента на сессию, "
+        f"задержка Bot API {args.api_latency} мс"
+    )
+
+    try:
+        start = await _run_phase(
+            "Открытие сессий (/start)", probe, api,
+            _start_all(traffic, clients, bot_main.dp["post_send"]),
+        )
+        _report(start)
+
+        assignments = {operator: clients[i::len(operators)] for i, operator in enumerate(operators)}
+        chat = await _run_phase(
+            "Переписка (взять, сообщения, закрыть)", probe, api,
+            _serve_all(traffic, assignments, bot_main.dp["post_send"]),
+        )
+        _report(chat)
+    finally:
+        await bot_main.dp.stop_polling()
+        await polling
+        await bot_main.dp["post_send"].close()
+        await bot_main.dp["refresh_scheduler"].close()
+        await bot_main.dp["outbound"].close()
+        await bot_main._cleanup_database(pool, services)
+        await bot_main.bot.session.close()
+        await api.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clients", type=int, default=1000, help="количество клиентов")
+    parser.add_argument("--operators", type=int, default=10, help="количество операторов")
+    parser.add_argument("--attachments", type=float, default=0.3, help="доля сообщений клиентов с фото")
+    parser.add_argument("--album-size", type=int, default=0, help="фото в альбоме: сообщения с фото приходят альбомами")
+    parser.add_argument("--messages", type=int, default=3, help="сообщений клиента на сессию")
+    parser.add_argument("--concurrency", type=int, default=200, help="обновлений в обработке одновременно")
+    parser.add_argument("--api-latency", type=float, default=0.0, help="задержка ответов Bot API, мс")
+    parser.add_argument("--timeout", type=float, default=60.0, help="ожидание обработки одного обновления, с")
+    parser.add_argument("--rate-limit", action="store_true", help="включить лимиты Telegram на отправку")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--port", type=int, default=18090, help="порт фейкового Bot API")
+    asyncio.run(run(parser.parse_args()))
@@ -0,0 +1,167 @@
+"""
+Накладные расходы логирования на одно обновление: до и после перехода
+на очередь логов
+
+Воспроизводит строки логов, которые пишутся при обработке сообщения
+клиента и ответа оператора, и измеряет время, проведённое в вызовах
+логгера в потоке event loop.
+
+  before - прежняя схема: root на DEBUG, синхронный StreamHandler,
+           f-строки (форматирование до вызова) и форматтер, меняющий запись;
+  after  - текущая utils.logger: QueueHandler + QueueListener,
+           уровни из LOG_LEVEL/LOG_LEVELS, %-аргументы.
+
+Вывод в обоих режимах идёт в os.devnull.
+
+Запуск:
+    python -m benchmarks.logging_overhead --updates 20000
+"""
+import argparse
+import logging
+import os
+import sys
+import time
+
+# Логгер читает уровни из окружения при импорте
+os.environ.setdefault("LOG_LEVEL", "INFO")
+
+from utils import logger as app_logger
+
+D, I = logging.DEBUG, logging.INFO
+
+# (логгер, уровень, шаблон, аргументы) - строки одного обновления
+CLIENT_MESSAGE = [
+    ("middlewares.admin", D, "Проверка прав пользователя %s: is_admin=%s", (1000, False)),
+    ("middlewares.services", D, "Сервисы добавлены в контекст обработчика", ()),
+    ("middlewares.log", D, "Сообщение от пользователя %s в сессии %s", (1000, 42)),
+    ("MessageService", D, "Логирование сообщения: tgid=%s, session_id=%s, direction=%s", (1000, 42, "fromUser")),
+    ("MessageService", D, "Сообщение залогировано в БД", ()),
+    ("middlewares.databaseAdd", D, "Добавление пользователя в БД: tgid=%s, username=@%s", (1000, "client")),
+    ("UserService", D, "Добавление пользователя в БД: tgid=%s, username=@%s", (1000, "client")),
+    ("UserService", D, "Пользователь %s добавлен в БД", (1000,)),
+    ("middlewares.databaseAdd", D, "Пользователь %s добавлен в БД", (1000,)),
+    ("utils.refresh", D, "Обновление просмотра сессии для оператора %s", (1,)),
+    ("utils.refresh", D, "Рендеринг панели: %s сообщений, %s вложений", (30, 2)),
+    ("utils.refresh", I, "Панель сессии %s обновлена для оператора %s", (42, 1)),
+]
+
+OPERATOR_REPLY = [
+    ("middlewares.admin", D, "Проверка прав пользователя %s: is_admin=%s", (1, True)),
+    ("middlewares.services", D, "Сервисы добавлены в контекст обработчика", ()),
+    ("handlers.messages.admin_reply_handlers", I, "Обработка ответа админа %s", (1,)),
+    ("handlers.messages.admin_reply_handlers", D, "Данные состояния: %s", ({"session_id": "42", "panel_msg": {"chat_id": 1, "message_id": 7}},)),
+    ("handlers.messages.admin_reply_handlers", I, "Получение информации о сессии %s", ("42",)),
+    ("handlers.messages.admin_reply_handlers", I, "Отправка сообщения от админа %s пользователю %s в сессии %s", (1, 1000, "42")),
+    ("handlers.messages.admin_reply_handlers", D, "Текст сообщения: %s", ("Здравствуйте! Чем можем помочь?",)),
+    ("handlers.messages.admin_reply_handlers", I, "Сообщение успешно отправлено пользователю %s", (1000,)),
+    ("handlers.messages.admin_reply_handlers", I, "Логирование сообщения в БД: user_id=%s, session_id=%s", (1000, "42")),
+    ("MessageService", D, "Логирование сообщения: tgid=%s, session_id=%s, direction=%s", (1000, "42", "fromAgent")),
+    ("MessageService", D, "Сообщение залогировано в БД", ()),
+    ("handlers.messages.admin_reply_handlers", I, "Сообщение залогировано в БД", ()),
+    ("handlers.messages.admin_reply_handlers", I, "Обновление панели сессии %s", ("42",)),
+    ("handlers.messages.admin_reply_handlers", D, "Рендеринг панели: %s сообщений, %s вложений", (30, 2)),
+    ("handlers.messages.admin_reply_handlers", I, "Панель сессии %s обновлена", ("42",)),
+    ("handlers.messages.admin_reply_handlers", I, "Обработка ответа админа %s завершена", (1,)),
+]
+
+# Модули, которым прежняя настройка выставляла INFO; остальные писали DEBUG
+LEGACY_INFO_LOGGERS = [
+    "main",
+    "services.user_service",
+    "services.session_service",
+    "services.message_service",
+    "services.notification_service",
+    "services.database_service",
+    "handlers.messages.start",
+    "handlers.messages.admin_reply_handlers",
+    "handlers.callbacks.messages_handler",
+    "handlers.callbacks.users_handler",
+    "middlewares.log",
+    "middlewares.databaseAdd",
+    "utils.refresh",
+]
+
+
+class LegacyColoredFormatter(app_logger.ColoredFormatter):
+    """Прежний форматтер: меняет levelname самой записи"""
+
+    def format(self, record):
+        config = self.LEVEL_CONFIG.get(record.levelname, {"color": "", "emoji": "", "name": record.levelname})
+        record.levelname = f"{config['color']}{config['emoji']} {config['name']}{self.RESET}"
+        return logging.Formatter.format(self, record)
+
+
+def _reset_levels() -> None:
+    for name in {name for name, *_ in CLIENT_MESSAGE + OPERATOR_REPLY} | set(LEGACY_INFO_LOGGERS):
+        logging.getLogger(name).setLevel(logging.NOTSET)
+
+
+def setup_before(sink) -> None:
+    app_logger.logger_manager.stop()
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.setLevel(logging.DEBUG)
+    handler = logging.StreamHandler(sink)
+    handler.setFormatter(LegacyColoredFormatter(
+        fmt="%(asctime)s | %(name)-20s | %(levelname)-12s | %(message)s", datefmt="%H:%M:%S"
+    ))
+    root.addHandler(handler)
+    _reset_levels()
+    for name in LEGACY_INFO_LOGGERS:
+        logging.getLogger(name).setLevel(logging.INFO)
+
+
+def setup_after(sink) -> None:
+    app_logger.logger_manager.stop()
+    _reset_levels()
+    app_logger.logger_manager._setup_logging()
+    listener = app_logger.logger_manager.listener
+    if listener is not None:
+        for handler in listener.handlers:
+            handler.setStream(sink)
+    else:
+        for handler in logging.getLogger().handlers:
+            handler.setStream(sink)
+
+
+def run(lines, updates: int, eager: bool) -> float:
+    """Возвращает среднее время вызовов логгера на одно обновление в мкс"""
+    prepared = [(logging.getLogger(name), level, template, args) for name, level, template, args in lines]
+    start = time.perf_counter()
+    for _ in range(updates):
+        for log, level, template, args in prepared:
+            if eager:
+                # f-строка: сообщение собирается до вызова, даже если уровень отключен
+                log.log(level, template % args)
+            else:
+                log.log(level, template, *args)
+    return (time.perf_counter() - start) / updates * 1e6
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--updates", type=int, default=20000)
+    args = parser.parse_args()
+
+    with open(os.devnull, "w", encoding="utf-8") as sink:
+        results = {}
+        for mode, setup, eager in (("before", setup_before, True), ("after", setup_after, False)):
+            setup(sink)
+            for title, lines in (("сообщение клиента", CLIENT_MESSAGE), ("ответ оператора", OPERATOR_REPLY)):
+                run(lines, min(args.updates, 1000), eager)  # прогрев
+                results[(mode, title)] = run(lines, args.updates, eager)
+            drain_start = time.perf_counter()
+            app_logger.logger_manager.stop()
+            results[(mode, "drain")] = time.perf_counter() - drain_start
+
+    print(f"Обновлений: {args.updates}, LOG_LEVEL={os.environ['LOG_LEVEL']}", file=sys.stderr)
+    for title in ("сообщение клиента", "ответ оператора"):
+        before, after = results[("before", title)], results[("after", title)]
+        print(f"{title:>18}: before {before:7.1f} мкс/обновление, after {after:7.1f} мкс/обновление "
+              f"({before / after:.1f}x)")
+    print(f"Дописывание очереди после прогона (вне event loop): {results[('after', 'drain')]:.2f} с")
+
+
+if __name__ == "__main__":
+    main()
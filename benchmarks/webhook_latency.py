@@ -0,0 +1,130 @@
+"""
+Сравнение задержки «обновление -> обработчик» в режимах polling и webhook
+
+Обновления по одному отдаются через фейковый Bot API (polling) или
+отправляются POST-запросом в webhook-приложение из main.create_webhook_app.
+Измеряется время от появления обновления до вызова обработчика.
+
+Запуск:
+    python -m benchmarks.webhook_latency --updates 500
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import time
+
+# main.py читает конфигурацию при импорте
+for _name, _value in {
+    "TOKEN": "123456:FAKE-benchmark-token",
+    "ADMINS_ID": "1",
+    "DB_HOST": "localhost",
+    "DB_USER": "bench",
+    "DB_PASSWORD": "bench",
+    "DB_DATABASE": "bench",
+}.items():
+    os.environ.setdefault(_name, _value)
+
+import aiohttp
+from aiogram import Dispatcher
+from aiogram.types import Message
+from aiohttp import web
+
+import main
+from benchmarks.fake_bot_api import FakeBotAPI, make_message
+
+WEBHOOK_PATH = "/webhook"
+WEBHOOK_SECRET = "benchmark-secret"
+CHAT_ID = 1000
+
+
+def _create_dispatcher(arrivals: dict[int, asyncio.Future]) -> Dispatcher:
+    dispatcher = Dispatcher()
+
+    @dispatcher.message()
+    async def on_message(message: Message) -> None:
+        future = arrivals.get(message.message_id)
+        if future is not None and not future.done():
+            future.set_result(time.perf_counter())
+
+    return dispatcher
+
+
+async def bench_polling(updates: int, api_port: int) -> list[float]:
+    api = FakeBotAPI(port=api_port)
+    await api.start()
+    bot = api.create_bot()
+    arrivals: dict[int, asyncio.Future] = {}
+    dispatcher = _create_dispatcher(arrivals)
+    polling = asyncio.create_task(dispatcher.start_polling(bot, handle_signals=False, polling_timeout=30))
+
+    loop = asyncio.get_running_loop()
+    latencies = []
+    try:
+        for message_id in range(1, updates + 1):
+            arrivals[message_id] = loop.create_future()
+            sent = time.perf_counter()
+            api.push_update({"message": make_message(CHAT_ID, "ping", message_id=message_id)})
+            received = await asyncio.wait_for(arrivals[message_id], 30)
+            latencies.append(received - sent)
+    finally:
+        await dispatcher.stop_polling()
+        await polling
+        await api.stop()
+    return latencies
+
+
+async def bench_webhook(updates: int, webhook_port: int) -> list[float]:
+    api = FakeBotAPI(port=webhook_port + 1)
+    await api.start()
+    bot = api.create_bot()
+    arrivals: dict[int, asyncio.Future] = {}
+    dispatcher = _create_dispatcher(arrivals)
+
+    app = main.create_webhook_app(dispatcher, bot, WEBHOOK_PATH, WEBHOOK_SECRET)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", webhook_port).start()
+
+    url = f"http://127.0.0.1:{webhook_port}{WEBHOOK_PATH}"
+    headers = {"X-Telegram-Bot-Api-Secret-Token": WEBHOOK_SECRET}
+    loop = asyncio.get_running_loop()
+    latencies = []
+    try:
+        async with aiohttp.ClientSession() as http:
+            # Без секрета запрос должен отклоняться
+            async with http.post(url, json={"update_id": 0}) as response:
+                assert response.status == 401, f"webhook принял запрос без секрета: {response.status}"
+
+            for message_id in range(1, updates + 1):
+                arrivals[message_id] = loop.create_future()
+                update = {"update_id": message_id, "message": make_message(CHAT_ID, "ping", message_id=message_id)}
+                sent = time.perf_counter()
+                async with http.post(url, json=update, headers=headers) as response:
+                    response.raise_for_status()
+                received = await asyncio.wait_for(arrivals[message_id], 30)
+                latencies.append(received - sent)
+    finally:
+        await runner.cleanup()
+        await api.stop()
+    return latencies
+
+
+def _report(name: str, latencies: list[float]) -> None:
+    ms = sorted(x * 1000 for x in latencies)
+    p50 = statistics.median(ms)
+    p99 = ms[min(len(ms) - 1, int(len(ms) * 0.99))]
+    print(f"{name:<8} n={len(ms):<5} mean={statistics.fmean(ms):7.2f} ms  p50={p50:7.2f} ms  p99={p99:7.2f} ms")
+
+
+async def run(updates: int, port: int) -> None:
+    _report("polling", await bench_polling(updates, port))
+    _report("webhook", await bench_webhook(updates, port + 1))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--updates", type=int, default=500, help="количество обновлений на режим")
+    parser.add_argument("--port", type=int, default=18080, help="базовый локальный порт")
+    args = parser.parse_args()
+    asyncio.run(run(args.updates, args.port))
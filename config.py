@@ -2,10 +2,9 @@ import os
 import re
 from typing import Optional, Set
 
-import aiomysql
 from dotenv import load_dotenv
 
-from constants import DB_MAX_POOL_SIZE, DB_MIN_POOL_SIZE, DB_PORT
+from constants import DB_MAX_POOL_SIZE, DB_MIN_POOL_SIZE, DB_PORT, SQLITE_POOL_SIZE, WEBHOOK_CACHE_TTL
 from utils.logger import get_logger
 
 load_dotenv()
@@ -15,21 +14,85 @@ logger = get_logger(__name__)
 TOKEN: Optional[str] = os.getenv("TOKEN")
 ADMINS_ID: str = os.getenv("ADMINS_ID", "")
 
+# Хранилище: mysql (по умолчанию) или sqlite (встроенная БД в одном файле)
+DB_BACKEND: str = os.getenv("DB_BACKEND", "mysql").lower()
+SQLITE_PATH: str = os.getenv("SQLITE_PATH", "onyxchat.db")
+
 DB_HOST: Optional[str] = os.getenv("DB_HOST")
 DB_USER: Optional[str] = os.getenv("DB_USER")
 DB_PASSWORD: Optional[str] = os.getenv("DB_PASSWORD")
 DB_DATABASE: Optional[str] = os.getenv("DB_DATABASE")
 
+# Режим получения обновлений: polling (по умолчанию) или webhook
+BOT_MODE: str = os.getenv("BOT_MODE", "polling").lower()
+WEBHOOK_BASE_URL: Optional[str] = os.getenv("WEBHOOK_BASE_URL")
+WEBHOOK_PATH: str = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_SECRET: Optional[str] = os.getenv("WEBHOOK_SECRET")
+WEBHOOK_HOST: str = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT: int = int(os.getenv("WEBHOOK_PORT", "8080"))
+
+# Отложенная запись сообщений пачками (по умолчанию выключена)
+MESSAGE_BATCH_LOGGING: bool = os.getenv("MESSAGE_BATCH_LOGGING", "0").lower() in ("1", "true", "yes")
+
+# Хранилище состояний FSM: mysql (по умолчанию, общее для всех процессов) или memory
+FSM_STORAGE: str = os.getenv("FSM_STORAGE", "mysql").lower()
+
+# Лимиты Telegram на исходящие сообщения: 0 - выключены (например, для бенчмарков)
+OUTBOUND_RATE_LIMIT: bool = os.getenv("OUTBOUND_RATE_LIMIT", "1").lower() in ("1", "true", "yes")
+
+# HTTP-эндпоинт метрик Prometheus: 0 (по умолчанию) - выключен
+METRICS_HOST: str = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT: int = int(os.getenv("METRICS_PORT", "0"))
+
+# Время жизни кэшей маршрутов и историй сессий, секунд; 0 - без срока.
+# В polling работает один процесс и сам обновляет кэши, а за балансировщиком
+# (webhook) изменения других процессов видны только после истечения срока
+_cache_ttl_default = "0" if BOT_MODE == "polling" else str(WEBHOOK_CACHE_TTL)
+ROUTING_CACHE_TTL: float = float(os.getenv("ROUTING_CACHE_TTL", _cache_ttl_default))
+TRANSCRIPT_CACHE_TTL: float = float(os.getenv("TRANSCRIPT_CACHE_TTL", _cache_ttl_default))
+
 # Проверка обязательных переменных
 required_vars = {
     "TOKEN": TOKEN,
     "ADMINS_ID": ADMINS_ID if ADMINS_ID else None,
-    "DB_HOST": DB_HOST,
-    "DB_USER": DB_USER,
-    "DB_PASSWORD": DB_PASSWORD,
-    "DB_DATABASE": DB_DATABASE
 }
 
+if DB_BACKEND not in ("mysql", "sqlite"):
+    logger.error(f"Неизвестный бэкенд DB_BACKEND: {DB_BACKEND}")
+    raise ValueError(f"DB_BACKEND должен быть mysql или sqlite, получено: {DB_BACKEND}")
+
+if DB_BACKEND == "sqlite" and MESSAGE_BATCH_LOGGING:
+    # Фоновая запись пачек ждала бы блокировку записи, которую держит транзакция
+    # обновления, а обновление - дозапись буфера перед чтением истории
+    logger.warning("MESSAGE_BATCH_LOGGING не поддерживается с SQLite и будет выключен")
+    MESSAGE_BATCH_LOGGING = False
+
+if DB_BACKEND == "mysql":
+    required_vars["DB_HOST"] = DB_HOST
+    required_vars["DB_USER"] = DB_USER
+    required_vars["DB_PASSWORD"] = DB_PASSWORD
+    required_vars["DB_DATABASE"] = DB_DATABASE
+
+if BOT_MODE not in ("polling", "webhook"):
+    logger.error(f"Неизвестный режим BOT_MODE: {BOT_MODE}")
+    raise ValueError(f"BOT_MODE должен быть polling или webhook, получено: {BOT_MODE}")
+
+if FSM_STORAGE not in ("mysql", "memory"):
+    logger.error(f"Неизвестное хранилище FSM_STORAGE: {FSM_STORAGE}")
+    raise ValueError(f"FSM_STORAGE должен быть mysql или memory, получено: {FSM_STORAGE}")
+
+if not 0 <= METRICS_PORT <= 65535:
+    logger.error(f"Недопустимый порт METRICS_PORT: {METRICS_PORT}")
+    raise ValueError(f"METRICS_PORT должен быть от 0 до 65535, получено: {METRICS_PORT}")
+
+if ROUTING_CACHE_TTL < 0 or TRANSCRIPT_CACHE_TTL < 0:
+    logger.error(f"Отрицательное время жизни кэша: {ROUTING_CACHE_TTL}, {TRANSCRIPT_CACHE_TTL}")
+    raise ValueError("ROUTING_CACHE_TTL и TRANSCRIPT_CACHE_TTL должны быть не меньше 0")
+
+if BOT_MODE == "webhook":
+    required_vars["WEBHOOK_BASE_URL"] = WEBHOOK_BASE_URL
+    required_vars["WEBHOOK_SECRET"] = WEBHOOK_SECRET
+
 missing_vars = [var for var, value in required_vars.items() if not value]
 if missing_vars:
     logger.error(f"Отсутствуют обязательные переменные окружения: {', '.join(missing_vars)}")
@@ -42,18 +105,23 @@ def get_admin_ids() -> Set[int]:
 
 
 async def create_pool():
-    """Создание пула соединений с базой данных"""
+    """Создание пула соединений с базой данных выбранного бэкенда"""
+    # Импорт здесь: пакет services сам импортирует config
+    from services.backends import create_mysql_pool, create_sqlite_pool
+
     try:
-        pool = await aiomysql.create_pool(
-            host=DB_HOST,
-            user=DB_USER,
-            password=DB_PASSWORD,
-            db=DB_DATABASE,
-            port=DB_PORT,
-            minsize=DB_MIN_POOL_SIZE,
-            maxsize=DB_MAX_POOL_SIZE,
-            autocommit=True
-        )
+        if DB_BACKEND == "sqlite":
+            pool = await create_sqlite_pool(SQLITE_PATH, SQLITE_POOL_SIZE)
+        else:
+            pool = await create_mysql_pool(
+                host=DB_HOST,
+                user=DB_USER,
+                password=DB_PASSWORD,
+                db=DB_DATABASE,
+                port=DB_PORT,
+                minsize=DB_MIN_POOL_SIZE,
+                maxsize=DB_MAX_POOL_SIZE,
+            )
         logger.info("Пул соединений с базой данных создан успешно")
         return pool
     except Exception as e:
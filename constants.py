@@ -6,9 +6,65 @@
 DB_PORT = 3306
 DB_MIN_POOL_SIZE = 5
 DB_MAX_POOL_SIZE = 10
+SQLITE_POOL_SIZE = 4  # соединений с файлом SQLite; запись всё равно идёт по одной
+SQLITE_BUSY_TIMEOUT = 30.0  # секунд ожидания блокировки записи
+MIGRATION_LOCK_TIMEOUT = 60        # секунд ожидания миграции, выполняемой другим процессом
+
+# Настройки пакетной записи сообщений
+MESSAGE_BATCH_SIZE = 100
+MESSAGE_BATCH_INTERVAL_MS = 50
+MESSAGE_BATCH_QUEUE_SIZE = 1000
+
+# Обработка обновлений
+UPDATE_MAX_CONCURRENCY = 20        # обновлений в обработке одновременно; ~2 на соединение пула, часть ждёт Bot API
+POST_SEND_MAX_ATTEMPTS = 3         # попыток фоновой операции после доставки ответа оператора
+POST_SEND_RETRY_DELAY = 0.5        # секунд до первого повтора; далее пауза удваивается
+POST_SEND_CLOSE_TIMEOUT = 10.0     # секунд ожидания фоновых операций при остановке бота
+
+# Настройки кэшей
+ROUTING_CACHE_SIZE = 10000
+TRANSCRIPT_CACHE_SIZE = 500
+WEBHOOK_CACHE_TTL = 5.0            # секунд жизни кэшей маршрутов и историй по умолчанию в режиме webhook
+SESSION_COUNTERS_RECONCILE_INTERVAL = 60.0  # секунд между сверками счётчиков сессий с БД
 
 # Настройки пагинации
 CLOSED_PER_PAGE = 10
+SESSIONS_PER_PAGE = 20
+
+# Настройки панели сессии
+TRANSCRIPT_PAGE_SIZE = 30          # сообщений, читаемых из БД за одно окно
+TRANSCRIPT_MESSAGE_LIMIT = 1000    # символов одного сообщения в панели
+PANEL_TEXT_LIMIT = 4096            # лимит длины текста сообщения Telegram
+PANEL_REFRESH_INTERVAL = 1.0       # секунд между обновлениями панели одного оператора
+
+# Вложения
+MEDIA_GROUP_MAX_SIZE = 10          # элементов в одном альбоме Telegram
+ATTACHMENTS_OPEN_ALL_LIMIT = 50    # последних вложений сессии, отправляемых кнопкой "Все вложения"
+MEDIA_GROUP_COLLECT_WINDOW = 0.5   # секунд тишины, после которых альбом клиента считается полученным
+
+# Исходящие запросы к Bot API (лимиты Telegram)
+OUTBOUND_GLOBAL_RATE = 30.0        # сообщений в секунду на весь бот
+OUTBOUND_GLOBAL_BURST = 30         # сообщений подряд сверх среднего темпа
+OUTBOUND_CHAT_RATE = 1.0           # сообщений в секунду в один чат
+OUTBOUND_CHAT_BURST = 3
+OUTBOUND_MAX_RETRIES = 3           # повторов после 429 Too Many Requests
+OUTBOUND_MAX_RETRY_AFTER = 60.0    # секунд; при более долгой паузе запрос не повторяется
+OUTBOUND_CHAT_BUCKETS_MAX = 10000  # чатов, для которых помнится расход лимита
+
+# Хранилище FSM
+FSM_CACHE_TTL = 1.0                # секунд, в течение которых состояние читается из локального кэша
+
+# Метрики
+METRICS_PREFIX = "onyxchat"
+METRICS_LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)  # секунд
+METRICS_STATEMENT_CACHE_SIZE = 1000  # текстов запросов с уже определённым именем
+
+# Статистика SQL-запросов
+SLOW_QUERY_THRESHOLD = 0.2         # секунд, после которых запрос попадает в журнал медленных
+QUERY_STATS_SAMPLE_SIZE = 1000     # последних замеров запроса для p50/p95
+QUERY_STATS_MAX_STATEMENTS = 500   # различных запросов в статистике
+QUERY_STATS_TOP = 10               # строк в /querystats по умолчанию
+QUERY_STATS_TOP_MAX = 30
 
 # Типы сессий
 SESSION_TYPES = {
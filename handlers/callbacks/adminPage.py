@@ -10,25 +10,25 @@ logger = get_logger(__name__)
 async def mainPageCallback(callback_query: CallbackQuery, state: FSMContext, is_admin: bool, pool):
     user_id = callback_query.from_user.id
     callback_data = callback_query.data
-    logger.info(f"Обработка callback от пользователя {user_id}: {callback_data}")
+    logger.info("Обработка callback от пользователя %s: %s", user_id, callback_data)
 
     if callback_data == "home":
-        logger.info(f"Переход на главную страницу пользователем {user_id}")
+        logger.info("Переход на главную страницу пользователем %s", user_id)
         if is_admin:
-            logger.debug(f"Очистка состояния для админа {user_id}")
+            logger.debug("Очистка состояния для админа %s", user_id)
             await state.clear()
         await start.welcome(callback_query.message, state, is_admin, pool, from_callback=True)
         await callback_query.answer()
-        logger.info(f"Главная страница показана пользователю {user_id}")
+        logger.info("Главная страница показана пользователю %s", user_id)
 
     elif callback_data == "onyxStats":
-        logger.info(f"Запрос статистики onyx от пользователя {user_id}")
+        logger.info("Запрос статистики onyx от пользователя %s", user_id)
         await callback_query.message.edit_text("здесь будет onyx stats", reply_markup=back.keyboard())
         await callback_query.answer()
-        logger.info(f"Страница статистики показана пользователю {user_id}")
+        logger.info("Страница статистики показана пользователю %s", user_id)
 
     elif callback_data == "messages":
-        logger.info(f"Запрос страницы сообщений от пользователя {user_id}")
+        logger.info("Запрос страницы сообщений от пользователя %s", user_id)
         await callback_query.message.edit_text("Чаты:", reply_markup=messages_page_keyboard.keyboard())
         await callback_query.answer()
-        logger.info(f"Страница сообщений показана пользователю {user_id}")
\ No newline at end of file
+        logger.info("Страница сообщений показана пользователю %s", user_id)
\ No newline at end of file
@@ -1,13 +1,14 @@
-import asyncio
 import math
+from datetime import datetime
 
-from aiogram.types import CallbackQuery
+from aiogram.types import CallbackQuery, InlineKeyboardMarkup
 
 import texts
-from constants import CLOSED_PER_PAGE, SESSION_TYPES
+from constants import CLOSED_PER_PAGE, SESSION_TYPES, SESSIONS_PER_PAGE
 from keyboards import back
 from keyboards.messages_keyboard import closed_kb, waiting_keyboard
 from services import ServiceContainer
+from utils import render_messages
 from utils.logger import get_logger
 
 logger = get_logger(__name__)
@@ -25,64 +26,100 @@ def _format_count_text(count: int, mine_texts: tuple[str, str, str], other_texts
 
 async def done_list_page(callback_query: CallbackQuery, services: ServiceContainer):
     agent_id = callback_query.from_user.id
-    logger.info(f"Обработка пагинации закрытых чатов для агента {agent_id}")
-    
-    _, _, page_str, mine_str = callback_query.data.split(":")
-    page = int(page_str)
-    only_mine = bool(int(mine_str))
-    logger.debug(f"Параметры пагинации: page={page}, only_mine={only_mine}")
+    logger.info("Обработка пагинации закрытых чатов для агента %s", agent_id)
+    
+    parts = callback_query.data.split(":")
+    if len(parts) == 7:
+        # done:list:{mine}:{page}:{n|o}:{closed_at}:{id}
+        _, _, mine_str, page_str, direction, closed_at, sid = parts
+        only_mine = bool(int(mine_str))
+        page = int(page_str)
+        cursor = render_messages.decode_cursor(closed_at, sid)
+        newer = direction == "n"
+    else:
+        # Кнопки старого формата done:list:{page}:{mine} открывают первую страницу
+        only_mine = bool(int(parts[-1]))
+        page, cursor, newer = 1, None, False
+    logger.debug("Параметры пагинации: page=%s, only_mine=%s, cursor=%s, newer=%s", page, only_mine, cursor, newer)
     
-    await _render_done_page(callback_query, services, page=page, only_mine=only_mine, agent_id=agent_id)
+    await _render_done_page(callback_query, services, only_mine=only_mine, agent_id=agent_id, page=page, cursor=cursor, newer=newer)
     await callback_query.answer()
-    logger.info(f"Пагинация закрытых чатов обработана для агента {agent_id}")
+    logger.info("Пагинация закрытых чатов обработана для агента %s", agent_id)
 
 async def done_toggle(callback_query: CallbackQuery, services: ServiceContainer):
     agent_id = callback_query.from_user.id
-    logger.info(f"Переключение режима просмотра закрытых чатов для агента {agent_id}")
+    logger.info("Переключение режима просмотра закрытых чатов для агента %s", agent_id)
     
-    _, _, page_str, mine_str = callback_query.data.split(":")
-    page = int(page_str)
-    only_mine = not bool(int(mine_str))
-    logger.debug(f"Переключение режима: page={page}, only_mine={only_mine}")
+    # done:toggle:{mine}; режим - всегда последняя часть, в том числе у кнопок старого формата
+    only_mine = not bool(int(callback_query.data.split(":")[-1]))
+    logger.debug("Переключение режима: only_mine=%s", only_mine)
     
-    await _render_done_page(callback_query, services, page=page, only_mine=only_mine, agent_id=agent_id)
+    await _render_done_page(callback_query, services, only_mine=only_mine, agent_id=agent_id)
     await callback_query.answer()
-    logger.info(f"Режим просмотра переключен для агента {agent_id}")
+    logger.info("Режим просмотра переключен для агента %s", agent_id)
 
 
 
-async def _render_done_page(callback_query: CallbackQuery, services: ServiceContainer, page: int, only_mine: bool, agent_id: int) -> None:
-    logger.debug(f"Рендеринг страницы закрытых чатов: page={page}, only_mine={only_mine}, agent_id={agent_id}")
+async def _render_done_page(
+    callback_query: CallbackQuery,
+    services: ServiceContainer,
+    only_mine: bool,
+    agent_id: int,
+    page: int = 1,
+    cursor: tuple[datetime, int] | None = None,
+    newer: bool = False,
+) -> None:
+    logger.debug("Рендеринг страницы закрытых чатов: page=%s, only_mine=%s, agent_id=%s", page, only_mine, agent_id)
     
     session_service = services.session_service
     total = await session_service.count_closed_sessions(only_mine=only_mine, agent_id=agent_id)
+    rows, has_more = await session_service.fetch_closed_sessions(
+        only_mine=only_mine, agent_id=agent_id, cursor=cursor, newer=newer
+    )
+    logger.debug("Получено %s закрытых чатов, всего %s", len(rows), total)
+    
+    # Номер страницы только для заголовка: при листании к новым
+    # отсутствие следующей страницы означает, что мы на первой
+    if cursor is None or (newer and not has_more):
+        page = 1
     total_pages = max(1, math.ceil(total / CLOSED_PER_PAGE))
     page = max(1, min(page, total_pages))
-    logger.debug(f"Статистика: total={total}, total_pages={total_pages}, corrected_page={page}")
-
-    rows = await session_service.fetch_closed_sessions(page=page, only_mine=only_mine, agent_id=agent_id)
-    logger.debug(f"Получено {len(rows)} закрытых чатов")
+    
+    has_newer = has_more if newer else cursor is not None
+    has_older = True if newer else has_more
+    newer_cursor = render_messages.encode_cursor(rows[0][3], rows[0][0]) if rows and has_newer else None
+    older_cursor = render_messages.encode_cursor(rows[-1][3], rows[-1][0]) if rows and has_older else None
     
     title = "Закрытые чаты - Мои" if only_mine else "Закрытые чаты - Все"
     if not rows:
         title += "\n\nПока нет закрытых чатов в этом режиме."
-        logger.info(f"Нет закрытых чатов для агента {agent_id} в режиме {'только мои' if only_mine else 'все'}")
+        logger.info("Нет закрытых чатов для агента %s в режиме %s", agent_id, "только мои" if only_mine else "все")
+    else:
+        title += f"\n\nСтраница {page} из {total_pages} (всего {total})"
         
-    kb = closed_kb.closed_list_kb(rows, page=page, total_pages=total_pages, only_mine=only_mine)
+    kb = closed_kb.closed_list_kb(rows, page=page, only_mine=only_mine, newer=newer_cursor, older=older_cursor)
     await callback_query.message.edit_text(title, reply_markup=kb)
-    logger.info(f"Страница закрытых чатов отрендерена для агента {agent_id}")
+    logger.info("Страница закрытых чатов отрендерена для агента %s", agent_id)
 
 async def messages(callback_query: CallbackQuery, is_admin: bool, services: ServiceContainer):
     """Обрабатывает запросы на получение списков сессий"""
     agent_id = callback_query.from_user.id
-    logger.info(f"Обработка запроса сообщений от агента {agent_id}")
+    logger.info("Обработка запроса сообщений от агента %s", agent_id)
     
     if not is_admin:
-        logger.warning(f"Не-админ {agent_id} пытается получить доступ к сообщениям")
+        logger.warning("Не-админ %s пытается получить доступ к сообщениям", agent_id)
         return
 
-    callback_data = callback_query.data.removeprefix("msg:")
-    logger.debug(f"Тип запроса: {callback_data}")
+    # msg:{kind} - первая страница, msg:{kind}:{page}:{n|o}:{time}:{id} - листание
+    callback_data, *page_parts = callback_query.data.removeprefix("msg:").split(":")
+    logger.debug("Тип запроса: %s, страница: %s", callback_data, page_parts)
+
+    page, cursor, newer = 1, None, False
+    if len(page_parts) == 4:
+        page_str, direction, time_str, sid = page_parts
+        page = int(page_str)
+        cursor = render_messages.decode_cursor(time_str, sid)
+        newer = direction == "n"
 
     # Обработка разных типов запросов
     handlers = {
@@ -94,50 +131,74 @@ async def messages(callback_query: CallbackQuery, is_admin: bool, services: Serv
     
     handler = handlers.get(callback_data)
     if handler:
-        await handler(callback_query, services, agent_id)
+        await handler(callback_query, services, agent_id, page=page, cursor=cursor, newer=newer)
     else:
-        logger.warning(f"Неизвестный тип запроса: {callback_data}")
+        logger.warning("Неизвестный тип запроса: %s", callback_data)
+
+
+async def _fetch_sessions_page(
+    services: ServiceContainer,
+    kind: str,
+    agent_id: int,
+    page: int,
+    cursor: tuple[datetime, int] | None,
+    newer: bool,
+) -> tuple[list[tuple], int, str, InlineKeyboardMarkup]:
+    """
+    Загружает страницу открытых сессий
+    
+    Returns:
+        Сессии страницы, их общее количество, строка с номером страницы и клавиатура
+    """
+    session_service = services.session_service
+    # Количество берется из счётчиков в памяти и не требует запроса к БД
+    items, has_more = await session_service.fetch_sessions(kind, agent_id=agent_id, cursor=cursor, newer=newer)
+    count = await session_service.count_sessions(kind, agent_id=agent_id)
+    
+    if cursor is None or (newer and not has_more):
+        page = 1
+    total_pages = max(1, math.ceil(count / SESSIONS_PER_PAGE))
+    page = max(1, min(page, total_pages))
+    
+    has_newer = has_more if newer else cursor is not None
+    has_older = True if newer else has_more
+    newer_cursor = render_messages.encode_cursor(items[0][3], items[0][0]) if items and has_newer else None
+    older_cursor = render_messages.encode_cursor(items[-1][3], items[-1][0]) if items and has_older else None
+    
+    page_text = f"\n\nСтраница {page} из {total_pages}" if newer_cursor or older_cursor else ""
+    kb = waiting_keyboard.kb(items, kind=kind, page=page, newer=newer_cursor, older=older_cursor)
+    return items, count, page_text, kb
 
 
-async def _handle_to_serve(callback_query: CallbackQuery, services: ServiceContainer, agent_id: int) -> None:
+async def _handle_to_serve(callback_query: CallbackQuery, services: ServiceContainer, agent_id: int, **page_args) -> None:
     """Обрабатывает запрос ожидающих сессий"""
-    logger.info(f"Запрос ожидающих сессий от агента {agent_id}")
+    logger.info("Запрос ожидающих сессий от агента %s", agent_id)
     
-    session_service = services.session_service
-    # Выполняем запросы параллельно для лучшей производительности
-    items, count = await asyncio.gather(
-        session_service.fetch_sessions(SESSION_TYPES["TO_SERVE"]),
-        session_service.count_sessions(SESSION_TYPES["TO_SERVE"])
-    )
-    logger.debug(f"Найдено {count} ожидающих сессий")
+    items, count, page_text, kb = await _fetch_sessions_page(services, SESSION_TYPES["TO_SERVE"], agent_id, **page_args)
+    logger.debug("Найдено %s ожидающих сессий", count)
     
     if not items:
-        logger.info(f"Нет ожидающих сессий для агента {agent_id}")
+        logger.info("Нет ожидающих сессий для агента %s", agent_id)
         await callback_query.message.edit_text(texts.NONE_TO_SERVE, reply_markup=back.keyboard())
         return
 
     await callback_query.message.edit_text(
-        texts.COUNT_TO_SERVE.format(count=count), 
-        reply_markup=waiting_keyboard.kb(items)
+        texts.COUNT_TO_SERVE.format(count=count) + page_text, 
+        reply_markup=kb
     )
     await callback_query.answer()
-    logger.info(f"Список ожидающих сессий показан агенту {agent_id}")
+    logger.info("Список ожидающих сессий показан агенту %s", agent_id)
 
 
-async def _handle_processing_mine(callback_query: CallbackQuery, services: ServiceContainer, agent_id: int) -> None:
+async def _handle_processing_mine(callback_query: CallbackQuery, services: ServiceContainer, agent_id: int, **page_args) -> None:
     """Обрабатывает запрос моих активных сессий"""
-    logger.info(f"Запрос моих активных сессий от агента {agent_id}")
+    logger.info("Запрос моих активных сессий от агента %s", agent_id)
     
-    session_service = services.session_service
-    # Выполняем запросы параллельно
-    items, count = await asyncio.gather(
-        session_service.fetch_sessions(SESSION_TYPES["PROCESSING_MINE"], agent_id=agent_id),
-        session_service.count_sessions(SESSION_TYPES["PROCESSING_MINE"], agent_id=agent_id)
-    )
-    logger.debug(f"Найдено {count} моих активных сессий")
+    items, count, page_text, kb = await _fetch_sessions_page(services, SESSION_TYPES["PROCESSING_MINE"], agent_id, **page_args)
+    logger.debug("Найдено %s моих активных сессий", count)
     
     if not items:
-        logger.info(f"Нет активных сессий у агента {agent_id}")
+        logger.info("Нет активных сессий у агента %s", agent_id)
         await callback_query.message.edit_text(texts.NO_ONE_ASSIGNED_TO_ADMIN, reply_markup=back.keyboard())
         return
     
@@ -146,25 +207,20 @@ async def _handle_processing_mine(callback_query: CallbackQuery, services: Servi
         (texts.MINE_ASSIGNED_1, texts.MINE_ASSIGNED_2_3_4, texts.MINE_ASSIGNED_OTHER),
         (texts.OTHER_ASSIGNED_1, texts.OTHER_ASSIGNED_2_3_4, texts.OTHER_ASSIGNED_OTHER)
     )
-    await callback_query.message.edit_text(text=text, reply_markup=waiting_keyboard.kb(items))
+    await callback_query.message.edit_text(text=text + page_text, reply_markup=kb)
     await callback_query.answer()
-    logger.info(f"Список моих активных сессий показан агенту {agent_id}")
+    logger.info("Список моих активных сессий показан агенту %s", agent_id)
 
 
-async def _handle_processing(callback_query: CallbackQuery, services: ServiceContainer, agent_id: int) -> None:
+async def _handle_processing(callback_query: CallbackQuery, services: ServiceContainer, agent_id: int, **page_args) -> None:
     """Обрабатывает запрос активных сессий других агентов"""
-    logger.info(f"Запрос активных сессий других агентов от агента {agent_id}")
+    logger.info("Запрос активных сессий других агентов от агента %s", agent_id)
     
-    session_service = services.session_service
-    # Выполняем запросы параллельно
-    items, count = await asyncio.gather(
-        session_service.fetch_sessions(SESSION_TYPES["PROCESSING"], agent_id=agent_id),
-        session_service.count_sessions(SESSION_TYPES["PROCESSING"], agent_id=agent_id)
-    )
-    logger.debug(f"Найдено {count} активных сессий других агентов")
+    items, count, page_text, kb = await _fetch_sessions_page(services, SESSION_TYPES["PROCESSING"], agent_id, **page_args)
+    logger.debug("Найдено %s активных сессий других агентов", count)
     
     if not items:
-        logger.info(f"Нет активных сессий других агентов для агента {agent_id}")
+        logger.info("Нет активных сессий других агентов для агента %s", agent_id)
         await callback_query.message.edit_text(texts.NO_ONE_ASSGINED, reply_markup=back.keyboard())
         return
     
@@ -173,14 +229,14 @@ async def _handle_processing(callback_query: CallbackQuery, services: ServiceCon
         (texts.OTHER_ASSIGNED_1, texts.OTHER_ASSIGNED_2_3_4, texts.OTHER_ASSIGNED_OTHER),
         (texts.OTHER_ASSIGNED_1, texts.OTHER_ASSIGNED_2_3_4, texts.OTHER_ASSIGNED_OTHER)
     )
-    await callback_query.message.edit_text(text=text, reply_markup=waiting_keyboard.kb(items))
+    await callback_query.message.edit_text(text=text + page_text, reply_markup=kb)
     await callback_query.answer()
-    logger.info(f"Список активных сессий других агентов показан агенту {agent_id}")
+    logger.info("Список активных сессий других агентов показан агенту %s", agent_id)
 
 
-async def _handle_done(callback_query: CallbackQuery, services: ServiceContainer, agent_id: int) -> None:
+async def _handle_done(callback_query: CallbackQuery, services: ServiceContainer, agent_id: int, **page_args) -> None:
     """Обрабатывает запрос закрытых чатов"""
-    logger.info(f"Запрос закрытых чатов от агента {agent_id}")
-    await _render_done_page(callback_query, services, page=1, only_mine=False, agent_id=agent_id)
+    logger.info("Запрос закрытых чатов от агента %s", agent_id)
+    await _render_done_page(callback_query, services, only_mine=False, agent_id=agent_id)
     await callback_query.answer()
-    logger.info(f"Список закрытых чатов показан агенту {agent_id}")
\ No newline at end of file
+    logger.info("Список закрытых чатов показан агенту %s", agent_id)
@@ -8,6 +8,7 @@ from keyboards.messages_keyboard import session_view
 from services import ServiceContainer
 from states import AdminChat
 from utils import render_messages
+from utils.attachments import send_attachment, send_attachments
 from utils.logger import get_logger
 
 logger = get_logger(__name__)
@@ -18,36 +19,38 @@ logger = get_logger(__name__)
 async def open_session_view(callback_query: CallbackQuery, is_admin: bool, services: ServiceContainer, state: FSMContext):
     """Открывает просмотр сессии"""
     agent_id = callback_query.from_user.id
-    logger.info(f"Открытие просмотра сессии агентом {agent_id}")
+    logger.info("Открытие просмотра сессии агентом %s", agent_id)
     
     if not is_admin:
-        logger.warning(f"Не-админ {agent_id} пытается открыть просмотр сессии")
+        logger.warning("Не-админ %s пытается открыть просмотр сессии", agent_id)
         return
 
     session_id = callback_query.data.removeprefix("session:")
-    logger.debug(f"ID сессии для просмотра: {session_id}")
+    logger.debug("ID сессии для просмотра: %s", session_id)
     
     session_service = services.session_service
     message_service = services.message_service
     
     info = await session_service.get_session_info(session_id)
     if not info:
-        logger.error(f"Сессия {session_id} не найдена для агента {agent_id}")
+        logger.error("Сессия %s не найдена для агента %s", session_id, agent_id)
         return await callback_query.message.edit_text(texts.SESSION_NOT_FOUND, reply_markup=back.keyboard())
 
     # Получаем сообщения и рендерим текст
-    msgs = await message_service.get_session_messages(info["tgid"], session_id)
-    text, attachments = render_messages.render_session_text(info["username"], info["assigned_agent"], msgs)
-    logger.debug(f"Рендеринг сессии: {len(msgs)} сообщений, {len(attachments)} вложений")
+    transcript = await message_service.get_session_transcript(info["tgid"], session_id)
+    page = transcript.render(info["username"], info["assigned_agent"])
+    logger.debug("Рендеринг сессии: %s сообщений, %s вложений", len(transcript.entries), len(page.attachments))
 
     # Обновляем сообщение
     await callback_query.message.edit_text(
-        text,
+        page.text,
         reply_markup=session_view.session_view_kb(
             session_id, 
             taken=bool(info["assigned_agent"]), 
             opened=bool(await state.get_state()), 
-            attachments=attachments
+            attachments=page.attachments,
+            older=page.older,
+            newer=page.newer,
         ),
         disable_web_page_preview=True
     )
@@ -59,51 +62,46 @@ async def open_session_view(callback_query: CallbackQuery, is_admin: bool, servi
         "session_id": session_id,
     })
     await callback_query.answer()
-    logger.info(f"Просмотр сессии {session_id} открыт агентом {agent_id}")
+    logger.info("Просмотр сессии %s открыт агентом %s", session_id, agent_id)
 
 async def take_session(callback_query: CallbackQuery, is_admin: bool, services: ServiceContainer, state: FSMContext) -> None:
     agent_id = callback_query.from_user.id
-    logger.info(f"Попытка взять сессию агентом {agent_id}")
+    logger.info("Попытка взять сессию агентом %s", agent_id)
     
     if not is_admin:
-        logger.warning(f"Не-админ {agent_id} пытается взять сессию")
+        logger.warning("Не-админ %s пытается взять сессию", agent_id)
         return
     
     session_id = callback_query.data.removeprefix("take:")
-    logger.debug(f"ID сессии для взятия: {session_id}")
+    logger.debug("ID сессии для взятия: %s", session_id)
 
     session_service = services.session_service
-    message_service = services.message_service
     
-    ok = await session_service.assign_session(session_id, agent_id)
-    if not ok:
-        logger.warning(f"Попытка взять уже занятую сессию {session_id} оператором {agent_id}")
+    # Назначение, заголовок и история - одной операцией
+    claim = await session_service.claim_session(session_id, agent_id)
+    if claim is None:
+        logger.warning("Попытка взять уже занятую сессию %s оператором %s", session_id, agent_id)
         return await callback_query.answer(texts.TAKEN_SESSION, show_alert=True)
+    info, transcript = claim
     
-    logger.info(f"Оператор {agent_id} взял сессию {session_id}")
+    logger.info("Оператор %s взял сессию %s", agent_id, session_id)
     
-    logger.debug(f"Установка состояния AdminChat.active для агента {agent_id}")
+    logger.debug("Установка состояния AdminChat.active для агента %s", agent_id)
     await state.set_state(AdminChat.active)
     await state.update_data(session_id=session_id)
 
-    info = await session_service.get_session_info(session_id)
-    if not info:
-        logger.error(f"Сессия {session_id} не найдена после взятия агентом {agent_id}")
-        await state.clear()
-        return await callback_query.answer(texts.SESSION_NOT_FOUND, show_alert=True)
-    
-    logger.info(f"Получение сообщений сессии {session_id} для пользователя {info['tgid']}")
-    msgs = await message_service.get_session_messages(info["tgid"], session_id)
-    text, attachments = render_messages.render_session_text(info["username"], info["assigned_agent"], msgs)
-    logger.debug(f"Рендеринг сессии: {len(msgs)} сообщений, {len(attachments)} вложений")
+    page = transcript.render(info["username"], info["assigned_agent"])
+    logger.debug("Рендеринг сессии: %s сообщений, %s вложений", len(transcript.entries), len(page.attachments))
 
     await callback_query.message.edit_text(
-        text,
+        page.text,
         reply_markup=session_view.session_view_kb(
             session_id, 
             taken=bool(info["assigned_agent"]), 
             opened=bool(await state.get_state()), 
-            attachments=attachments
+            attachments=page.attachments,
+            older=page.older,
+            newer=page.newer,
         ),
         disable_web_page_preview=True
     )
@@ -115,19 +113,19 @@ async def take_session(callback_query: CallbackQuery, is_admin: bool, services:
         "session_id": session_id,
     })
     await callback_query.answer(texts.CHAT_ASSIGNED_TO_YOU)
-    logger.info(f"Сессия {session_id} успешно взята агентом {agent_id}")
+    logger.info("Сессия %s успешно взята агентом %s", session_id, agent_id)
 
 async def open_chat(callback_query: CallbackQuery, is_admin: bool, services: ServiceContainer, state: FSMContext) -> None:
     """Открывает чат для работы"""
     agent_id = callback_query.from_user.id
-    logger.info(f"Открытие чата агентом {agent_id}")
+    logger.info("Открытие чата агентом %s", agent_id)
     
     if not is_admin:
-        logger.warning(f"Не-админ {agent_id} пытается открыть чат")
+        logger.warning("Не-админ %s пытается открыть чат", agent_id)
         return
     
     session_id = callback_query.data.removeprefix("open:")
-    logger.debug(f"ID сессии для открытия чата: {session_id}")
+    logger.debug("ID сессии для открытия чата: %s", session_id)
     
     # Устанавливаем состояние
     await state.set_state(AdminChat.active)
@@ -139,23 +137,25 @@ async def open_chat(callback_query: CallbackQuery, is_admin: bool, services: Ser
     # Получаем информацию о сессии
     info = await session_service.get_session_info(session_id)
     if not info:
-        logger.error(f"Сессия {session_id} не найдена для открытия чата агентом {agent_id}")
+        logger.error("Сессия %s не найдена для открытия чата агентом %s", session_id, agent_id)
         await state.clear()
         return await callback_query.answer(texts.SESSION_NOT_FOUND, show_alert=True)
     
     # Получаем сообщения и рендерим
-    msgs = await message_service.get_session_messages(info["tgid"], session_id)
-    text, attachments = render_messages.render_session_text(info["username"], info["assigned_agent"], msgs)
-    logger.debug(f"Рендеринг сессии: {len(msgs)} сообщений, {len(attachments)} вложений")
+    transcript = await message_service.get_session_transcript(info["tgid"], session_id)
+    page = transcript.render(info["username"], info["assigned_agent"])
+    logger.debug("Рендеринг сессии: %s сообщений, %s вложений", len(transcript.entries), len(page.attachments))
 
     # Обновляем сообщение
     await callback_query.message.edit_text(
-        text,
+        page.text,
         reply_markup=session_view.session_view_kb(
             session_id, 
             taken=bool(info["assigned_agent"]), 
             opened=bool(await state.get_state()), 
-            attachments=attachments
+            attachments=page.attachments,
+            older=page.older,
+            newer=page.newer,
         ),
         disable_web_page_preview=True
     )
@@ -167,89 +167,158 @@ async def open_chat(callback_query: CallbackQuery, is_admin: bool, services: Ser
         "session_id": session_id,
     })
     await callback_query.answer()
-    logger.info(f"Чат сессии {session_id} открыт агентом {agent_id}")
+    logger.info("Чат сессии %s открыт агентом %s", session_id, agent_id)
+    
+async def history_page(callback_query: CallbackQuery, is_admin: bool, services: ServiceContainer, state: FSMContext) -> None:
+    """Листает историю сессии в панели"""
+    agent_id = callback_query.from_user.id
+    logger.info("Листание истории сессии агентом %s", agent_id)
+    
+    if not is_admin:
+        logger.warning("Не-админ %s пытается листать историю сессии", agent_id)
+        return
+    
+    _, session_id, direction, ts_str, mid_str = callback_query.data.split(":")
+    older = direction == "o"
+    created_at, message_id = render_messages.decode_cursor(ts_str, mid_str)
+    logger.debug("Параметры листания: session_id=%s, older=%s, cursor=(%s, %s)", session_id, older, created_at, message_id)
     
+    session_service = services.session_service
+    message_service = services.message_service
+    
+    info = await session_service.get_session_info(session_id)
+    if not info:
+        logger.error("Сессия %s не найдена для листания агентом %s", session_id, agent_id)
+        return await callback_query.answer(texts.SESSION_NOT_FOUND, show_alert=True)
+    
+    transcript = await message_service.get_transcript_page(info["tgid"], session_id, older, created_at, message_id)
+    history = transcript.has_newer and bool(transcript.entries)
+    if not history:
+        # Долистали до конца - возвращаемся к живому окну последних сообщений
+        transcript = await message_service.get_session_transcript(info["tgid"], session_id)
+    
+    page = transcript.render(info["username"], info["assigned_agent"])
+    logger.debug("Рендеринг страницы истории: %s сообщений, %s вложений", len(transcript.entries), len(page.attachments))
+    
+    await callback_query.message.edit_text(
+        page.text,
+        reply_markup=session_view.session_view_kb(
+            session_id,
+            taken=bool(info["assigned_agent"]),
+            opened=bool(await state.get_state()),
+            attachments=page.attachments,
+            older=page.older,
+            newer=page.newer,
+        ),
+        disable_web_page_preview=True
+    )
+    
+    # Пока оператор смотрит старые сообщения, живые обновления панели не применяются
+    await state.update_data(panel_msg={
+        "chat_id": callback_query.message.chat.id,
+        "message_id": callback_query.message.message_id,
+        "session_id": session_id,
+        "history": history,
+    })
+    await callback_query.answer()
+    logger.info("Страница истории сессии %s показана агенту %s", session_id, agent_id)
+
 async def close_session(callback_query: CallbackQuery, is_admin: bool, services: ServiceContainer, state: FSMContext) -> None:
     """Закрывает сессию"""
     agent_id = callback_query.from_user.id
-    logger.info(f"Попытка закрыть сессию агентом {agent_id}")
+    logger.info("Попытка закрыть сессию агентом %s", agent_id)
     
     if not is_admin:
-        logger.warning(f"Не-админ {agent_id} пытается закрыть сессию")
+        logger.warning("Не-админ %s пытается закрыть сессию", agent_id)
         return
     
     session_id = callback_query.data.removeprefix("close:")
-    logger.debug(f"ID сессии для закрытия: {session_id}")
+    logger.debug("ID сессии для закрытия: %s", session_id)
     
     session_service = services.session_service
     
     # Закрываем сессию
     ok = await session_service.close_session(session_id, agent_id)
     if not ok:
-        logger.warning(f"Не удалось закрыть сессию {session_id} оператором {agent_id}")
+        logger.warning("Не удалось закрыть сессию %s оператором %s", session_id, agent_id)
         return await callback_query.answer(texts.FAILED_TO_CLOSE_SESSION, show_alert=True)
     
-    logger.info(f"Оператор {agent_id} закрыл сессию {session_id}")
+    logger.info("Оператор %s закрыл сессию %s", agent_id, session_id)
     
     # Очищаем состояние и возвращаемся на главную
     await state.clear()
     await start.welcome(callback_query.message, state, is_admin, services, from_callback=True)
     await callback_query.answer(texts.SESSION_CLOSED_SUCCESSFUL)
-    logger.info(f"Сессия {session_id} успешно закрыта агентом {agent_id}")
+    logger.info("Сессия %s успешно закрыта агентом %s", session_id, agent_id)
 
 async def open_attachment(callback_query: CallbackQuery, services: ServiceContainer) -> None:
     """Открывает вложение из сообщения"""
     user_id = callback_query.from_user.id
-    logger.info(f"Открытие вложения пользователем {user_id}")
+    logger.info("Открытие вложения пользователем %s", user_id)
     
     _, sid_str, mid_str = callback_query.data.split(":")
     mid = int(mid_str)
-    logger.debug(f"Параметры вложения: session_id={sid_str}, message_id={mid}")
+    logger.debug("Параметры вложения: session_id=%s, message_id=%s", sid_str, mid)
 
     message_service = services.message_service
     
     # Получаем информацию о файле
-    file_id, sess_id_of_msg = await message_service.get_message_file(mid)
+    file_id, content_type, sess_id_of_msg = await message_service.get_message_file(mid)
     if not file_id or int(sid_str) != int(sess_id_of_msg or 0):
-        logger.warning(f"Вложение {mid} не найдено или не принадлежит сессии {sid_str}")
+        logger.warning("Вложение %s не найдено или не принадлежит сессии %s", mid, sid_str)
         return await callback_query.answer(texts.ATTACHMENT_NOT_FOUND, show_alert=True)
     
-    # Отправляем вложение
-    await _send_attachment(callback_query, file_id, mid, user_id)
+    # Тип известен - вложение уходит одним запросом нужным методом
+    try:
+        await send_attachment(
+            callback_query.bot, callback_query.message.chat.id, file_id, content_type, reply_markup=att_kb.attclose(mid)
+        )
+        logger.info("Вложение %s (%s) отправлено пользователю %s", mid, content_type or "без типа", user_id)
+    except Exception as e:
+        logger.error("Не удалось отправить вложение %s: %s", mid, e)
     await callback_query.answer()
 
 
-async def _send_attachment(callback_query: CallbackQuery, file_id: str, mid: int, user_id: int):
-    """Отправляет вложение пользователю"""
-    logger.debug(f"Отправка вложения {file_id} пользователю {user_id}")
+async def open_all_attachments(callback_query: CallbackQuery, is_admin: bool, services: ServiceContainer) -> None:
+    """Отправляет все вложения сессии альбомами"""
+    agent_id = callback_query.from_user.id
     
-    # Пробуем отправить как фото
-    try:
-        await callback_query.message.answer_photo(file_id, reply_markup=att_kb.attclose(mid))
-        logger.info(f"Фото вложение {mid} отправлено пользователю {user_id}")
+    if not is_admin:
+        logger.warning("Не-админ %s пытается открыть вложения сессии", agent_id)
         return
-    except Exception as e:
-        logger.debug(f"Не удалось отправить как фото, пробуем как документ: {e}")
     
-    # Пробуем отправить как документ
+    session_id = int(callback_query.data.removeprefix("attall:"))
+    logger.info("Открытие всех вложений сессии %s агентом %s", session_id, agent_id)
+    
+    info = await services.session_service.get_session_info(session_id)
+    if not info:
+        logger.warning("Сессия %s не найдена", session_id)
+        return await callback_query.answer(texts.SESSION_NOT_FOUND, show_alert=True)
+    
+    attachments = await services.message_service.get_session_attachments(info["tgid"], session_id)
+    if not attachments:
+        return await callback_query.answer(texts.NO_ATTACHMENTS, show_alert=True)
+    
     try:
-        await callback_query.message.answer_document(file_id, reply_markup=att_kb.attclose(mid))
-        logger.info(f"Документ вложение {mid} отправлено пользователю {user_id}")
-    except Exception as e2:
-        logger.error(f"Не удалось отправить вложение {mid}: {e2}")
+        requests = await send_attachments(callback_query.bot, callback_query.message.chat.id, attachments)
+        logger.info("Вложения сессии %s (%s) отправлены агенту %s за %s запросов", session_id, len(attachments), agent_id, requests)
+    except Exception as e:
+        logger.error("Не удалось отправить вложения сессии %s: %s", session_id, e)
+    await callback_query.answer()
+
 
 async def close_attachment(callback_query: CallbackQuery, is_admin: bool) -> None:
     """Закрывает вложение"""
     agent_id = callback_query.from_user.id
-    logger.info(f"Закрытие вложения агентом {agent_id}")
+    logger.info("Закрытие вложения агентом %s", agent_id)
     
     if not is_admin:
-        logger.warning(f"Не-админ {agent_id} пытается закрыть вложение")
+        logger.warning("Не-админ %s пытается закрыть вложение", agent_id)
         return
     
     try:
         await callback_query.message.delete()
-        logger.info(f"Вложение закрыто агентом {agent_id}")
+        logger.info("Вложение закрыто агентом %s", agent_id)
     except Exception as e:
-        logger.warning(f"Не удалось удалить сообщение с вложением: {e}")
+        logger.warning("Не удалось удалить сообщение с вложением: %s", e)
     await callback_query.answer()
\ No newline at end of file
@@ -8,132 +8,89 @@ from aiogram.utils.keyboard import InlineKeyboardBuilder
 import texts
 from config import get_admin_ids
 from constants import MESSAGE_DIRECTIONS
-from keyboards.messages_keyboard import session_view
-from services import ServiceContainer
-from utils import render_messages
+from services import CommitOutcomeUnknown, ServiceContainer
+from utils.attachments import extract_attachment
 from utils.logger import get_logger
+from utils.post_send import PostSendPipeline
+from utils.refresh import refresh_session_view
 
 logger = get_logger(__name__)
 
-async def admin_reply(message: Message, state: FSMContext, services: ServiceContainer) -> None:
+async def admin_reply(message: Message, state: FSMContext, services: ServiceContainer, post_send: PostSendPipeline) -> None:
     """Обрабатывает ответ админа пользователю"""
     admin_id = message.from_user.id
-    logger.info(f"Обработка ответа админа {admin_id}")
+    logger.info("Обработка ответа админа %s", admin_id)
     
     data = await state.get_data()
     session_id = data.get("session_id")
-    logger.debug(f"Данные состояния: {data}")
+    logger.debug("Данные состояния: %s", data)
     
     if not session_id:
-        logger.warning(f"Админ {admin_id} пытается ответить без активной сессии")
+        logger.warning("Админ %s пытается ответить без активной сессии", admin_id)
         await state.clear()
         return await message.answer(texts.SESSION_NOT_FOUND)
     
     # Обработка команды /start
     if message.text and message.text.strip() == "/start":
-        logger.info(f"Админ {admin_id} отправил /start, удаляем сообщение")
+        logger.info("Админ %s отправил /start, удаляем сообщение", admin_id)
         try:
             await message.delete()
         except Exception as e:
-            logger.warning(f"Не удалось удалить сообщение /start: {e}")
+            logger.warning("Не удалось удалить сообщение /start: %s", e)
         return
     
-    # Получаем сервисы
-    session_service = services.session_service
-    message_service = services.message_service
-    
-    logger.info(f"Получение информации о сессии {session_id}")
-    view = await session_service.get_session_info(session_id)
+    logger.info("Получение информации о сессии %s", session_id)
+    view = await services.session_service.get_session_info(session_id)
     if not view or not view["tgid"]:
-        logger.error(f"Сессия {session_id} не найдена или не имеет tgid")
+        logger.error("Сессия %s не найдена или не имеет tgid", session_id)
         await message.answer(texts.CLIENT_NOT_FOUND)
         return
     
     user_id = view["tgid"]
     sent_text = message.text or message.caption
-    file_id = _extract_file_id(message)
+    attachment = extract_attachment(message)
     
-    logger.info(f"Отправка сообщения от админа {admin_id} пользователю {user_id} в сессии {session_id}")
-    logger.debug(f"Текст сообщения: {sent_text}")
+    logger.info("Отправка сообщения от админа %s пользователю %s в сессии %s", admin_id, user_id, session_id)
+    logger.debug("Текст сообщения: %s", sent_text)
 
-    # Отправляем сообщение пользователю
+    # Оператор ждёт только доставки клиенту, остальное выполняется в фоне
     try:
         await message.send_copy(chat_id=user_id)
-        logger.info(f"Сообщение успешно отправлено пользователю {user_id}")
+        logger.info("Сообщение успешно отправлено пользователю %s", user_id)
     except Exception as e:
-        logger.error(f"Ошибка отправки сообщения пользователю {user_id}: {e}")
+        logger.error("Ошибка отправки сообщения пользователю %s: %s", user_id, e)
         return await message.answer(texts.FAILED_TO_SEND_MESSAGE.format(exception=e))
     
-    # Логируем сообщение в БД через сервис
-    logger.info(f"Логирование сообщения в БД: user_id={user_id}, session_id={session_id}")
-    await message_service.log_agent_message(
-        tgid=user_id,
-        session_id=session_id,
-        text=sent_text,
-        file_id=file_id
-    )
-    logger.info(f"Сообщение залогировано в БД")
-
-    # Обновляем панель если есть
-    await _update_session_panel(message, state, services, session_id, user_id, view)
+    session_id = int(session_id)
     
-    # Удаляем сообщение админа
-    logger.debug(f"Удаление сообщения админа {admin_id}")
-    await message.delete()
-    logger.info(f"Обработка ответа админа {admin_id} завершена")
-
-
-def _extract_file_id(message: Message) -> str | None:
-    """Извлекает file_id из сообщения"""
-    if message.photo:
-        file_id = message.photo[-1].file_id
-        logger.debug(f"Обнаружено фото с file_id: {file_id}")
-        return file_id
-    elif message.document:
-        file_id = message.document.file_id
-        logger.debug(f"Обнаружен документ с file_id: {file_id}")
-        return file_id
-    elif message.voice:
-        file_id = message.voice.file_id
-        logger.debug(f"Обнаружено голосовое сообщение с file_id: {file_id}")
-        return file_id
-    return None
+    async def report_not_saved(error: Exception) -> None:
+        unconfirmed = isinstance(error, CommitOutcomeUnknown)
+        await message.answer(texts.REPLY_SAVE_UNCONFIRMED if unconfirmed else texts.REPLY_NOT_SAVED)
+    
+    # Запись и панель одной сессии идут по порядку: панель показывает уже записанный ответ
+    post_send.submit(
+        "log_reply",
+        lambda: services.message_service.log_agent_message(
+            tgid=user_id,
+            session_id=session_id,
+            text=sent_text,
+            attachment=attachment
+        ),
+        key=session_id,
+        on_failure=report_not_saved,
+    )
+    post_send.submit("refresh_panel", lambda: _refresh_panel(message, state, services), key=session_id)
+    post_send.submit("delete_reply", message.delete)
+    logger.info("Обработка ответа админа %s завершена, запись и панель обновятся в фоне", admin_id)
 
 
-async def _update_session_panel(message: Message, state: FSMContext, services: ServiceContainer, session_id: int, user_id: int, view: dict) -> None:
-    """Обновляет панель сессии"""
+async def _refresh_panel(message: Message, state: FSMContext, services: ServiceContainer) -> None:
+    """Показывает ответ на панели сессии оператора"""
     data = await state.get_data()
     panel = data.get("panel_msg")
+    if panel and panel.get("history"):
+        # После ответа оператора панель снова показывает живое окно
+        await state.update_data(panel_msg={**panel, "history": False})
     
-    if not panel:
-        logger.debug(f"Панель для сессии {session_id} не найдена")
-        return
-    
-    # Получаем сервисы
-    session_service = services.session_service
-    message_service = services.message_service
-    
-    logger.info(f"Обновление панели сессии {session_id}")
-    info = await session_service.get_session_info(int(session_id))
-    msgs = await message_service.get_session_messages(user_id, int(session_id))
-    text, attachments = render_messages.render_session_text(
-        info["username"], info["assigned_agent"], msgs
-    )
-    logger.debug(f"Рендеринг панели: {len(msgs)} сообщений, {len(attachments)} вложений")
-    
-    try:
-        await message.bot.edit_message_text(
-            chat_id=panel["chat_id"],
-            message_id=panel["message_id"],
-            text=text,
-            reply_markup=session_view.session_view_kb(
-                session_id,
-                taken=bool(info["assigned_agent"]),
-                opened=bool(await state.get_state()),
-                attachments=attachments,
-            ),
-            disable_web_page_preview=True,
-        )
-        logger.info(f"Панель сессии {session_id} обновлена")
-    except Exception as e:
-        logger.warning(f"Не удалось обновить панель сессии {session_id}: {e}")
+    # Состояние перечитывается: пока операция ждала, оператор мог закрыть сессию
+    await refresh_session_view(message.bot, state.storage, services, message.from_user.id, state=state, raise_errors=True)
@@ -0,0 +1,57 @@
+import html
+
+import texts
+
+from aiogram.enums import ParseMode
+from aiogram.filters import CommandObject
+from aiogram.types import Message
+
+from constants import PANEL_TEXT_LIMIT, QUERY_STATS_TOP, QUERY_STATS_TOP_MAX
+from utils.logger import get_logger
+from utils.query_stats import QUERY_STATS, StatementSummary
+
+logger = get_logger(__name__)
+
+_SQL_WIDTH = 80
+
+
+def _format_table(rows: list[StatementSummary]) -> str:
+    """Форматирует сводки запросов моноширинной таблицей; время в миллисекундах"""
+    lines = [f"{'n':>7} {'всего':>9} {'p50':>7} {'p95':>7} {'max':>7} {'строк':>8}"]
+    for row in rows:
+        sql = row.sql if len(row.sql) <= _SQL_WIDTH else row.sql[:_SQL_WIDTH - 1] + "…"
+        lines.append(
+            f"{row.count:>7} {row.total * 1000:>9.1f} {row.p50 * 1000:>7.1f} "
+            f"{row.p95 * 1000:>7.1f} {row.max * 1000:>7.1f} {row.rows:>8}"
+        )
+        lines.append(f"  {sql}")
+    return "\n".join(lines)
+
+
+async def query_stats(message: Message, is_admin: bool, command: CommandObject) -> None:
+    """Отправляет админу таблицу запросов с наибольшим суммарным временем: /querystats [N]"""
+    tgid = message.from_user.id
+    if not is_admin:
+        logger.warning("Не-админ %s запросил статистику запросов", tgid)
+        return
+
+    limit = QUERY_STATS_TOP
+    if command.args and command.args.strip().isdigit():
+        limit = max(1, min(int(command.args.strip()), QUERY_STATS_TOP_MAX))
+    logger.info("Админ %s запросил статистику запросов, топ-%s", tgid, limit)
+
+    rows = QUERY_STATS.top(limit)
+    if not rows:
+        await message.answer(texts.QUERY_STATS_EMPTY)
+        return
+
+    # Убираем строки с конца, пока таблица не поместится в одно сообщение
+    while True:
+        text = (
+            f"{texts.QUERY_STATS_TITLE.format(count=len(rows))}\n"
+            f"<pre>{html.escape(_format_table(rows))}</pre>"
+        )
+        if len(text) <= PANEL_TEXT_LIMIT or len(rows) == 1:
+            break
+        rows = rows[:-1]
+    await message.answer(text[:PANEL_TEXT_LIMIT], parse_mode=ParseMode.HTML)
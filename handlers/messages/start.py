@@ -7,57 +7,72 @@ from aiogram.types import Message
 from keyboards import admin_keyboard
 from services import ServiceContainer
 from utils.logger import get_logger
+from utils.post_send import PostSendPipeline
 
 logger = get_logger(__name__)
 
 
-async def welcome(message: Message, state: FSMContext, is_admin: bool, services: ServiceContainer, from_callback: bool = False) -> None:
+async def welcome(
+    message: Message,
+    state: FSMContext,
+    is_admin: bool,
+    services: ServiceContainer,
+    from_callback: bool = False,
+    post_send: PostSendPipeline | None = None,
+) -> None:
     tgid = message.from_user.id
     username = message.from_user.username
-    logger.info(f"Обработка команды /start: tgid={tgid}, username=@{username}, is_admin={is_admin}, from_callback={from_callback}")
+    logger.info("Обработка команды /start: tgid=%s, username=@%s, is_admin=%s, from_callback=%s", tgid, username, is_admin, from_callback)
     
     if is_admin:
-        logger.info(f"Админ {tgid} запустил бота")
+        logger.info("Админ %s запустил бота", tgid)
         first_name = message.chat.first_name or message.chat.title
-        logger.debug(f"Имя админа: {first_name}")
+        logger.debug("Имя админа: %s", first_name)
         
         if first_name == "Father":
             text = texts.WELCOME_TEXT_ONYX
-            logger.info(f"Специальное приветствие для Father")
+            logger.info("Специальное приветствие для Father")
         else:
             text = texts.WELCOME_TEXT_ADMIN.format(first_name=first_name)
-            logger.info(f"Обычное приветствие для админа {first_name}")
+            logger.info("Обычное приветствие для админа %s", first_name)
             
         if from_callback:
-            logger.debug(f"Редактирование сообщения для админа {tgid}")
+            logger.debug("Редактирование сообщения для админа %s", tgid)
             await message.edit_text(text, reply_markup=admin_keyboard.keyboard())
         else:
-            logger.debug(f"Отправка нового сообщения админу {tgid}")
+            logger.debug("Отправка нового сообщения админу %s", tgid)
             await message.answer(text, reply_markup=admin_keyboard.keyboard())
-        logger.info(f"Приветствие админу {tgid} отправлено")
+        logger.info("Приветствие админу %s отправлено", tgid)
     else:
-        logger.info(f"Пользователь {tgid} запустил бота")
+        logger.info("Пользователь %s запустил бота", tgid)
         
         # Используем сервисы вместо прямых вызовов reqs
-        user_service = services.user_service
         session_service = services.session_service
         notification_service = services.notification_service
         
-        session_opened = await user_service.has_open_session(tgid)
-        logger.debug(f"Проверка открытой сессии для {tgid}: {session_opened}")
         text = texts.WELCOME_TEXT_USER
         
-        if session_opened:
-            logger.info(f"У клиента {tgid} уже была открыта сессия")
+        # Открытая сессия находится или создаётся одним запросом
+        session_id, created = await session_service.ensure_open_session(tgid, username)
+        if not created:
+            logger.info("У клиента %s уже была открыта сессия %s", tgid, session_id)
         else:
-            logger.info(f"Создание новой сессии для пользователя {tgid}")
-            session_id = await session_service.ensure_open_session(tgid)
-            logger.info(f"Создана новая сессия {session_id} для пользователя {tgid}")
-            
-            # Отправляем уведомление админам через сервис
-            await notification_service.notify_new_session(tgid, username, session_id)
-            logger.info(f"Уведомление админам о новой сессии {session_id} отправлено")
+            logger.info("Создана новая сессия %s для пользователя %s", session_id, tgid)
         
-        logger.debug(f"Отправка приветствия пользователю {tgid}")
+        logger.debug("Отправка приветствия пользователю %s", tgid)
         await message.answer(text, parse_mode=ParseMode.MARKDOWN_V2)
-        logger.info(f"Приветствие пользователю {tgid} отправлено")
+        logger.info("Приветствие пользователю %s отправлено", tgid)
+        
+        if created:
+            # Уведомления админам уходят в фоне после фиксации сессии
+            notification_service.schedule_new_session_notice(post_send, tgid, username, session_id)
+            logger.info("Уведомление админам о новой сессии %s поставлено в очередь", session_id)
+
+
+async def client_message(message: Message) -> None:
+    """
+    Обычные сообщения клиентов. Запись в БД и обновление панели оператора
+    выполняют LogMiddleware и DbAdd; внутренние middleware вызываются только
+    для сообщений, у которых нашёлся обработчик, поэтому он нужен, даже пустой
+    """
+    logger.debug("Сообщение клиента %s обработано middleware", message.from_user.id)
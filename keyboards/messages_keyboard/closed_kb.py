@@ -1,13 +1,15 @@
 from aiogram.types import InlineKeyboardButton
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 
-def closed_list_kb(items, page: int, total_pages: int, only_mine: bool):
+def closed_list_kb(items, page: int, only_mine: bool, newer: str | None = None, older: str | None = None):
     """
     items: [(session_id, tgid, username, closed_at), ...]
+    newer/older: курсоры (closed_at, id) первой и последней строки страницы,
+                 если в эту сторону есть ещё сессии
     callback_data:
       - на карточку:     session:{session_id}
-      - пагинация:       done:list:{page}:{mine}   (mine=0/1)
-      - toggle:   done:toggle:{page}:{mine}
+      - пагинация:       done:list:{mine}:{page}:{n|o}:{cursor}   (mine=0/1)
+      - toggle:   done:toggle:{mine}
     """
     mine_flag = 1 if only_mine else 0
     b = InlineKeyboardBuilder()
@@ -18,13 +20,13 @@ def closed_list_kb(items, page: int, total_pages: int, only_mine: bool):
         b.row(InlineKeyboardButton(text=title + suffix, callback_data=f"session:{sid}"))
 
     title_toggle = "Мои" if not only_mine else "Все"
-    b.row(InlineKeyboardButton(text=f"Показать: {title_toggle}", callback_data=f"done:toggle:{page}:{mine_flag}"))
+    b.row(InlineKeyboardButton(text=f"Показать: {title_toggle}", callback_data=f"done:toggle:{mine_flag}"))
 
     nav = []
-    if page > 1:
-        nav.append(InlineKeyboardButton(text="‹ Пред", callback_data=f"done:list:{page-1}:{mine_flag}"))
-    if page < total_pages:
-        nav.append(InlineKeyboardButton(text="След ›", callback_data=f"done:list:{page+1}:{mine_flag}"))
+    if newer:
+        nav.append(InlineKeyboardButton(text="‹ Пред", callback_data=f"done:list:{mine_flag}:{page-1}:n:{newer}"))
+    if older:
+        nav.append(InlineKeyboardButton(text="След ›", callback_data=f"done:list:{mine_flag}:{page+1}:o:{older}"))
     if nav:
         b.row(*nav)
 
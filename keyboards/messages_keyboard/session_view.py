@@ -3,9 +3,29 @@ import texts
 from aiogram.types import InlineKeyboardButton
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 
-def session_view_kb(session_id: int, taken: bool, opened: bool | None, attachments: list[tuple[int, int]] | None = None):
+def session_view_kb(
+    session_id: int,
+    taken: bool,
+    opened: bool | None,
+    attachments: list[tuple[int, int]] | None = None,
+    older: str | None = None,
+    newer: str | None = None,
+):
     builder = InlineKeyboardBuilder()
     
+    # Листание истории по курсору (created_at, id)
+    history_btns: list[InlineKeyboardButton] = []
+    if older:
+        history_btns.append(
+            InlineKeyboardButton(text=texts.OLDER_MESSAGES, callback_data=f"hist:{session_id}:o:{older}")
+        )
+    if newer:
+        history_btns.append(
+            InlineKeyboardButton(text=texts.NEWER_MESSAGES, callback_data=f"hist:{session_id}:n:{newer}")
+        )
+    if history_btns:
+        builder.row(*history_btns)
+
 
     if attachments:
         row: list[InlineKeyboardButton] = []
@@ -16,6 +36,8 @@ def session_view_kb(session_id: int, taken: bool, opened: bool | None, attachmen
                 row = []
         if row:
             builder.row(*row)
+        # Все вложения сессии альбомами, за минимум запросов
+        builder.row(InlineKeyboardButton(text=texts.OPEN_ALL_ATTACHMENTS, callback_data=f"attall:{session_id}"))
 
     action_btns: list[InlineKeyboardButton] = []
     if not taken:
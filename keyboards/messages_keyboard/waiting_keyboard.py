@@ -3,18 +3,31 @@ import texts
 from aiogram.types import InlineKeyboardButton
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 
-def kb(users: list[tuple[int, str | None]]):
+def kb(users: list[tuple], kind: str | None = None, page: int = 1, newer: str | None = None, older: str | None = None):
+    """
+    users: [(session_id, tgid, username, opened_at), ...]
+    newer/older: курсоры (opened_at, id) первой и последней строки страницы,
+                 если в эту сторону есть ещё сессии
+    callback_data пагинации: msg:{kind}:{page}:{n|o}:{cursor}
+    """
     builder = InlineKeyboardBuilder()
 
-    for session_id, tgid, username in users:
+    for session_id, tgid, username, *_ in users:
         text = f"#{tgid} @{username}" if username else f"#{tgid}"
-        builder.add(
+        builder.row(
             InlineKeyboardButton(
                 text=text,
                 callback_data=f"session:{session_id}"
             )
         )
 
-    builder.add(InlineKeyboardButton(text=texts.BACK_KB_TEXT, callback_data="home"))
-    builder.adjust(1)
+    nav = []
+    if newer:
+        nav.append(InlineKeyboardButton(text="‹ Пред", callback_data=f"msg:{kind}:{page-1}:n:{newer}"))
+    if older:
+        nav.append(InlineKeyboardButton(text="След ›", callback_data=f"msg:{kind}:{page+1}:o:{older}"))
+    if nav:
+        builder.row(*nav)
+
+    builder.row(InlineKeyboardButton(text=texts.BACK_KB_TEXT, callback_data="home"))
     return builder.as_markup()
@@ -1,17 +1,44 @@
 import asyncio
 
+from aiohttp import web
 from aiogram import Bot, Dispatcher, F, Router
 from aiogram.enums import ParseMode
 from aiogram.filters import Command, CommandStart
 from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
 
-from config import get_admin_ids, TOKEN, create_pool
+from config import (
+    BOT_MODE,
+    FSM_STORAGE,
+    METRICS_HOST,
+    METRICS_PORT,
+    OUTBOUND_RATE_LIMIT,
+    TOKEN,
+    WEBHOOK_BASE_URL,
+    WEBHOOK_HOST,
+    WEBHOOK_PATH,
+    WEBHOOK_PORT,
+    WEBHOOK_SECRET,
+    create_pool,
+    get_admin_ids,
+)
+from constants import (
+    OUTBOUND_CHAT_BURST,
+    OUTBOUND_CHAT_RATE,
+    OUTBOUND_GLOBAL_BURST,
+    OUTBOUND_GLOBAL_RATE,
+    UPDATE_MAX_CONCURRENCY,
+)
 from handlers.callbacks import adminPage, messages_handler, users_handler
-from handlers.messages import admin_reply_handlers, start
-from middlewares import admin, databaseAdd, log, services
-from services import ServiceContainer
+from handlers.messages import admin_reply_handlers, query_stats, start
+from middlewares import admin, album, databaseAdd, executor, log, metrics, services, unitOfWork
+from services import MySQLStorage, ServiceContainer
 from states import AdminChat
 from utils.logger import get_logger
+from utils.metrics import OUTBOUND_QUEUED, POST_SEND_PENDING, UPDATES_ACTIVE, UPDATES_QUEUED, register_pool, start_metrics_server
+from utils.outbound import OutboundDispatcher
+from utils.post_send import PostSendPipeline
+from utils.refresh import PanelRefreshScheduler
 
 logger = get_logger(__name__)
 
@@ -30,11 +57,42 @@ async def bot_init():
     dp["pool"] = pool
     logger.info("Пул БД добавлен в диспетчер")
     
+    # Размер и загрузка пула попадают в метрики при каждом чтении
+    register_pool(pool)
+    
+    # Все запросы к Bot API проходят через очередь с лимитами Telegram;
+    # метрики запросов подключаются после нее и не учитывают ожидание в очереди
+    outbound = OutboundDispatcher(
+        global_rate=OUTBOUND_GLOBAL_RATE if OUTBOUND_RATE_LIMIT else 0,
+        global_burst=OUTBOUND_GLOBAL_BURST,
+        chat_rate=OUTBOUND_CHAT_RATE if OUTBOUND_RATE_LIMIT else 0,
+        chat_burst=OUTBOUND_CHAT_BURST,
+    )
+    dp["outbound"] = outbound
+    OUTBOUND_QUEUED.set_function(lambda: outbound.queued)
+    bot.session.middleware(outbound)
+    bot.session.middleware(metrics.BotApiMetricsMiddleware())
+    
+    # Подключаем общее хранилище FSM: пул создается асинхронно,
+    # поэтому хранилище меняется уже после создания диспетчера
+    if FSM_STORAGE == "mysql":
+        dp.fsm.storage = MySQLStorage(pool, persistent_ids=get_admin_ids())
+        logger.info("Хранилище FSM в MySQL подключено")
+    
     # Создаем контейнер сервисов
     services = ServiceContainer(pool, bot)
     dp["services"] = services
     logger.info("Контейнер сервисов добавлен в диспетчер")
     
+    # Создаем планировщик обновления панелей операторов
+    dp["refresh_scheduler"] = PanelRefreshScheduler(bot, dp.storage, services)
+    logger.info("Планировщик обновления панелей добавлен в диспетчер")
+    
+    # Запись ответов операторов, их панели и удаление их сообщений выполняются в фоне
+    post_send = PostSendPipeline()
+    dp["post_send"] = post_send
+    POST_SEND_PENDING.set_function(lambda: post_send.pending)
+    
     # Настраиваем middleware
     await _setup_middleware(pool, services)
     
@@ -50,6 +108,21 @@ async def bot_init():
 
 async def _setup_middleware(pool, services_container):
     """Настраивает middleware для бота"""
+    # Метрики обновлений: первым, чтобы в замер попадала вся обработка
+    dp.update.outer_middleware(metrics.UpdateMetricsMiddleware())
+    
+    # Очередь обновлений: порядок внутри чата и общий лимит; до единицы работы,
+    # чтобы ожидающие обновления не держали соединений с БД
+    update_executor = executor.UpdateExecutorMiddleware(UPDATE_MAX_CONCURRENCY)
+    UPDATES_QUEUED.set_function(lambda: update_executor.waiting)
+    UPDATES_ACTIVE.set_function(lambda: update_executor.active)
+    dp.update.outer_middleware(update_executor)
+    logger.info("Middleware очереди обновлений добавлен")
+    
+    # Единица работы: одно соединение и одна транзакция на обновление
+    dp.update.outer_middleware(unitOfWork.UnitOfWorkMiddleware(pool))
+    logger.info("Middleware единицы работы добавлен")
+    
     # Middleware для передачи сервисов
     dp.message.middleware(services.ServicesMiddleware())
     dp.callback_query.middleware(services.ServicesMiddleware())
@@ -61,13 +134,22 @@ async def _setup_middleware(pool, services_container):
     dp.callback_query.middleware(admin.AdminCheck(admin_ids))
     logger.info("Middleware для проверки админов добавлен")
     
+    # Альбомы клиентов: после проверки админов, до записи в БД
+    dp.message.middleware(album.AlbumMiddleware())
+    logger.info("Middleware альбомов добавлен")
+    
     # Middleware для логгирования
-    dp.message.middleware(log.LogMiddleware(services_container, dp.storage))
+    dp.message.middleware(log.LogMiddleware(services_container, dp["refresh_scheduler"]))
     logger.info("Middleware для логгирования добавлен")
     
     # Middleware для добавления пользователей в БД
     dp.message.middleware(databaseAdd.DbAdd(services_container))
     logger.info("Middleware для добавления пользователей в БД добавлен")
+    
+    # Время обработчиков: последним, чтобы замерялся только сам обработчик
+    dp.message.middleware(metrics.HandlerMetricsMiddleware())
+    dp.callback_query.middleware(metrics.HandlerMetricsMiddleware())
+    logger.info("Middleware метрик добавлен")
 
 
 async def _register_handlers():
@@ -78,11 +160,13 @@ async def _register_handlers():
     callback_handlers = [
         (messages_handler.done_list_page, F.data.startswith("done:list:")),
         (messages_handler.done_toggle, F.data.startswith("done:toggle:")),
+        (users_handler.open_all_attachments, F.data.startswith("attall:")),
         (users_handler.open_attachment, F.data.startswith("att:")),
         (users_handler.close_attachment, F.data.startswith("attclose:")),
         (users_handler.open_session_view, F.data.startswith("session:")),
         (users_handler.take_session, F.data.startswith("take:")),
         (users_handler.open_chat, F.data.startswith("open:")),
+        (users_handler.history_page, F.data.startswith("hist:")),
         (users_handler.close_session, F.data.startswith("close:")),
         (messages_handler.messages, F.data.startswith("msg:")),
         (adminPage.mainPageCallback, None),  # Без фильтра
@@ -97,8 +181,12 @@ async def _register_handlers():
     logger.info("Обработчики callback_query зарегистрированы")
 
     logger.info("Регистрация обработчиков сообщений...")
+    # Команда регистрируется раньше ответа админа, чтобы работать и в открытом чате
+    router.message.register(query_stats.query_stats, Command("querystats"))
     router.message.register(admin_reply_handlers.admin_reply, AdminChat.active)
     router.message.register(start.welcome, CommandStart())
+    # Последним: остальные сообщения клиентов, чтобы для них вызывались middleware
+    router.message.register(start.client_message)
     logger.info("Обработчики сообщений зарегистрированы")
 
 async def main() -> None:
@@ -112,26 +200,97 @@ async def main() -> None:
     # Получаем контейнер сервисов из диспетчера
     services_container = dp["services"]
     
-    # Создаем таблицы в БД
-    logger.info("Создание таблиц в БД...")
-    await services_container.database_service.create_tables()
-    logger.info("Таблицы в БД созданы/проверены")
+    # Приводим схему БД к актуальной версии
+    await services_container.database_service.migrate()
+    
+    # Загружаем счётчики сессий и запускаем их периодическую сверку с БД
+    await services_container.session_service.load_counters()
+    services_container.session_service.start_counters_reconcile()
+    
+    # Отчет по планам запросов не должен мешать запуску
+    try:
+        await services_container.database_service.check_query_plans()
+    except Exception as e:
+        logger.error(f"Ошибка проверки планов запросов: {e}")
+
+    # Локальный эндпоинт метрик
+    metrics_runner = None
+    if METRICS_PORT:
+        metrics_runner = await start_metrics_server(METRICS_HOST, METRICS_PORT)
 
     # Запускаем бота
-    logger.info("Бот запущен и ожидает сообщений")
+    logger.info(f"Бот запущен и ожидает сообщений в режиме {BOT_MODE}")
     
     try:
-        await dp.start_polling(bot)
+        if BOT_MODE == "webhook":
+            await _run_webhook()
+        else:
+            await dp.start_polling(bot)
     except Exception as e:
         logger.error(f"Ошибка при работе бота: {e}")
         raise
     finally:
+        # Дожидаемся фоновых операций ответов, затем останавливаем обновления панелей и очередь отправки
+        await dp["post_send"].close()
+        await dp["refresh_scheduler"].close()
+        await dp["outbound"].close()
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
         # Закрываем соединения с БД
-        await _cleanup_database(pool)
+        await _cleanup_database(pool, services_container)
+
+
+def create_webhook_app(dispatcher: Dispatcher, bot_instance: Bot, path: str, secret_token: str | None) -> web.Application:
+    """
+    Создает aiohttp-приложение, принимающее обновления от Telegram
+    
+    Запросы без правильного заголовка X-Telegram-Bot-Api-Secret-Token
+    отклоняются обработчиком aiogram.
+    """
+    app = web.Application()
+    SimpleRequestHandler(
+        dispatcher=dispatcher,
+        bot=bot_instance,
+        secret_token=secret_token,
+    ).register(app, path=path)
+    setup_application(app, dispatcher, bot=bot_instance)
+    return app
+
+
+async def _run_webhook() -> None:
+    """Запускает webhook-сервер и регистрирует webhook в Telegram"""
+    app = create_webhook_app(dp, bot, WEBHOOK_PATH, WEBHOOK_SECRET)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, host=WEBHOOK_HOST, port=WEBHOOK_PORT)
+    await site.start()
+    logger.info(f"Webhook-сервер слушает {WEBHOOK_HOST}:{WEBHOOK_PORT}{WEBHOOK_PATH}")
+    
+    webhook_url = WEBHOOK_BASE_URL.rstrip("/") + WEBHOOK_PATH
+    await bot.set_webhook(
+        webhook_url,
+        secret_token=WEBHOOK_SECRET,
+        allowed_updates=dp.resolve_used_update_types(),
+    )
+    logger.info(f"Webhook зарегистрирован: {webhook_url}")
+    
+    try:
+        # Работаем до остановки процесса
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+        logger.info("Webhook-сервер остановлен")
 
 
-async def _cleanup_database(pool):
+async def _cleanup_database(pool, services_container):
     """Закрывает соединения с базой данных"""
+    # Сначала дописываем буферизованные сообщения, пока пул ещё открыт
+    logger.info("Сброс отложенных записей в БД...")
+    try:
+        await services_container.close()
+    except Exception as e:
+        logger.error(f"Ошибка сброса отложенных записей: {e}")
+    
     logger.info("Закрытие пула соединений с БД...")
     pool.close()
     await pool.wait_closed()
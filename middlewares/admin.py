@@ -11,7 +11,7 @@ class AdminCheck(BaseMiddleware):
     def __init__(self, admins: set[int]):
         super().__init__()
         self.admins = admins
-        logger.info(f"Загружены ID админов: {self.admins}")
+        logger.info("Загружены ID админов: %s", self.admins)
 
     async def __call__(
             self,
@@ -25,6 +25,6 @@ class AdminCheck(BaseMiddleware):
         data["is_admin"] = is_admin
         
         if user_id:
-            logger.debug(f"Проверка прав пользователя {user_id}: is_admin={is_admin}")
+            logger.debug("Проверка прав пользователя %s: is_admin=%s", user_id, is_admin)
         
         return await handler(event, data)
\ No newline at end of file
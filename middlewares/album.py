@@ -0,0 +1,80 @@
+"""
+Middleware альбомов: сообщения клиента с общим media_group_id
+обрабатываются как одно
+"""
+import asyncio
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.types import Message
+
+from constants import MEDIA_GROUP_COLLECT_WINDOW, MEDIA_GROUP_MAX_SIZE
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+
+class _Album:
+    """Сообщения альбома, собранные к текущему моменту"""
+
+    def __init__(self, message: Message):
+        self.messages = [message]
+        self.complete = asyncio.Event()
+
+
+class AlbumMiddleware(BaseMiddleware):
+    """
+    Собирает альбом клиента в одно обновление.
+
+    Telegram присылает каждое фото альбома отдельным обновлением. Первое
+    из них ждёт остальные, пока они приходят чаще раза в window секунд
+    (или пока альбом не заполнится), и передаёт дальше весь альбом
+    в data["album"]; остальные обновления на этом заканчиваются. Так запись
+    в БД, поиск сессии и обновление панели выполняются один раз на альбом.
+    Сообщения админов не собираются: ответ оператора пересылается клиенту
+    как есть.
+    """
+
+    def __init__(self, window: float = MEDIA_GROUP_COLLECT_WINDOW, max_size: int = MEDIA_GROUP_MAX_SIZE):
+        """
+        Args:
+            window: Сколько секунд ждать следующее сообщение альбома
+            max_size: Размер альбома, после которого ждать больше нечего
+        """
+        self.window = window
+        self.max_size = max_size
+        self._albums: dict[tuple[int, str], _Album] = {}
+
+    async def __call__(
+        self,
+        handler: Callable[[Message, Dict[str, Any]], Awaitable[Any]],
+        event: Message,
+        data: Dict[str, Any]
+    ) -> Any:
+        if not isinstance(event, Message) or not event.media_group_id or data.get("is_admin", False):
+            return await handler(event, data)
+
+        key = (event.chat.id, event.media_group_id)
+        album = self._albums.get(key)
+        if album is not None:
+            album.messages.append(event)
+            if len(album.messages) >= self.max_size:
+                album.complete.set()
+            logger.debug("Сообщение %s добавлено в альбом %s", event.message_id, event.media_group_id)
+            return None
+
+        album = self._albums[key] = _Album(event)
+        try:
+            while not album.complete.is_set():
+                received = len(album.messages)
+                try:
+                    await asyncio.wait_for(album.complete.wait(), self.window)
+                except asyncio.TimeoutError:
+                    if len(album.messages) == received:
+                        break
+        finally:
+            self._albums.pop(key, None)
+
+        data["album"] = sorted(album.messages, key=lambda message: message.message_id)
+        logger.debug("Альбом %s собран: %s сообщений", event.media_group_id, len(album.messages))
+        return await handler(event, data)
@@ -21,9 +21,9 @@ class DbAdd(BaseMiddleware):
         if isinstance(event, Message) and not data.get("is_admin", False):
             tgid = event.from_user.id
             username = event.from_user.username
-            logger.debug(f"Добавление пользователя в БД: tgid={tgid}, username=@{username}")
+            logger.debug("Добавление пользователя в БД: tgid=%s, username=@%s", tgid, username)
             
             user_service = self.services.user_service
             await user_service.add_user(tgid, username)
-            logger.debug(f"Пользователь {tgid} добавлен в БД")
+            logger.debug("Пользователь %s добавлен в БД", tgid)
         return await handler(event, data)
\ No newline at end of file
@@ -0,0 +1,116 @@
+"""
+Middleware очереди обновлений: порядок внутри чата и общий лимит параллельности
+"""
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from aiogram import BaseMiddleware
+from aiogram.dispatcher.middlewares.user_context import EVENT_CONTEXT_KEY
+from aiogram.types import TelegramObject, Update
+
+from constants import UPDATE_MAX_CONCURRENCY
+from utils import metrics
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+
+class _Step:
+    """Шаг очереди чата: одно обновление или все сообщения одного альбома"""
+
+    def __init__(self, group: Optional[str], previous: Optional["_Step"]):
+        self.group = group
+        self.previous = previous
+        self.members = 1
+        # Шаг получил слот и можно запускать присоединившиеся к нему обновления
+        self.started = asyncio.Event()
+        self.finished = asyncio.Event()
+
+
+class UpdateExecutorMiddleware(BaseMiddleware):
+    """
+    Выполняет обновления одного чата строго по очереди, разных чатов - параллельно.
+
+    Обновления чата образуют цепочку шагов: шаг начинается, когда закончился
+    предыдущий, поэтому два быстрых сообщения клиента или два /start не
+    обгоняют друг друга. Сообщения одного альбома составляют один шаг:
+    первое из них ждёт остальные в AlbumMiddleware. Кроме того, одновременно
+    обрабатывается не больше max_concurrency шагов: остальные ждут здесь,
+    не занимая соединений пула, - так нагрузка не копится в ожидании БД.
+    Ожидание и глубина очереди попадают в метрики.
+    """
+
+    def __init__(self, max_concurrency: int = UPDATE_MAX_CONCURRENCY):
+        """
+        Args:
+            max_concurrency: Сколько шагов обрабатывается одновременно
+        """
+        self._slots = asyncio.Semaphore(max_concurrency)
+        self._tails: dict[int, _Step] = {}
+        self.waiting = 0
+        self.active = 0
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: Update,
+        data: Dict[str, Any]
+    ) -> Any:
+        context = data.get(EVENT_CONTEXT_KEY)
+        chat_id = context.chat_id if context is not None else None
+        message = event.message if isinstance(event, Update) else None
+        group = message.media_group_id if message is not None else None
+
+        step, leader = self._enter(chat_id, group) if chat_id is not None else (None, True)
+        holds_slot = False
+        start = time.perf_counter()
+        self.waiting += 1
+        try:
+            try:
+                if leader:
+                    if step is not None and step.previous is not None:
+                        await step.previous.finished.wait()
+                        step.previous = None
+                    await self._slots.acquire()
+                    holds_slot = True
+                    if step is not None:
+                        step.started.set()
+                else:
+                    await step.started.wait()
+            finally:
+                self.waiting -= 1
+            metrics.UPDATE_QUEUE_WAIT.observe(time.perf_counter() - start, event.event_type)
+
+            self.active += 1
+            try:
+                return await handler(event, data)
+            finally:
+                self.active -= 1
+        finally:
+            if holds_slot:
+                self._slots.release()
+            if step is not None:
+                self._leave(chat_id, step)
+
+    def _enter(self, chat_id: int, group: Optional[str]) -> tuple[_Step, bool]:
+        """Ставит обновление в очередь чата; возвращает шаг и признак, что шаг новый"""
+        tail = self._tails.get(chat_id)
+        if group is not None and tail is not None and tail.group == group and not tail.finished.is_set():
+            tail.members += 1
+            return tail, False
+        step = self._tails[chat_id] = _Step(group, tail)
+        if tail is not None:
+            logger.debug("Обновление чата %s ждёт окончания предыдущего", chat_id)
+        return step, True
+
+    def _leave(self, chat_id: int, step: _Step) -> None:
+        """Отмечает окончание обновления и освобождает очередь чата"""
+        # Если первое обновление шага отменено до получения слота, присоединившиеся не должны зависнуть
+        step.started.set()
+        step.members -= 1
+        if step.members:
+            return
+        step.finished.set()
+        if self._tails.get(chat_id) is step:
+            del self._tails[chat_id]
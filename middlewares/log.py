@@ -6,50 +6,47 @@ from aiogram.types import Message
 from constants import MESSAGE_DIRECTIONS
 from services import ServiceContainer
 from utils import refresh
+from utils.attachments import extract_attachment
 from utils.logger import get_logger
 
 logger = get_logger(__name__)
 
 class LogMiddleware(BaseMiddleware):
-    def __init__(self, services: ServiceContainer, storage):
+    def __init__(self, services: ServiceContainer, refresh_scheduler: refresh.PanelRefreshScheduler):
         super().__init__()
         self.services = services
-        self.storage = storage
+        self.refresh_scheduler = refresh_scheduler
     async def __call__(self, handler, event: Message, data: dict):
         if isinstance(event, Message) and not data.get("is_admin", False):
             tgid = event.from_user.id
             
-            user_service = self.services.user_service
             message_service = self.services.message_service
             session_service = self.services.session_service
             
-            session_id = await user_service.get_user_session_id(tgid)
-            if session_id:
-                logger.debug(f"Сообщение от пользователя {tgid} в сессии {session_id}")
-                text = event.text or event.caption
-                file_id = None
-                if event.photo:
-                    file_id = event.photo[-1].file_id
-                elif event.document:
-                    file_id = event.document.file_id
-                elif event.voice:
-                    file_id = event.voice.file_id
-
-                await message_service.log_user_message(
-                    tgid=tgid,
-                    session_id=session_id,
-                    text=text,
-                    file_id=file_id
-                )
-                view = await session_service.get_session_info(session_id)
-                assigned = view.get("assigned_agent") if view else None
-                if assigned:
-                    await refresh.refresh_session_view(
-                        bot=event.bot,
-                        storage=self.storage,
-                        services=self.services,
-                        operator_id=assigned
+            route = await session_service.get_open_session_route(tgid)
+            if route:
+                session_id = route.session_id
+                logger.debug("Сообщение от пользователя %s в сессии %s", tgid, session_id)
+                album = data.get("album")
+                if album:
+                    # Альбом - одна многострочная запись и одно обновление панели
+                    await message_service.log_user_album(
+                        tgid=tgid,
+                        session_id=session_id,
+                        items=[(message.caption, extract_attachment(message)) for message in album],
+                        media_group_id=event.media_group_id
                     )
+                else:
+                    await message_service.log_user_message(
+                        tgid=tgid,
+                        session_id=session_id,
+                        text=event.text or event.caption,
+                        attachment=extract_attachment(event)
+                    )
+                assigned = route.assigned_agent
+                if assigned:
+                    # Панель обновится в фоне, не задерживая обработку сообщения
+                    self.refresh_scheduler.schedule(assigned)
             elif event.text == "/start":
                 pass
             else:
@@ -0,0 +1,80 @@
+"""
+Middleware метрик: обновления, обработчики и запросы к Bot API
+"""
+import time
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware, Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.methods import Response, TelegramMethod
+from aiogram.types import TelegramObject, Update
+
+from utils import metrics
+
+
+class UpdateMetricsMiddleware(BaseMiddleware):
+    """Считает обновления и ошибки и измеряет полное время обработки обновления"""
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: Update,
+        data: Dict[str, Any]
+    ) -> Any:
+        update_type = event.event_type
+        metrics.UPDATES.inc(update_type)
+        start = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception as e:
+            metrics.UPDATE_ERRORS.inc(update_type, type(e).__name__)
+            raise
+        finally:
+            metrics.UPDATE_DURATION.observe(time.perf_counter() - start, update_type)
+
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    """
+    Измеряет время работы обработчика, выбранного роутером.
+
+    Регистрируется последним внутренним middleware, чтобы в замер
+    попадал только сам обработчик.
+    """
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        handler_object = data.get("handler")
+        if handler_object is None:
+            return await handler(event, data)
+
+        callback = handler_object.callback
+        name = f"{callback.__module__.rsplit('.', 1)[-1]}.{callback.__qualname__}"
+        start = time.perf_counter()
+        try:
+            return await handler(event, data)
+        finally:
+            metrics.HANDLER_DURATION.observe(time.perf_counter() - start, name)
+
+
+class BotApiMetricsMiddleware(BaseRequestMiddleware):
+    """Измеряет время запросов к Bot API по методам и считает ошибки"""
+
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType,
+        bot: Bot,
+        method: TelegramMethod,
+    ) -> Response:
+        name = getattr(method, "__api_method__", type(method).__name__)
+        start = time.perf_counter()
+        try:
+            return await make_request(bot, method)
+        except Exception as e:
+            metrics.BOT_API_ERRORS.inc(name, type(e).__name__)
+            raise
+        finally:
+            metrics.BOT_API_DURATION.observe(time.perf_counter() - start, name)
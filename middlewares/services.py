@@ -22,7 +22,8 @@ class ServicesMiddleware(BaseMiddleware):
         data: Dict[str, Any]
     ) -> Any:
         """
-        Добавляет сервисы в контекст обработчика
+        Добавляет сервисы в контекст обработчика и открывает память чтений
+        на время обработки события
         
         Args:
             handler: Обработчик события
@@ -42,4 +43,5 @@ class ServicesMiddleware(BaseMiddleware):
         data["services"] = services
         logger.debug("Сервисы добавлены в контекст обработчика")
         
-        return await handler(event, data)
+        with services.request_scope():
+            return await handler(event, data)
@@ -0,0 +1,41 @@
+"""
+Middleware единицы работы: одно соединение с БД и одна транзакция на обновление
+"""
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+
+from services.backends import Pool
+from services.unit_of_work import unit_of_work
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+
+class UnitOfWorkMiddleware(BaseMiddleware):
+    """
+    Открывает единицу работы на время обработки обновления.
+
+    Все запросы сервисов внутри обновления идут через одно соединение
+    и фиксируются одним COMMIT после обработчика; при исключении
+    транзакция откатывается. Соединение берётся из пула только при
+    первом запросе, поэтому обновления без обращений к БД его не занимают.
+    """
+
+    def __init__(self, pool: Pool):
+        """
+        Args:
+            pool: Пул соединений с БД
+        """
+        self.pool = pool
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        async with unit_of_work(self.pool) as uow:
+            data["unit_of_work"] = uow
+            return await handler(event, data)
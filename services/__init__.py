@@ -2,18 +2,28 @@
 Слой сервисов для бизнес-логики приложения
 """
 
-from .base_service import BaseService
+from .base_service import BaseService, CommitOutcomeUnknown
 from .user_service import UserService
 from .session_service import SessionService
 from .message_service import MessageService
 from .notification_service import NotificationService
+from .routing_cache import RoutingCache, RoutingEntry
+from .transcript_cache import TranscriptCache
+from .session_counters import SessionCounters
+from .fsm_storage import MySQLStorage
 from .container import ServiceContainer
 
 __all__ = [
     'BaseService',
+    'CommitOutcomeUnknown',
     'UserService',
     'SessionService', 
     'MessageService',
     'NotificationService',
+    'RoutingCache',
+    'RoutingEntry',
+    'TranscriptCache',
+    'SessionCounters',
+    'MySQLStorage',
     'ServiceContainer'
 ]
@@ -0,0 +1,18 @@
+"""
+Бэкенды хранилища: MySQL (aiomysql) и встроенный SQLite
+"""
+from .base import Connection, Cursor, Pool, dialect_of
+from .mysql import create_mysql_pool
+from .sqlite import SQLitePool, create_sqlite_pool, outside_transaction, translate
+
+__all__ = [
+    "Connection",
+    "Cursor",
+    "Pool",
+    "SQLitePool",
+    "create_mysql_pool",
+    "create_sqlite_pool",
+    "dialect_of",
+    "outside_transaction",
+    "translate",
+]
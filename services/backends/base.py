@@ -0,0 +1,59 @@
+"""
+Интерфейс хранилища, которым пользуются сервисы
+
+Сервисы работают с пулом в стиле aiomysql: acquire()/release(),
+курсоры с execute/fetchone/fetchall, rowcount и lastrowid, транзакции
+через begin/commit/rollback. Пул aiomysql подходит под этот интерфейс
+как есть, встроенный SQLite-бэкенд реализует его сам.
+"""
+from typing import Any, AsyncContextManager, Optional, Protocol, Sequence
+
+
+class Cursor(Protocol):
+    """Курсор запроса"""
+
+    rowcount: int
+    lastrowid: Optional[int]
+
+    async def execute(self, query: str, args: Any = None) -> Any: ...
+
+    async def fetchone(self) -> Optional[Sequence[Any]]: ...
+
+    async def fetchall(self) -> Sequence[Sequence[Any]]: ...
+
+
+class Connection(Protocol):
+    """Соединение с БД"""
+
+    def cursor(self, *cursor_classes: type) -> AsyncContextManager[Cursor]: ...
+
+    async def begin(self) -> None: ...
+
+    async def commit(self) -> None: ...
+
+    async def rollback(self) -> None: ...
+
+    def close(self) -> None: ...
+
+
+class Pool(Protocol):
+    """Пул соединений"""
+
+    size: int
+    freesize: int
+    maxsize: int
+
+    def acquire(self) -> Any:
+        """Возвращает объект, который можно и ожидать, и использовать в async with"""
+        ...
+
+    def release(self, conn: Connection) -> Any: ...
+
+    def close(self) -> None: ...
+
+    async def wait_closed(self) -> None: ...
+
+
+def dialect_of(pool: Pool) -> str:
+    """Возвращает диалект SQL пула: mysql или sqlite"""
+    return getattr(pool, "dialect", "mysql")
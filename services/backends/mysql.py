@@ -0,0 +1,40 @@
+"""
+Бэкенд MySQL: пул aiomysql
+"""
+import aiomysql
+
+from utils.logger import get_logger
+from utils.metrics import TimedCursor
+
+logger = get_logger(__name__)
+
+
+async def create_mysql_pool(
+    host: str,
+    user: str,
+    password: str,
+    db: str,
+    port: int,
+    minsize: int,
+    maxsize: int,
+) -> aiomysql.Pool:
+    """
+    Создает пул соединений с MySQL
+
+    Returns:
+        Пул aiomysql в режиме autocommit; транзакции открываются явно
+    """
+    pool = await aiomysql.create_pool(
+        host=host,
+        user=user,
+        password=password,
+        db=db,
+        port=port,
+        minsize=minsize,
+        maxsize=maxsize,
+        autocommit=True,
+        # Курсор по умолчанию записывает время запросов в метрики
+        cursorclass=TimedCursor,
+    )
+    logger.info("Пул соединений с MySQL %s:%s/%s создан", host, port, db)
+    return pool
@@ -0,0 +1,567 @@
+"""
+Встроенный бэкенд SQLite
+
+Выполняет те же запросы из sql/, что и MySQL: перед выполнением запрос
+переводится на диалект SQLite (плейсхолдеры, INSERT IGNORE, ON DUPLICATE
+KEY UPDATE, DDL с ENUM и индексами внутри CREATE TABLE и т.п.). Каждое
+соединение работает в собственном потоке, как в aiosqlite, поэтому
+event loop не блокируется; внешних зависимостей нет.
+
+Ограничения по сравнению с MySQL:
+- транзакция открывается (BEGIN IMMEDIATE) только перед первой записью
+  или SELECT ... FOR UPDATE и держит блокировку записи до COMMIT, поэтому
+  единицы работы, пишущие в БД, выполняются по одной с первой записи
+  до конца; чтения до неё идут без транзакции и друг друга не ждут;
+- rowcount у UPDATE считает все подошедшие строки, а не только изменённые;
+- из форм ON DUPLICATE KEY UPDATE с LAST_INSERT_ID(expr) поддерживается
+  только идиома id = LAST_INSERT_ID(id): при конфликте, как и MySQL,
+  курсор отдаёт lastrowid существующей строки и rowcount 0;
+- сохраняемые генерируемые колонки добавляются как VIRTUAL: ALTER TABLE
+  в SQLite не умеет добавлять STORED;
+- запрос соединения из контекста, где уже открыта транзакция, получает
+  это же соединение: второе соединение ждало бы блокировку записи,
+  которую держит сам контекст. Такие запросы фиксируются вместе с
+  транзакцией. Фоновые задачи наследуют контекст обновления, поэтому
+  те, что пишут в своих транзакциях, отвязываются от него через
+  outside_transaction();
+- ON UPDATE CURRENT_TIMESTAMP не поддерживается.
+"""
+import asyncio
+import re
+import sqlite3
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+from functools import lru_cache
+from typing import Any, Iterator, Optional, Sequence
+
+import aiomysql
+
+from constants import SQLITE_BUSY_TIMEOUT
+from utils.logger import get_logger
+from utils.metrics import observe_query
+
+logger = get_logger(__name__)
+
+# Колонки и псевдонимы с датой и временем: SQLite хранит их строками
+_DATETIME_COLUMNS = frozenset({
+    "created_at", "updated_at", "opened_at", "closed_at",
+    "last_message_at", "applied_at",
+})
+_DATETIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+_NOW = "(datetime('now', 'localtime'))"
+
+# Соединение, в котором текущий контекст открыл транзакцию, и метка этой транзакции:
+# после её завершения соединение может открыть транзакцию уже для другого контекста
+_transaction: ContextVar[Optional[tuple["SQLiteConnection", object]]] = ContextVar("sqlite_transaction", default=None)
+
+
+
+@contextmanager
+def outside_transaction() -> Iterator[None]:
+    """
+    Отвязывает текущий контекст от транзакции, открытой в нём раньше:
+    соединения пула берутся заново, а не выдаются повторно
+    """
+    token = _transaction.set(None)
+    try:
+        yield
+    finally:
+        _transaction.reset(token)
+
+
+# DATETIME в MySQL хранится с точностью до секунды
+sqlite3.register_adapter(datetime, lambda value: value.strftime(_DATETIME_FORMAT))
+
+
+def _split_top_level(body: str) -> list[str]:
+    """Делит список через запятую, не заходя в скобки и строки"""
+    parts, depth, quote, current = [], 0, None, []
+    for char in body:
+        if quote:
+            if char == quote:
+                quote = None
+        elif char in ("'", '"', "`"):
+            quote = char
+        elif char == "(":
+            depth += 1
+        elif char == ")":
+            depth -= 1
+        elif char == "," and depth == 0:
+            parts.append("".join(current).strip())
+            current = []
+            continue
+        current.append(char)
+    if "".join(current).strip():
+        parts.append("".join(current).strip())
+    return parts
+
+
+_INDEX_DEF = re.compile(r"^(UNIQUE\s+)?(?:INDEX|KEY)\s+(\w+)\s*(\(.*\))$", re.IGNORECASE | re.DOTALL)
+
+
+class _RawConnection(sqlite3.Connection):
+    """Соединение sqlite3, запоминающее аргумент LAST_INSERT_ID(expr)"""
+
+    last_insert_id: Optional[int] = None
+
+    def remember_insert_id(self, value: Optional[int]) -> Optional[int]:
+        self.last_insert_id = value
+        return value
+
+
+def _translate_column(definition: str) -> str:
+    definition = re.sub(
+        r"\b\w+(?:\s+UNSIGNED)?\s+AUTO_INCREMENT\s+PRIMARY\s+KEY\b",
+        "INTEGER PRIMARY KEY AUTOINCREMENT", definition, flags=re.IGNORECASE,
+    )
+    definition = re.sub(r"\s+UNSIGNED\b", "", definition, flags=re.IGNORECASE)
+    definition = re.sub(r"\bENUM\s*\([^)]*\)", "TEXT", definition, flags=re.IGNORECASE)
+    definition = re.sub(r"^(\w+\s+)JSON\b", r"\1TEXT", definition, flags=re.IGNORECASE)
+    definition = re.sub(r"\s+ON\s+UPDATE\s+CURRENT_TIMESTAMP\b", "", definition, flags=re.IGNORECASE)
+    definition = re.sub(r"\s+AFTER\s+\w+\s*$", "", definition, flags=re.IGNORECASE)
+    return re.sub(r"\bDEFAULT\s+CURRENT_TIMESTAMP\b", f"DEFAULT {_NOW}", definition, flags=re.IGNORECASE)
+
+
+def _create_index(table: str, unique: Optional[str], name: str, columns: str) -> str:
+    kind = "UNIQUE INDEX" if unique else "INDEX"
+    return f"CREATE {kind} IF NOT EXISTS {name} ON {table} {columns}"
+
+
+def _translate_create_table(sql: str) -> tuple[str, ...]:
+    match = re.match(r"CREATE\s+TABLE\s+(IF\s+NOT\s+EXISTS\s+)?(\w+)\s*\(", sql, re.IGNORECASE)
+    if match is None:
+        raise ValueError(f"Не удалось разобрать CREATE TABLE: {sql[:80]}")
+    table = match.group(2)
+    # Опции таблицы после закрывающей скобки (ENGINE, CHARSET) в SQLite не нужны
+    body = sql[match.end():sql.rindex(")")]
+
+    columns, indexes = [], []
+    for item in _split_top_level(body):
+        index = _INDEX_DEF.match(item)
+        if index:
+            indexes.append(_create_index(table, index.group(1), index.group(2), index.group(3)))
+        else:
+            columns.append(_translate_column(item))
+    create = f"CREATE TABLE {match.group(1) or ''}{table} (\n  " + ",\n  ".join(columns) + "\n)"
+    return (create, *indexes)
+
+
+def _translate_alter_table(sql: str) -> tuple[str, ...]:
+    match = re.match(r"ALTER\s+TABLE\s+(\w+)\s+", sql, re.IGNORECASE)
+    if match is None:
+        raise ValueError(f"Не удалось разобрать ALTER TABLE: {sql[:80]}")
+    table = match.group(1)
+
+    statements = []
+    for action in _split_top_level(sql[match.end():]):
+        index = re.match(r"ADD\s+(UNIQUE\s+)?(?:INDEX|KEY)\s+(\w+)\s*(\(.*\))$", action, re.IGNORECASE | re.DOTALL)
+        if index:
+            statements.append(_create_index(table, index.group(1), index.group(2), index.group(3)))
+            continue
+        drop_index = re.match(r"DROP\s+(?:INDEX|KEY)\s+(\w+)$", action, re.IGNORECASE)
+        if drop_index:
+            statements.append(f"DROP INDEX IF EXISTS {drop_index.group(1)}")
+            continue
+        add_column = re.match(r"ADD\s+(?:COLUMN\s+)?(.*)$", action, re.IGNORECASE | re.DOTALL)
+        if add_column:
+            column = re.sub(r"\bSTORED\s*$", "VIRTUAL", _translate_column(add_column.group(1)), flags=re.IGNORECASE)
+            statements.append(f"ALTER TABLE {table} ADD COLUMN {column}")
+            continue
+        drop_column = re.match(r"DROP\s+(?:COLUMN\s+)?(\w+)$", action, re.IGNORECASE)
+        if drop_column:
+            statements.append(f"ALTER TABLE {table} DROP COLUMN {drop_column.group(1)}")
+            continue
+        raise ValueError(f"ALTER TABLE не поддерживается в SQLite: {action}")
+    return tuple(statements)
+
+
+def _translate_statement(sql: str) -> str:
+    sql = re.sub(r"^\s*INSERT\s+IGNORE\b", "INSERT OR IGNORE", sql, flags=re.IGNORECASE)
+    duplicate = re.search(r"\bON\s+DUPLICATE\s+KEY\s+UPDATE\b", sql, re.IGNORECASE)
+    if duplicate:
+        assignments = re.sub(r"\bVALUES\s*\(\s*(\w+)\s*\)", r"excluded.\1", sql[duplicate.end():], flags=re.IGNORECASE)
+        sql = f"{sql[:duplicate.start()]}ON CONFLICT DO UPDATE SET{assignments}"
+    # Перед таким запросом транзакция уже взяла блокировку записи (_takes_write_lock)
+    sql = re.sub(r"\s+FOR\s+UPDATE\s*$", "", sql, flags=re.IGNORECASE)
+    sql = re.sub(r"\bCURRENT_TIMESTAMP\b", _NOW, sql, flags=re.IGNORECASE)
+    return sql.replace("%s", "?").replace("%%", "%")
+
+
+@lru_cache(maxsize=1024)
+def translate(query: str) -> tuple[str, ...]:
+    """
+    Переводит запрос MySQL на диалект SQLite
+
+    Args:
+        query: Запрос из sql/ с плейсхолдерами %s
+
+    Returns:
+        Один или несколько запросов SQLite: CREATE TABLE и ALTER TABLE
+        распадаются на отдельные запросы для индексов
+    """
+    sql = query.strip().rstrip(";").strip()
+    keyword = " ".join(sql.split(None, 2)[:2]).upper()
+    if keyword == "CREATE TABLE":
+        return _translate_create_table(sql)
+    if keyword == "ALTER TABLE":
+        return _translate_alter_table(sql)
+    return (_translate_statement(sql),)
+
+
+@lru_cache(maxsize=1024)
+def _takes_write_lock(query: str) -> bool:
+    """Запрос пишет в БД или блокирует строки (SELECT ... FOR UPDATE)"""
+    sql = query.strip().rstrip(";").strip()
+    keyword = sql.split(None, 1)[0].upper() if sql else ""
+    if keyword in ("SELECT", "WITH"):
+        return re.search(r"\bFOR\s+UPDATE$", sql, re.IGNORECASE) is not None
+    return True
+
+
+def _connect(path: str) -> _RawConnection:
+    conn = sqlite3.connect(
+        path, isolation_level=None, check_same_thread=False, timeout=SQLITE_BUSY_TIMEOUT, factory=_RawConnection
+    )
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    # Функции MySQL, которые встречаются в запросах бота
+    conn.create_function("GET_LOCK", 2, lambda name, timeout: 1)
+    conn.create_function("RELEASE_LOCK", 1, lambda name: 1)
+    conn.create_function("VERSION", 0, lambda: f"SQLite {sqlite3.sqlite_version}")
+    conn.create_function("DATABASE", 0, lambda: path)
+    conn.create_function("LAST_INSERT_ID", 1, conn.remember_insert_id)
+    return conn
+
+
+def _convert_row(row: Sequence[Any], datetime_columns: Sequence[int]) -> tuple:
+    if not datetime_columns:
+        return tuple(row)
+    values = list(row)
+    for i in datetime_columns:
+        if isinstance(values[i], str):
+            values[i] = datetime.fromisoformat(values[i])
+    return tuple(values)
+
+
+class SQLiteCursor:
+    """Курсор SQLite с интерфейсом курсора aiomysql"""
+
+    def __init__(self, conn: "SQLiteConnection", as_dict: bool = False):
+        self._conn = conn
+        self._as_dict = as_dict
+        self._rows: list = []
+        self._position = 0
+        self.description: Optional[tuple] = None
+        self.rowcount = -1
+        self.lastrowid: Optional[int] = None
+
+    async def __aenter__(self) -> "SQLiteCursor":
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.close()
+
+    def _execute(self, query: str, args: Any) -> None:
+        """Выполняется в потоке соединения"""
+        statements = translate(query)
+        if args is None:
+            params: Any = ()
+        elif isinstance(args, (dict, tuple)):
+            params = args
+        else:
+            params = tuple(args) if isinstance(args, list) else (args,)
+
+        raw = self._conn.raw
+        if self._conn.begin_pending and _takes_write_lock(query):
+            raw.execute("BEGIN IMMEDIATE")
+            self._conn.begin_pending = False
+        raw.last_insert_id = None
+        cursor = raw.cursor()
+        try:
+            if len(statements) > 1:
+                for statement in statements:
+                    cursor.execute(statement)
+            else:
+                cursor.execute(statements[0], params)
+
+            self.description = cursor.description
+            if cursor.description is not None:
+                names = [column[0] for column in cursor.description]
+                datetime_columns = [i for i, name in enumerate(names) if name in _DATETIME_COLUMNS]
+                rows = [_convert_row(row, datetime_columns) for row in cursor.fetchall()]
+                self._rows = [dict(zip(names, row)) for row in rows] if self._as_dict else rows
+                # Как у буферизованного курсора MySQL: число строк результата
+                self.rowcount = len(self._rows)
+            else:
+                self._rows = []
+                self.rowcount = cursor.rowcount
+            self._position = 0
+
+            self.lastrowid = cursor.lastrowid
+            if raw.last_insert_id is not None:
+                # ON DUPLICATE KEY UPDATE id = LAST_INSERT_ID(id): строка не изменилась
+                self.lastrowid = raw.last_insert_id
+                self.rowcount = 0
+            elif statements[-1].lstrip().upper().startswith("INSERT"):
+                if self.rowcount <= 0:
+                    self.lastrowid = 0
+                elif self.rowcount > 1:
+                    # MySQL возвращает id первой строки многострочного INSERT, SQLite - последней
+                    self.lastrowid -= self.rowcount - 1
+        finally:
+            cursor.close()
+
+    async def execute(self, query: str, args: Any = None) -> int:
+        start = time.perf_counter()
+        failed = True
+        try:
+            await self._conn.run(self._execute, query, args)
+            failed = False
+            return self.rowcount
+        finally:
+            observe_query(query, args, time.perf_counter() - start, max(self.rowcount, 0), failed)
+
+    async def fetchone(self) -> Optional[Any]:
+        if self._position >= len(self._rows):
+            return None
+        row = self._rows[self._position]
+        self._position += 1
+        return row
+
+    async def fetchmany(self, size: int = 1) -> list:
+        rows = self._rows[self._position:self._position + size]
+        self._position += len(rows)
+        return rows
+
+    async def fetchall(self) -> list:
+        rows = self._rows[self._position:]
+        self._position = len(self._rows)
+        return rows
+
+    async def close(self) -> None:
+        self._rows = []
+
+
+class SQLiteConnection:
+    """Соединение SQLite, работающее в собственном потоке"""
+
+    def __init__(self, raw: _RawConnection, executor: ThreadPoolExecutor):
+        self.raw = raw
+        self._executor = executor
+        self.closed = False
+        self.transaction_id: Optional[object] = None
+        # begin() вызван, но BEGIN IMMEDIATE ждёт первой записи
+        self.begin_pending = False
+
+    @classmethod
+    async def open(cls, path: str) -> "SQLiteConnection":
+        executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite")
+        raw = await asyncio.get_running_loop().run_in_executor(executor, _connect, path)
+        return cls(raw, executor)
+
+    async def run(self, function, *args) -> Any:
+        """Выполняет функцию в потоке соединения"""
+        if self.closed:
+            raise sqlite3.ProgrammingError("Соединение с SQLite закрыто")
+        return await asyncio.get_running_loop().run_in_executor(self._executor, function, *args)
+
+    @property
+    def in_transaction(self) -> bool:
+        return not self.closed and (self.begin_pending or self.raw.in_transaction)
+
+    def cursor(self, *cursor_classes: type) -> SQLiteCursor:
+        as_dict = any(issubclass(cls, aiomysql.DictCursor) for cls in cursor_classes)
+        return SQLiteCursor(self, as_dict=as_dict)
+
+    async def begin(self) -> None:
+        # Блокировка записи берётся перед первой записью: транзакция, которая
+        # только читает, не задерживает остальные на время запросов к Bot API
+        self.begin_pending = True
+        self.transaction_id = object()
+        _transaction.set((self, self.transaction_id))
+
+    async def commit(self) -> None:
+        self.transaction_id = None
+        self.begin_pending = False
+        if self.in_transaction:
+            await self.run(self.raw.execute, "COMMIT")
+
+    async def rollback(self) -> None:
+        self.transaction_id = None
+        self.begin_pending = False
+        if self.in_transaction:
+            await self.run(self.raw.execute, "ROLLBACK")
+
+    def close(self) -> None:
+        if self.closed:
+            return
+        self.closed = True
+        self.transaction_id = None
+        self.begin_pending = False
+        self._executor.submit(self.raw.close)
+        self._executor.shutdown(wait=False)
+
+    async def ensure_closed(self) -> None:
+        self.close()
+
+
+class _BorrowedConnection:
+    """
+    Соединение с открытой транзакцией, выданное повторно тому же контексту.
+    Управление транзакцией и закрытие остаются за владельцем.
+    """
+
+    closed = False
+    in_transaction = False
+
+    def __init__(self, conn: SQLiteConnection):
+        self._conn = conn
+
+    def cursor(self, *cursor_classes: type) -> SQLiteCursor:
+        return self._conn.cursor(*cursor_classes)
+
+    async def begin(self) -> None:
+        pass
+
+    async def commit(self) -> None:
+        pass
+
+    async def rollback(self) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+
+class _AcquireContext:
+    """Результат acquire(): можно ожидать или использовать в async with"""
+
+    def __init__(self, pool: "SQLitePool"):
+        self._pool = pool
+        self._conn: Optional[SQLiteConnection] = None
+
+    def __await__(self):
+        return self._pool._acquire().__await__()
+
+    async def __aenter__(self) -> SQLiteConnection:
+        self._conn = await self._pool._acquire()
+        return self._conn
+
+    async def __aexit__(self, *exc_info) -> None:
+        conn, self._conn = self._conn, None
+        self._pool.release(conn)
+
+
+class SQLitePool:
+    """
+    Пул соединений SQLite с интерфейсом пула aiomysql.
+
+    Соединения открываются по мере надобности, но не больше maxsize.
+    """
+
+    dialect = "sqlite"
+
+    def __init__(self, path: str, maxsize: int):
+        """
+        Args:
+            path: Путь к файлу БД
+            maxsize: Максимум одновременно открытых соединений
+        """
+        self.path = path
+        self.maxsize = maxsize
+        self.pending_acquires = 0
+        self._free: deque[SQLiteConnection] = deque()
+        self._used: set[SQLiteConnection] = set()
+        self._opening = 0
+        self._cond = asyncio.Condition()
+        self._closing = False
+
+    @property
+    def size(self) -> int:
+        return len(self._free) + len(self._used) + self._opening
+
+    @property
+    def freesize(self) -> int:
+        return len(self._free)
+
+    def acquire(self) -> _AcquireContext:
+        return _AcquireContext(self)
+
+    async def _acquire(self) -> SQLiteConnection:
+        if self._closing:
+            raise RuntimeError("Пул SQLite закрывается")
+        owned = _transaction.get()
+        if owned is not None:
+            conn, transaction_id = owned
+            if conn.transaction_id is transaction_id and conn in self._used and conn.in_transaction:
+                return _BorrowedConnection(conn)
+        self.pending_acquires += 1
+        try:
+            async with self._cond:
+                while True:
+                    if self._free:
+                        conn = self._free.popleft()
+                        self._used.add(conn)
+                        return conn
+                    if self.size < self.maxsize:
+                        self._opening += 1
+                        try:
+                            conn = await SQLiteConnection.open(self.path)
+                        finally:
+                            self._opening -= 1
+                        self._used.add(conn)
+                        return conn
+                    await self._cond.wait()
+        finally:
+            self.pending_acquires -= 1
+
+    def release(self, conn: SQLiteConnection) -> asyncio.Task:
+        """Возвращает соединение в пул; соединение с открытой транзакцией закрывается, как в aiomysql"""
+        if isinstance(conn, _BorrowedConnection):
+            return asyncio.get_running_loop().create_task(self._wakeup())
+        self._used.discard(conn)
+        if conn.in_transaction or self._closing:
+            if conn.in_transaction:
+                logger.warning("Соединение SQLite возвращено с открытой транзакцией и будет закрыто")
+            conn.close()
+        elif not conn.closed:
+            self._free.append(conn)
+        return asyncio.get_running_loop().create_task(self._wakeup())
+
+    async def _wakeup(self) -> None:
+        async with self._cond:
+            self._cond.notify()
+
+    def close(self) -> None:
+        self._closing = True
+        while self._free:
+            self._free.popleft().close()
+
+    async def wait_closed(self) -> None:
+        self.close()
+        for conn in list(self._used):
+            conn.close()
+        self._used.clear()
+
+
+async def create_sqlite_pool(path: str, maxsize: int) -> SQLitePool:
+    """
+    Создает пул соединений SQLite и проверяет, что файл БД открывается
+
+    Args:
+        path: Путь к файлу БД
+        maxsize: Максимум одновременно открытых соединений
+
+    Returns:
+        Пул SQLite
+    """
+    pool = SQLitePool(path, maxsize)
+    async with pool.acquire() as conn:
+        async with conn.cursor() as cursor:
+            await cursor.execute("SELECT 1")
+    logger.info("Пул соединений с SQLite %s создан", path)
+    return pool
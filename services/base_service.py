@@ -2,17 +2,27 @@
 Базовый класс для всех сервисов
 """
 from abc import ABC
-from typing import Any, Optional
-import aiomysql
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Awaitable, Callable, Hashable, Optional
+from .backends import Connection, Pool
+from .request_memo import MISSING, current_memo
+from .unit_of_work import current_unit_of_work
 from utils.logger import get_logger
 
 logger = get_logger(__name__)
 
 
+class CommitOutcomeUnknown(Exception):
+    """
+    COMMIT завершился ошибкой: соединение могло оборваться уже после
+    фиксации, поэтому повтор записи может её продублировать
+    """
+
+
 class BaseService(ABC):
     """Базовый класс для всех сервисов"""
     
-    def __init__(self, pool: aiomysql.Pool):
+    def __init__(self, pool: Pool):
         """
         Инициализация сервиса с пулом соединений БД
         
@@ -22,6 +32,105 @@ class BaseService(ABC):
         self.pool = pool
         self.logger = get_logger(self.__class__.__name__)
     
+    @asynccontextmanager
+    async def _connection(self) -> AsyncIterator[Connection]:
+        """
+        Выдаёт соединение: общее соединение обновления, если оно открыто,
+        иначе - соединение из пула
+        """
+        uow = current_unit_of_work()
+        if uow is not None:
+            async with uow.connection() as conn:
+                if conn is not None:
+                    yield conn
+                    return
+        async with self.pool.acquire() as conn:
+            yield conn
+    
+    async def _commit(self, conn: Connection) -> None:
+        """
+        Фиксирует изменения; в рамках единицы работы фиксация
+        откладывается до конца обновления
+        """
+        uow = current_unit_of_work()
+        if uow is not None and uow.owns(conn):
+            return
+        try:
+            await conn.commit()
+        except Exception as e:
+            raise CommitOutcomeUnknown(e) from e
+    
+    @asynccontextmanager
+    async def _transaction(self) -> AsyncIterator[Connection]:
+        """
+        Выдаёт соединение внутри транзакции. В рамках единицы работы
+        это её транзакция, иначе - отдельная транзакция на время блока
+        """
+        async with self._connection() as conn:
+            uow = current_unit_of_work()
+            if uow is not None and uow.owns(conn):
+                yield conn
+                return
+            await conn.begin()
+            try:
+                yield conn
+            except BaseException:
+                await conn.rollback()
+                raise
+            try:
+                await conn.commit()
+            except Exception as e:
+                raise CommitOutcomeUnknown(e) from e
+    
+    def _after_commit(self, callback: Callable[[], None]) -> None:
+        """
+        Выполняет callback после фиксации изменений: сразу
+        или в конце единицы работы, если она открыта
+        """
+        uow = current_unit_of_work()
+        if uow is not None and not uow.closed:
+            uow.after_commit(callback)
+        else:
+            callback()
+    
+    def _after_rollback(self, callback: Callable[[], None]) -> None:
+        """Выполняет callback, если открытая единица работы будет откачена"""
+        uow = current_unit_of_work()
+        if uow is not None and not uow.closed:
+            uow.after_rollback(callback)
+    
+    async def _memoized(self, method: str, args: Hashable, load: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Читает данные один раз за обновление: повторный вызов с теми же
+        аргументами берёт результат из памяти обновления
+        
+        Args:
+            method: Имя метода сервиса
+            args: Нормализованные аргументы (ключ памяти)
+            load: Чтение из БД при промахе
+            
+        Returns:
+            Результат чтения
+        """
+        memo = current_memo()
+        if memo is None:
+            return await load()
+        
+        service = type(self).__name__
+        value = memo.get(service, method, args)
+        if value is MISSING:
+            value = await load()
+            memo.put(service, method, args, value)
+        else:
+            self.logger.debug("%s%s взят из памяти обновления", method, args)
+        return value
+    
+    def _forget(self, method: str, args: Hashable) -> None:
+        """Удаляет из памяти обновления результат чтения, устаревший после записи"""
+        memo = current_memo()
+        if memo is not None:
+            memo.forget(type(self).__name__, method, args)
+    
     async def _execute_query(self, query: str, params: tuple = ()) -> Any:
         """
         Выполняет SQL запрос с обработкой ошибок
@@ -37,12 +146,12 @@ class BaseService(ABC):
             Exception: При ошибке выполнения запроса
         """
         try:
-            async with self.pool.acquire() as conn:
+            async with self._connection() as conn:
                 async with conn.cursor() as cursor:
                     await cursor.execute(query, params)
                     return await cursor.fetchall()
         except Exception as e:
-            self.logger.error(f"Ошибка выполнения запроса: {query}, params: {params}, error: {e}")
+            self.logger.error("Ошибка выполнения запроса: %s, params: %s, error: %s", query, params, e)
             # Добавляем контекстную информацию об ошибке
             if "connection" in str(e).lower():
                 self.logger.error("Проблема с подключением к базе данных")
@@ -67,13 +176,13 @@ class BaseService(ABC):
             Exception: При ошибке выполнения запроса
         """
         try:
-            async with self.pool.acquire() as conn:
+            async with self._connection() as conn:
                 async with conn.cursor() as cursor:
                     await cursor.execute(query, params)
-                    await conn.commit()
+                    await self._commit(conn)
                     return cursor.lastrowid
         except Exception as e:
-            self.logger.error(f"Ошибка выполнения INSERT: {query}, params: {params}, error: {e}")
+            self.logger.error("Ошибка выполнения INSERT: %s, params: %s, error: %s", query, params, e)
             # Добавляем контекстную информацию об ошибке
             if "duplicate" in str(e).lower():
                 self.logger.error("Попытка создать дублирующуюся запись")
@@ -98,13 +207,13 @@ class BaseService(ABC):
             Exception: При ошибке выполнения запроса
         """
         try:
-            async with self.pool.acquire() as conn:
+            async with self._connection() as conn:
                 async with conn.cursor() as cursor:
                     await cursor.execute(query, params)
-                    await conn.commit()
+                    await self._commit(conn)
                     return cursor.rowcount
         except Exception as e:
-            self.logger.error(f"Ошибка выполнения UPDATE: {query}, params: {params}, error: {e}")
+            self.logger.error("Ошибка выполнения UPDATE: %s, params: %s, error: %s", query, params, e)
             # Добавляем контекстную информацию об ошибке
             if "foreign key" in str(e).lower():
                 self.logger.error("Нарушение внешнего ключа при обновлении")
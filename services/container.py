@@ -1,13 +1,18 @@
 """
 Контейнер сервисов для управления зависимостями
 """
-import aiomysql
 from aiogram import Bot
+from config import MESSAGE_BATCH_LOGGING, ROUTING_CACHE_TTL, TRANSCRIPT_CACHE_TTL
+from .backends import Pool
 from .user_service import UserService
 from .session_service import SessionService
 from .message_service import MessageService
 from .notification_service import NotificationService
 from .database_service import DatabaseService
+from .request_memo import request_memo
+from .routing_cache import RoutingCache
+from .session_counters import SessionCounters
+from .transcript_cache import TranscriptCache
 from utils.logger import get_logger
 
 logger = get_logger(__name__)
@@ -16,7 +21,7 @@ logger = get_logger(__name__)
 class ServiceContainer:
     """Контейнер для управления сервисами"""
     
-    def __init__(self, pool: aiomysql.Pool, bot: Bot):
+    def __init__(self, pool: Pool, bot: Bot):
         """
         Инициализация контейнера сервисов
         
@@ -27,6 +32,11 @@ class ServiceContainer:
         self.pool = pool
         self.bot = bot
         
+        # Общие in-process кэши, разделяемые сервисами
+        self.routing_cache = RoutingCache(ttl=ROUTING_CACHE_TTL)
+        self.transcript_cache = TranscriptCache(ttl=TRANSCRIPT_CACHE_TTL)
+        self.session_counters = SessionCounters()
+        
         # Инициализируем сервисы
         self._user_service = None
         self._session_service = None
@@ -48,7 +58,9 @@ class ServiceContainer:
     def session_service(self) -> SessionService:
         """Получить сервис сессий"""
         if self._session_service is None:
-            self._session_service = SessionService(self.pool)
+            self._session_service = SessionService(
+                self.pool, self.routing_cache, self.session_counters, self.message_service
+            )
             logger.debug("SessionService создан")
         return self._session_service
     
@@ -56,7 +68,7 @@ class ServiceContainer:
     def message_service(self) -> MessageService:
         """Получить сервис сообщений"""
         if self._message_service is None:
-            self._message_service = MessageService(self.pool)
+            self._message_service = MessageService(self.pool, self.transcript_cache, batch_logging=MESSAGE_BATCH_LOGGING)
             logger.debug("MessageService создан")
         return self._message_service
     
@@ -76,6 +88,24 @@ class ServiceContainer:
             logger.debug("DatabaseService создан")
         return self._database_service
     
+    def request_scope(self):
+        """
+        Открывает память чтений сервисов на время одного обновления.
+        
+        Контейнер общий для всего процесса, поэтому сама память хранится
+        в контексте задачи и очищается при выходе из блока with.
+        """
+        return request_memo()
+    
+    async def close(self) -> None:
+        """Завершает фоновую работу сервисов перед закрытием пула"""
+        if self._session_service is not None:
+            await self._session_service.close()
+            logger.debug("SessionService закрыт")
+        if self._message_service is not None:
+            await self._message_service.close()
+            logger.debug("MessageService закрыт")
+    
     def get_all_services(self) -> dict:
         """
         Получить все сервисы в виде словаря
@@ -1,52 +1,146 @@
 """
 Сервис для работы с базой данных
 """
+import aiomysql
+
+from .backends import dialect_of
 from .base_service import BaseService
-from sql import texts
+from constants import MIGRATION_LOCK_TIMEOUT
+from sql import migrations, texts
 from utils.logger import get_logger
 
 logger = get_logger(__name__)
 
 
+class _TemplateDefaults(dict):
+    """Подставляет в шаблон запроса значения по умолчанию для EXPLAIN"""
+    
+    def __missing__(self, key: str) -> str:
+        return {"condition": texts.open_sessions_waiting, "order": "DESC"}.get(key, "")
+
+
+def _sqlite_plan_issues(plan: list[dict]) -> list[str]:
+    """Ищет в плане SQLite сканирования без индекса и сортировки во временном B-дереве"""
+    issues = []
+    # Подзапрос во FROM уже ограничен и материализован, его чтение целиком - не проблема
+    materialized = {
+        (step.get("detail") or "").split()[1] for step in plan if (step.get("detail") or "").startswith("MATERIALIZE")
+    }
+    for step in plan:
+        detail = step.get("detail") or ""
+        if detail.startswith("SCAN") and "USING" not in detail and detail.split()[1] not in materialized:
+            issues.append(f"полное сканирование {detail.split()[1]}")
+        if "USE TEMP B-TREE" in detail:
+            issues.append(f"сортировка без индекса ({detail})")
+    return issues
+
+
 class DatabaseService(BaseService):
     """Сервис для управления базой данных"""
     
-    async def create_tables(self) -> None:
+    async def migrate(self) -> int:
         """
-        Создает все необходимые таблицы в БД
+        Применяет к БД все ещё не применённые миграции схемы
+        
+        Returns:
+            Версия схемы после миграции
         """
-        logger.info("Создание таблиц в БД...")
+        logger.info("Проверка версии схемы БД...")
         
         try:
             async with self.pool.acquire() as conn:
                 async with conn.cursor() as cursor:
-                    # Выполняем все запросы в одной транзакции
-                    tables = [
-                        ("users", texts.create_users_table),
-                        ("orders", texts.create_orders_table),
-                        ("messages", texts.create_messages_table),
-                        ("sessions", texts.create_sessions_table)
-                    ]
+                    await cursor.execute(migrations.create_schema_version_table)
                     
-                    for table_name, create_sql in tables:
-                        logger.debug(f"Создание таблицы {table_name}")
-                        try:
-                            await cursor.execute(create_sql)
-                            logger.info(f"Таблица {table_name} создана успешно")
-                        except Exception as e:
-                            # Если таблица уже существует, это нормально
-                            if "already exists" in str(e).lower():
-                                logger.info(f"Таблица {table_name} уже существует")
-                            else:
-                                logger.error(f"Ошибка создания таблицы {table_name}: {e}")
-                                raise
+                    # Другие процессы бота ждут, пока миграцию выполняет один
+                    await cursor.execute(migrations.acquire_migration_lock, (MIGRATION_LOCK_TIMEOUT,))
+                    locked = await cursor.fetchone()
+                    if not locked or locked[0] != 1:
+                        raise RuntimeError("Не удалось получить блокировку миграций схемы")
                     
-                    await conn.commit()
-            logger.info("Все таблицы созданы/проверены в БД")
+                    try:
+                        await cursor.execute(migrations.get_schema_version)
+                        row = await cursor.fetchone()
+                        version = int(row[0]) if row else 0
+                        
+                        for migration in migrations.MIGRATIONS:
+                            if migration.version <= version:
+                                continue
+                            logger.info("Применение миграции %s: %s", migration.version, migration.description)
+                            # DDL в MySQL не откатывается, поэтому каждое изменение таблицы - один запрос
+                            for statement in migration.statements:
+                                await cursor.execute(statement)
+                            await cursor.execute(migrations.add_schema_version, (migration.version, migration.description))
+                            await conn.commit()
+                            version = migration.version
+                    finally:
+                        await cursor.execute(migrations.release_migration_lock)
+            
+            logger.info("Схема БД в актуальной версии %s", version)
+            return version
         except Exception as e:
-            logger.error(f"Ошибка создания таблиц: {e}")
+            logger.error("Ошибка миграции схемы БД: %s", e)
             raise
     
+    async def check_query_plans(self) -> dict[str, list[str]]:
+        """
+        Выполняет EXPLAIN для каждого запроса из sql/texts.py и ищет
+        полные сканирования таблиц и сортировки без индекса. Для SQLite
+        используется EXPLAIN QUERY PLAN.
+        
+        Returns:
+            Словарь имя запроса -> список найденных проблем (пустой, если план в порядке)
+        """
+        report: dict[str, list[str]] = {}
+        sqlite = dialect_of(self.pool) == "sqlite"
+        explain = "EXPLAIN QUERY PLAN" if sqlite else "EXPLAIN"
+        
+        async with self.pool.acquire() as conn:
+            async with conn.cursor(aiomysql.DictCursor) as cursor:
+                for name, query in vars(texts).items():
+                    if name.startswith("_") or not isinstance(query, str):
+                        continue
+                    if query.lstrip().split(" ", 1)[0].upper() not in ("SELECT", "UPDATE", "DELETE"):
+                        continue
+                    if "{" in query:
+                        # Шаблон: проверяется вариант без подстановок
+                        query = query.format_map(_TemplateDefaults())
+                    
+                    # Для плана значения параметров не важны, важна их форма
+                    params = (1,) * query.count("%s")
+                    try:
+                        await cursor.execute(f"{explain} {query}", params)
+                        plan = await cursor.fetchall()
+                    except Exception as e:
+                        report[name] = [f"EXPLAIN не выполнен: {e}"]
+                        continue
+                    
+                    if sqlite:
+                        report[name] = _sqlite_plan_issues(plan)
+                        continue
+
+                    issues = []
+                    for step in plan:
+                        table = step.get("table")
+                        extra = step.get("Extra") or ""
+                        # Производная таблица (подзапрос во FROM) уже ограничена и читается целиком
+                        if step.get("type") == "ALL" and not str(table).startswith("<derived"):
+                            issues.append(f"полное сканирование {table}")
+                        if "filesort" in extra:
+                            issues.append(f"сортировка без индекса в {table}")
+                        if "temporary" in extra:
+                            issues.append(f"временная таблица для {table}")
+                    report[name] = issues
+        
+        for name, issues in report.items():
+            if issues:
+                logger.warning("План запроса %s: %s", name, "; ".join(issues))
+            else:
+                logger.debug("План запроса %s использует индексы", name)
+        problems = sum(1 for issues in report.values() if issues)
+        logger.info("Проверено планов запросов: %s, с замечаниями: %s", len(report), problems)
+        return report
+    
     async def check_database_connection(self) -> bool:
         """
         Проверяет подключение к базе данных
@@ -61,7 +155,7 @@ class DatabaseService(BaseService):
                     result = await cursor.fetchone()
                     return result is not None
         except Exception as e:
-            logger.error(f"Ошибка проверки подключения к БД: {e}")
+            logger.error("Ошибка проверки подключения к БД: %s", e)
             return False
     
     async def get_database_info(self) -> dict:
@@ -79,6 +173,17 @@ class DatabaseService(BaseService):
                     version = await cursor.fetchone()
                     
                     # Получаем размер базы данных
+                    if dialect_of(self.pool) == "sqlite":
+                        await cursor.execute(
+                            "SELECT ROUND(page_count * page_size / 1024.0 / 1024.0, 2)"
+                            " FROM pragma_page_count(), pragma_page_size()"
+                        )
+                        size = await cursor.fetchone()
+                        return {
+                            "version": version[0] if version else "Unknown",
+                            "size_mb": size[0] if size else 0
+                        }
+                    
                     await cursor.execute("""
                         SELECT 
                             ROUND(SUM(data_length + index_length) / 1024 / 1024, 2) AS 'DB Size in MB'
@@ -92,5 +197,5 @@ class DatabaseService(BaseService):
                         "size_mb": size[0] if size else 0
                     }
         except Exception as e:
-            logger.error(f"Ошибка получения информации о БД: {e}")
+            logger.error("Ошибка получения информации о БД: %s", e)
             return {"version": "Unknown", "size_mb": 0}
@@ -0,0 +1,130 @@
+"""
+Хранилище FSM в MySQL, общее для всех процессов бота
+"""
+import json
+import time
+from collections.abc import Mapping
+from typing import Any, Optional
+
+from aiogram.exceptions import DataNotDictLikeError
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, KeyBuilder, StateType, StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+
+from .backends import Pool
+from constants import FSM_CACHE_TTL
+from sql import texts
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+
+class MySQLStorage(BaseStorage):
+    """
+    FSM-хранилище в таблице fsm_storage с локальным write-through кэшем.
+
+    Состояние операторов переживает перезапуск и видно всем процессам.
+    Запись идёт сразу в БД и в кэш, чтение - из кэша, пока запись в нём
+    моложе cache_ttl секунд; так изменения из другого процесса видны
+    не позже чем через cache_ttl.
+
+    Клиенты бота FSM не используют, а состояние читается на каждом апдейте,
+    поэтому ключи с chat_id вне persistent_ids живут только в памяти процесса
+    и не стоят запросов к БД.
+    """
+
+    def __init__(
+        self,
+        pool: Pool,
+        persistent_ids: Optional[set[int]] = None,
+        cache_ttl: float = FSM_CACHE_TTL,
+        key_builder: Optional[KeyBuilder] = None,
+    ):
+        """
+        Args:
+            pool: Пул соединений с БД
+            persistent_ids: chat_id, чьё состояние хранится в БД (None - все)
+            cache_ttl: Время жизни записи локального кэша в секундах
+            key_builder: Построитель строкового ключа
+        """
+        self.pool = pool
+        self.persistent_ids = persistent_ids
+        self.cache_ttl = cache_ttl
+        self.key_builder = key_builder or DefaultKeyBuilder(with_bot_id=True, with_destiny=True)
+        self._local = MemoryStorage()
+        # storage_key -> (момент чтения, state, data)
+        self._cache: dict[str, tuple[float, Optional[str], dict[str, Any]]] = {}
+
+    def _is_persistent(self, key: StorageKey) -> bool:
+        return self.persistent_ids is None or key.chat_id in self.persistent_ids
+
+    async def _load(self, key: StorageKey) -> tuple[Optional[str], dict[str, Any]]:
+        """Читает запись из кэша или из БД"""
+        storage_key = self.key_builder.build(key)
+        cached = self._cache.get(storage_key)
+        if cached is not None and time.monotonic() - cached[0] < self.cache_ttl:
+            return cached[1], cached[2]
+
+        try:
+            async with self.pool.acquire() as conn:
+                async with conn.cursor() as cursor:
+                    await cursor.execute(texts.fsm_get, (storage_key,))
+                    row = await cursor.fetchone()
+        except Exception as e:
+            logger.error("Ошибка чтения состояния FSM %s: %s", storage_key, e)
+            raise
+
+        state, data = (row[0], json.loads(row[1]) if row[1] else {}) if row else (None, {})
+        self._cache[storage_key] = (time.monotonic(), state, data)
+        return state, data
+
+    async def _save(self, key: StorageKey, query: str, state: Optional[str], data: dict[str, Any]) -> None:
+        """Пишет запись в БД и в кэш"""
+        storage_key = self.key_builder.build(key)
+        payload = json.dumps(data, ensure_ascii=False)
+        try:
+            async with self.pool.acquire() as conn:
+                async with conn.cursor() as cursor:
+                    await cursor.execute(query, (storage_key, state, payload))
+                    await conn.commit()
+        except Exception as e:
+            self._cache.pop(storage_key, None)
+            logger.error("Ошибка записи состояния FSM %s: %s", storage_key, e)
+            raise
+        self._cache[storage_key] = (time.monotonic(), state, data)
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        if not self._is_persistent(key):
+            return await self._local.set_state(key, state)
+
+        state = state.state if isinstance(state, State) else state
+        _, data = await self._load(key)
+        await self._save(key, texts.fsm_set_state, state, data)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        if not self._is_persistent(key):
+            return await self._local.get_state(key)
+
+        state, _ = await self._load(key)
+        return state
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        if not isinstance(data, dict):
+            msg = f"Data must be a dict or dict-like object, got {type(data).__name__}"
+            raise DataNotDictLikeError(msg)
+        if not self._is_persistent(key):
+            return await self._local.set_data(key, data)
+
+        state, _ = await self._load(key)
+        await self._save(key, texts.fsm_set_data, state, data.copy())
+
+    async def get_data(self, key: StorageKey) -> dict[str, Any]:
+        if not self._is_persistent(key):
+            return await self._local.get_data(key)
+
+        _, data = await self._load(key)
+        return data.copy()
+
+    async def close(self) -> None:
+        self._cache.clear()
+        await self._local.close()
@@ -0,0 +1,306 @@
+"""
+Буфер отложенной записи сообщений в БД
+"""
+import asyncio
+from datetime import datetime
+from typing import Callable, NamedTuple, Optional
+
+from .backends import Connection, Pool
+from .base_service import CommitOutcomeUnknown
+from .unit_of_work import outside_unit_of_work
+from constants import MESSAGE_BATCH_INTERVAL_MS, MESSAGE_BATCH_QUEUE_SIZE, MESSAGE_BATCH_SIZE
+from sql import texts
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+
+class PendingMessage(NamedTuple):
+    """Сообщение, ожидающее записи в БД"""
+    tgid: int
+    session_id: int
+    direction: str
+    text: Optional[str]
+    file_id: Optional[str]
+    content_type: Optional[str]
+    file_unique_id: Optional[str]
+    media_group_id: Optional[str]
+    created_at: datetime
+
+
+# Сообщение и future, которую ждёт write(): id строки или ошибка записи
+_Entry = tuple[PendingMessage, Optional[asyncio.Future]]
+
+# Регистрирует обработчик фиксации или отката транзакции обновления
+_Hook = Callable[[Callable[[], None]], None]
+
+
+class MessageWriteBuffer:
+    """
+    Копит сообщения и пишет их в БД одним многострочным INSERT.
+
+    Пачка сбрасывается, когда набралось batch_size сообщений или прошло
+    flush_interval_ms с первого сообщения пачки. Очередь ограничена:
+    при переполнении put() ждёт, пока фоновая запись её не разгрузит.
+    Ошибки записи сообщений из put() только пишутся в лог; write() ждёт
+    записи своего сообщения и получает её ошибку.
+
+    Соединение из пула берётся до блокировки буфера, а обновление, которое
+    уже держит соединение, сбрасывает буфер через него (flush_into), так
+    что держатель блокировки никогда не ждёт свободного соединения.
+    """
+
+    def __init__(
+        self,
+        pool: Pool,
+        on_flushed: Callable[[list[tuple[int, PendingMessage]]], None],
+        batch_size: int = MESSAGE_BATCH_SIZE,
+        flush_interval_ms: int = MESSAGE_BATCH_INTERVAL_MS,
+        max_queue_size: int = MESSAGE_BATCH_QUEUE_SIZE,
+    ):
+        """
+        Args:
+            pool: Пул соединений с БД
+            on_flushed: Вызывается с парами (id в БД, сообщение) после записи
+            batch_size: Максимальный размер пачки
+            flush_interval_ms: Максимальное время ожидания пачки
+            max_queue_size: Максимальный размер очереди
+        """
+        self.pool = pool
+        self.on_flushed = on_flushed
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval_ms / 1000
+        self._queue: asyncio.Queue[_Entry] = asyncio.Queue(maxsize=max_queue_size)
+        self._pending: list[_Entry] = []
+        self._lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self._retries: set[asyncio.Task] = set()
+        self._closed = False
+
+    async def put(self, message: PendingMessage) -> None:
+        """
+        Ставит сообщение в очередь на запись
+
+        Args:
+            message: Сообщение для записи
+        """
+        await self._enqueue((message, None))
+
+    async def write(self, message: PendingMessage) -> int:
+        """
+        Ставит сообщение в очередь и ждёт, пока пачка с ним будет записана
+
+        Args:
+            message: Сообщение для записи
+
+        Returns:
+            ID сообщения в БД
+        """
+        written = asyncio.get_running_loop().create_future()
+        await self._enqueue((message, written))
+        return await written
+
+    async def _enqueue(self, entry: _Entry) -> None:
+        if self._closed:
+            raise RuntimeError("Буфер сообщений уже закрыт")
+        if self._task is None:
+            self._task = asyncio.create_task(self._detached_run())
+            logger.info("Фоновая запись сообщений запущена")
+        if self._queue.full():
+            logger.warning("Очередь записи сообщений переполнена, ожидаем сброса")
+        await self._queue.put(entry)
+
+    async def flush(self) -> None:
+        """Немедленно записывает всё, что накопилось в буфере, через соединение из пула"""
+        if not self._pending and self._queue.empty():
+            return
+        async with self.pool.acquire() as conn:
+            async with self._lock:
+                batch = self._take()
+                try:
+                    for start in range(0, len(batch), self.batch_size):
+                        await self._write(conn, batch[start:start + self.batch_size])
+                except BaseException as e:
+                    # Ожидающие write() не должны зависнуть, если запись прервана
+                    for _, written in batch:
+                        _fail(written, e)
+                    raise
+
+    async def flush_into(self, conn: Connection, after_commit: _Hook, after_rollback: _Hook) -> list[PendingMessage]:
+        """
+        Записывает всё, что накопилось в буфере, в транзакции обновления.
+
+        Строки сразу передаются в on_flushed, чтобы обновление их видело;
+        write() получает id после фиксации транзакции, а при откате
+        сообщения снова встают в очередь.
+
+        Args:
+            conn: Соединение обновления с открытой транзакцией
+            after_commit: Регистрирует обработчик фиксации транзакции обновления
+            after_rollback: Регистрирует обработчик её отката
+
+        Returns:
+            Записанные сообщения
+        """
+        if not self._pending and self._queue.empty():
+            return []
+        async with self._lock:
+            batch = self._take()
+            results: list[tuple[int, _Entry]] = []
+            try:
+                for start in range(0, len(batch), self.batch_size):
+                    chunk = batch[start:start + self.batch_size]
+                    first_id = await self._execute(conn, [message for message, _ in chunk])
+                    results.extend((first_id + i, entry) for i, entry in enumerate(chunk))
+            except BaseException:
+                # Многострочный INSERT атомарен: упавшая и следующие пачки не записаны
+                self._requeue(batch[len(results):])
+                raise
+            finally:
+                if results:
+                    self.on_flushed([(message_id, message) for message_id, (message, _) in results])
+                    after_commit(lambda: _resolve(results))
+                    after_rollback(lambda: self._requeue([entry for _, entry in results]))
+            logger.debug("Записано сообщений в транзакции обновления: %s", len(results))
+            return [message for _, (message, _) in results]
+
+    def _take(self) -> list[_Entry]:
+        """Забирает все накопленные сообщения; вызывается под блокировкой"""
+        while not self._queue.empty():
+            self._pending.append(self._queue.get_nowait())
+        batch, self._pending = self._pending, []
+        return batch
+
+    def _requeue(self, entries: list[_Entry]) -> None:
+        """Возвращает незаписанные сообщения в начало очереди и запускает их запись"""
+        if not entries:
+            return
+        self._pending[:0] = entries
+        task = asyncio.create_task(self._detached_flush())
+        self._retries.add(task)
+        task.add_done_callback(self._retries.discard)
+
+    async def _detached_flush(self) -> None:
+        with outside_unit_of_work():
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error("Ошибка повторной записи сообщений: %s", e)
+
+    async def close(self) -> None:
+        """Останавливает фоновую запись и сбрасывает остаток в БД"""
+        self._closed = True
+        if self._task is not None:
+            # Под блокировкой фоновая задача не может быть посреди записи пачки
+            async with self._lock:
+                self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await asyncio.gather(*self._retries, return_exceptions=True)
+        await self.flush()
+        logger.info("Буфер сообщений сброшен и закрыт")
+
+    async def _detached_run(self) -> None:
+        """Фоновая запись запускается из обновления, но пишет в своих транзакциях"""
+        with outside_unit_of_work():
+            await self._run()
+
+    async def _run(self) -> None:
+        """Собирает пачки из очереди и пишет их в БД"""
+        loop = asyncio.get_running_loop()
+        while True:
+            self._pending.append(await self._queue.get())
+            deadline = loop.time() + self.flush_interval
+
+            while len(self._pending) < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    self._pending.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error("Ошибка фоновой записи сообщений: %s", e)
+
+    async def _write(self, conn: Connection, batch: list[_Entry]) -> None:
+        """Пишет пачку одним INSERT, при ошибке - построчно"""
+        messages = [message for message, _ in batch]
+        try:
+            first_id = await self._insert(conn, messages)
+            # Для INSERT с известным числом строк InnoDB выдаёт id подряд
+            results = [(first_id + i, entry) for i, entry in enumerate(batch)]
+            logger.debug("Записано сообщений одной пачкой: %s", len(batch))
+        except CommitOutcomeUnknown as e:
+            # Пачка могла записаться: построчный повтор продублировал бы сообщения
+            logger.error("Неизвестно, записана ли пачка из %s сообщений: %s", len(batch), e)
+            for _, written in batch:
+                _fail(written, e)
+            return
+        except Exception as e:
+            # Ошибка до COMMIT откатила транзакцию пачки: ни одна строка не записана
+            logger.error("Ошибка пакетной записи %s сообщений, пишем построчно: %s", len(batch), e)
+            results = []
+            for message, written in batch:
+                try:
+                    results.append((await self._insert(conn, [message]), (message, written)))
+                except Exception as row_error:
+                    logger.error("Сообщение пользователя %s в сессии %s потеряно: %s", message.tgid, message.session_id, row_error)
+                    _fail(written, row_error)
+
+        if results:
+            self.on_flushed([(message_id, message) for message_id, (message, _) in results])
+        _resolve(results)
+
+    async def _insert(self, conn: Connection, batch: list[PendingMessage]) -> int:
+        """
+        Выполняет многострочный INSERT в явной транзакции и возвращает id первой строки.
+
+        Пул работает в autocommit, и без BEGIN строки фиксировались бы ещё
+        в execute; в транзакции любая ошибка до COMMIT значит, что ничего
+        не записано, а ошибка самого COMMIT - CommitOutcomeUnknown
+        """
+        await conn.begin()
+        try:
+            message_id = await self._execute(conn, batch)
+        except BaseException:
+            await conn.rollback()
+            raise
+        try:
+            await conn.commit()
+        except Exception as e:
+            raise CommitOutcomeUnknown(e) from e
+        return message_id
+
+    @staticmethod
+    async def _execute(conn: Connection, batch: list[PendingMessage]) -> int:
+        """Выполняет многострочный INSERT и возвращает id первой строки"""
+        query = texts.log_messages_batch.format(
+            values=", ".join([texts.log_message_values] * len(batch))
+        )
+        params = tuple(value for message in batch for value in message)
+        async with conn.cursor() as cursor:
+            await cursor.execute(query, params)
+            return int(cursor.lastrowid)
+
+
+def _resolve(results: list[tuple[int, _Entry]]) -> None:
+    """Передаёт id записанных строк ожидающим write()"""
+    for message_id, (_, written) in results:
+        if written is not None and not written.done():
+            written.set_result(message_id)
+
+
+def _fail(written: Optional[asyncio.Future], error: BaseException) -> None:
+    """Передаёт ошибку записи ожидающему write()"""
+    if written is not None and not written.done():
+        if isinstance(error, asyncio.CancelledError):
+            written.cancel()
+        else:
+            written.set_exception(error)
@@ -3,15 +3,93 @@
 """
 from typing import Optional, Sequence, Any
 from datetime import datetime
-from .base_service import BaseService
+from .base_service import BaseService, CommitOutcomeUnknown
+from .message_buffer import MessageWriteBuffer, PendingMessage
+from .transcript_cache import TranscriptCache
+from .unit_of_work import current_unit_of_work
 from sql import texts
-from constants import MESSAGE_DIRECTIONS
+from constants import ATTACHMENTS_OPEN_ALL_LIMIT, MESSAGE_DIRECTIONS, TRANSCRIPT_PAGE_SIZE
+from utils.attachments import Attachment, StoredAttachment
+from utils.render_messages import SessionTranscript, build_transcript
 
 
 class MessageService(BaseService):
     """Сервис для управления сообщениями"""
     
-    async def log_message(self, tgid: int, session_id: int, direction: str, text: Optional[str], file_id: Optional[str]) -> None:
+    def __init__(self, pool, transcript_cache: Optional[TranscriptCache] = None, batch_logging: bool = False):
+        """
+        Инициализация сервиса сообщений
+        
+        Args:
+            pool: Пул соединений с БД
+            transcript_cache: Кэш отрендеренных историй сессий
+            batch_logging: Писать сообщения в БД отложенно, пачками
+        """
+        super().__init__(pool)
+        self.transcript_cache = transcript_cache if transcript_cache is not None else TranscriptCache()
+        self.write_buffer = MessageWriteBuffer(pool, self._on_batch_flushed) if batch_logging else None
+    
+    async def flush_pending(self) -> None:
+        """
+        Дописывает в БД сообщения, ожидающие в буфере, чтобы их можно было прочитать.
+        
+        Внутри обновления запись идёт через его соединение и транзакцию: второе
+        соединение из пула при нехватке соединений ждало бы обновлений, которые
+        сами держат соединения и ждут этого сброса
+        """
+        if self.write_buffer is None:
+            return
+        uow = current_unit_of_work()
+        if uow is not None and not uow.closed:
+            async with self._connection() as conn:
+                if uow.owns(conn):
+                    written = await self.write_buffer.flush_into(conn, self._after_commit, self._after_rollback)
+                    # При откате строки снова в очереди, а история перечитается из БД
+                    for session_id in {message.session_id for message in written}:
+                        self._after_rollback(lambda session_id=session_id: self.transcript_cache.invalidate(session_id))
+                    return
+        await self.write_buffer.flush()
+    
+    async def close(self) -> None:
+        """Сбрасывает буфер сообщений в БД и останавливает фоновую запись"""
+        if self.write_buffer is not None:
+            await self.write_buffer.close()
+    
+    def _on_batch_flushed(self, written: list[tuple[int, PendingMessage]]) -> None:
+        """Дописывает записанную пачку в кэш историй"""
+        for message_id, message in written:
+            self.transcript_cache.append(
+                message.session_id, message_id, message.direction, message.text, message.file_id, message.created_at,
+                message.media_group_id,
+            )
+    
+    @staticmethod
+    def _pending_message(
+        tgid: int,
+        session_id: int,
+        direction: str,
+        text: Optional[str],
+        attachment: Optional[Attachment],
+        media_group_id: Optional[str],
+        created_at: datetime,
+    ) -> PendingMessage:
+        """Собирает строку messages для записи"""
+        file_id, content_type, file_unique_id = (
+            (attachment.file_id, attachment.content_type, attachment.file_unique_id) if attachment else (None, None, None)
+        )
+        return PendingMessage(
+            tgid, session_id, direction, text, file_id, content_type, file_unique_id, media_group_id, created_at
+        )
+    
+    async def log_message(
+        self,
+        tgid: int,
+        session_id: int,
+        direction: str,
+        text: Optional[str],
+        attachment: Optional[Attachment],
+        wait: bool = False,
+    ) -> None:
         """
         Логирует сообщение в БД
         
@@ -20,61 +98,288 @@ class MessageService(BaseService):
             session_id: ID сессии
             direction: Направление сообщения (fromUser/fromAgent)
             text: Текст сообщения
-            file_id: ID файла (если есть)
+            attachment: Вложение (если есть)
+            wait: При пакетной записи дождаться записи сообщения и поднять её ошибку
+            
+        Raises:
+            CommitOutcomeUnknown: Ошибка COMMIT - сообщение могло быть записано
+        """
+        self.logger.debug("Логирование сообщения: tgid=%s, session_id=%s, direction=%s", tgid, session_id, direction)
+        
+        # Время задаём сами, чтобы строка в кэше истории совпадала с записью в БД
+        created_at = datetime.now().replace(microsecond=0)
+        message = self._pending_message(tgid, session_id, direction, text, attachment, None, created_at)
+        
+        if self.write_buffer is not None:
+            if wait:
+                try:
+                    await self.write_buffer.write(message)
+                except CommitOutcomeUnknown:
+                    # Строка могла записаться: история перечитается из БД
+                    self.transcript_cache.invalidate(session_id)
+                    raise
+                self.logger.debug("Сообщение записано в БД пачкой")
+            else:
+                await self.write_buffer.put(message)
+                self.logger.debug("Сообщение поставлено в очередь записи")
+            return
+        
+        try:
+            # Явная транзакция: в autocommit строка фиксировалась бы ещё в execute,
+            # и повтор после ошибки записал бы её второй раз
+            async with self._transaction() as conn:
+                async with conn.cursor() as cursor:
+                    await cursor.execute(texts.log_message, message)
+                    message_id = int(cursor.lastrowid)
+            # Панель текущего обновления должна видеть сообщение сразу, а при откате
+            # транзакции обновления история перечитается из БД
+            self.transcript_cache.append(session_id, message_id, direction, text, message.file_id, created_at)
+            self._after_rollback(lambda: self.transcript_cache.invalidate(session_id))
+            self.logger.debug("Сообщение залогировано в БД")
+        except CommitOutcomeUnknown as e:
+            self.logger.error("Неизвестно, записано ли сообщение: %s", e)
+            self.transcript_cache.invalidate(session_id)
+            raise
+        except Exception as e:
+            self.logger.error("Ошибка логирования сообщения: %s", e)
+            raise
+    
+    async def log_album(
+        self,
+        tgid: int,
+        session_id: int,
+        direction: str,
+        items: Sequence[tuple[Optional[str], Optional[Attachment]]],
+        media_group_id: str,
+    ) -> None:
+        """
+        Логирует сообщения альбома одним многострочным INSERT
+        
+        Args:
+            tgid: Telegram ID пользователя
+            session_id: ID сессии
+            direction: Направление сообщений (fromUser/fromAgent)
+            items: Пары (текст, вложение) в порядке сообщений альбома
+            media_group_id: ID альбома в Telegram
         """
-        self.logger.debug(f"Логирование сообщения: tgid={tgid}, session_id={session_id}, direction={direction}")
+        self.logger.debug("Логирование альбома %s из %s сообщений: tgid=%s, session_id=%s", media_group_id, len(items), tgid, session_id)
         
+        created_at = datetime.now().replace(microsecond=0)
+        batch = [
+            self._pending_message(tgid, session_id, direction, text, attachment, media_group_id, created_at)
+            for text, attachment in items
+        ]
+        
+        if self.write_buffer is not None:
+            for message in batch:
+                await self.write_buffer.put(message)
+            self.logger.debug("Альбом поставлен в очередь записи")
+            return
+        
+        query = texts.log_messages_batch.format(values=", ".join([texts.log_message_values] * len(batch)))
+        params = tuple(value for message in batch for value in message)
         try:
-            async with self.pool.acquire() as conn:
+            async with self._transaction() as conn:
                 async with conn.cursor() as cursor:
-                    await cursor.execute(texts.log_message, (tgid, session_id, direction, text, file_id))
-                    await conn.commit()
-            self.logger.debug(f"Сообщение залогировано в БД")
+                    await cursor.execute(query, params)
+                    # Для INSERT с известным числом строк InnoDB выдаёт id подряд
+                    first_id = int(cursor.lastrowid)
+            for i, message in enumerate(batch):
+                self.transcript_cache.append(
+                    session_id, first_id + i, direction, message.text, message.file_id, created_at, media_group_id
+                )
+            self._after_rollback(lambda: self.transcript_cache.invalidate(session_id))
+            self.logger.debug("Альбом залогирован в БД")
         except Exception as e:
-            self.logger.error(f"Ошибка логирования сообщения: {e}")
+            self.logger.error("Ошибка логирования альбома %s: %s", media_group_id, e)
             raise
     
-    async def get_session_messages(self, tgid: int, session_id: int) -> Sequence[tuple[Any, ...]]:
+    async def get_session_messages(self, tgid: int, session_id: int, limit: int = TRANSCRIPT_PAGE_SIZE) -> Sequence[tuple[Any, ...]]:
         """
-        Получает сообщения сессии
+        Получает последние сообщения сессии
         
         Args:
             tgid: Telegram ID пользователя
             session_id: ID сессии
+            limit: Максимальное количество сообщений
             
         Returns:
-            Список сообщений
+            Список сообщений в хронологическом порядке
         """
+        await self.flush_pending()
+        
         try:
-            async with self.pool.acquire() as conn:
+            async with self._connection() as conn:
                 async with conn.cursor() as cursor:
-                    await cursor.execute(texts.fetch_session_messages, (tgid, session_id))
-                    return await cursor.fetchall()
+                    await cursor.execute(texts.fetch_session_messages, (tgid, session_id, limit))
+                    rows = await cursor.fetchall()
+            return list(reversed(rows))
         except Exception as e:
-            self.logger.error(f"Ошибка получения сообщений сессии {session_id}: {e}")
+            self.logger.error("Ошибка получения сообщений сессии %s: %s", session_id, e)
+            raise
+    
+    async def get_session_transcript(self, tgid: int, session_id: int) -> SessionTranscript:
+        """
+        Получает окно последних сообщений сессии, перечитывая БД только при промахе кэша
+        
+        Args:
+            tgid: Telegram ID пользователя
+            session_id: ID сессии
+            
+        Returns:
+            История сессии
+        """
+        await self.flush_pending()
+        
+        transcript = self.transcript_cache.get(session_id)
+        if transcript is not None:
+            return transcript
+        
+        self.logger.debug("История сессии %s не найдена в кэше, пересборка окна", session_id)
+        token = self.transcript_cache.begin_load(session_id)
+        try:
+            # Читаем на одну строку больше, чтобы узнать, есть ли сообщения старше окна
+            msgs = await self.get_session_messages(tgid, session_id, limit=TRANSCRIPT_PAGE_SIZE + 1)
+        except Exception:
+            self.transcript_cache.cancel_load(session_id)
             raise
+        return self._cache_window(session_id, msgs, token)
     
-    async def get_message_file(self, message_id: int) -> tuple[Optional[str], Optional[int]]:
+    def _cache_window(self, session_id: int, msgs: Sequence[tuple[Any, ...]], token: int) -> SessionTranscript:
+        """Собирает окно истории из последних TRANSCRIPT_PAGE_SIZE + 1 сообщений и кладёт его в кэш"""
+        has_older = len(msgs) > TRANSCRIPT_PAGE_SIZE
+        transcript = build_transcript(msgs[-TRANSCRIPT_PAGE_SIZE:], max_entries=TRANSCRIPT_PAGE_SIZE, has_older=has_older)
+        self.transcript_cache.put(session_id, transcript, token)
+        return transcript
+    
+    async def get_session_view(self, session_id: int) -> Optional[tuple[dict, SessionTranscript]]:
         """
-        Получает file_id и session_id сообщения
+        Получает заголовок сессии и окно её истории одним запросом
+        
+        Если история уже в кэше, запрос читает только заголовок.
+        
+        Args:
+            session_id: ID сессии
+            
+        Returns:
+            Кортеж (информация о сессии, история) или None, если сессии нет
+        """
+        await self.flush_pending()
+        
+        transcript = self.transcript_cache.get(session_id)
+        limit = 0 if transcript is not None else TRANSCRIPT_PAGE_SIZE + 1
+        token = self.transcript_cache.begin_load(session_id) if transcript is None else None
+        try:
+            async with self._connection() as conn:
+                async with conn.cursor() as cursor:
+                    await cursor.execute(
+                        texts.get_session_view_with_messages, (session_id, session_id, limit, session_id)
+                    )
+                    rows = await cursor.fetchall()
+        except Exception as e:
+            if token is not None:
+                self.transcript_cache.cancel_load(session_id)
+            self.logger.error("Ошибка получения сессии %s с историей: %s", session_id, e)
+            raise
+        
+        if not rows:
+            if token is not None:
+                self.transcript_cache.cancel_load(session_id)
+            return None
+        
+        header = rows[0]
+        info = {
+            "session_id": int(header[0]),
+            "tgid": int(header[1]),
+            "username": header[2],
+            "assigned_agent": (int(header[3]) if header[3] is not None else None),
+            "status": header[4],
+        }
+        if token is not None:
+            # LEFT JOIN без сообщений даёт одну строку с NULL; порядок окна - (created_at, id)
+            msgs = sorted((row[5:] for row in rows if row[5] is not None), key=lambda msg: (msg[5], msg[0]))
+            transcript = self._cache_window(session_id, msgs, token)
+        return info, transcript
+    
+    async def get_transcript_page(self, tgid: int, session_id: int, older: bool, created_at: datetime, message_id: int) -> SessionTranscript:
+        """
+        Получает страницу истории сессии относительно курсора (created_at, id)
+        
+        Args:
+            tgid: Telegram ID пользователя
+            session_id: ID сессии
+            older: True - сообщения старше курсора, False - новее
+            created_at: Время сообщения-курсора
+            message_id: ID сообщения-курсора
+            
+        Returns:
+            Страница истории (не кэшируется)
+        """
+        query = texts.fetch_session_messages_before if older else texts.fetch_session_messages_after
+        params = (tgid, session_id, created_at, created_at, message_id, TRANSCRIPT_PAGE_SIZE + 1)
+        await self.flush_pending()
+        
+        try:
+            async with self._connection() as conn:
+                async with conn.cursor() as cursor:
+                    await cursor.execute(query, params)
+                    rows = list(await cursor.fetchall())
+        except Exception as e:
+            self.logger.error("Ошибка получения страницы истории сессии %s: %s", session_id, e)
+            raise
+        
+        has_more = len(rows) > TRANSCRIPT_PAGE_SIZE
+        rows = rows[:TRANSCRIPT_PAGE_SIZE]
+        if older:
+            rows.reverse()
+            return build_transcript(rows, has_older=has_more, has_newer=True)
+        return build_transcript(rows, has_older=True, has_newer=has_more, from_oldest=True)
+    
+    async def get_message_file(self, message_id: int) -> tuple[Optional[str], Optional[str], Optional[int]]:
+        """
+        Получает file_id, тип вложения и session_id сообщения
         
         Args:
             message_id: ID сообщения
             
         Returns:
-            Кортеж (file_id, session_id)
+            Кортеж (file_id, content_type, session_id)
         """
         try:
-            async with self.pool.acquire() as conn:
+            async with self._connection() as conn:
                 async with conn.cursor() as cursor:
                     await cursor.execute(texts.get_message_file, (message_id,))
                     row = await cursor.fetchone()
-                    return (row[0], row[1]) if row else (None, None)
+                    return (row[0], row[1], row[2]) if row else (None, None, None)
         except Exception as e:
-            self.logger.error(f"Ошибка получения файла сообщения {message_id}: {e}")
+            self.logger.error("Ошибка получения файла сообщения %s: %s", message_id, e)
             raise
     
-    async def log_user_message(self, tgid: int, session_id: int, text: Optional[str], file_id: Optional[str]) -> None:
+    async def get_session_attachments(self, tgid: int, session_id: int, limit: int = ATTACHMENTS_OPEN_ALL_LIMIT) -> list[StoredAttachment]:
+        """
+        Получает последние вложения сессии
+        
+        Args:
+            tgid: Telegram ID пользователя
+            session_id: ID сессии
+            limit: Максимальное количество вложений
+            
+        Returns:
+            Вложения в хронологическом порядке
+        """
+        await self.flush_pending()
+        
+        try:
+            async with self._connection() as conn:
+                async with conn.cursor() as cursor:
+                    await cursor.execute(texts.fetch_session_attachments, (tgid, session_id, limit))
+                    rows = await cursor.fetchall()
+            return [StoredAttachment(*row) for row in reversed(rows)]
+        except Exception as e:
+            self.logger.error("Ошибка получения вложений сессии %s: %s", session_id, e)
+            raise
+    
+    async def log_user_message(self, tgid: int, session_id: int, text: Optional[str], attachment: Optional[Attachment]) -> None:
         """
         Логирует сообщение от пользователя
         
@@ -82,30 +387,56 @@ class MessageService(BaseService):
             tgid: Telegram ID пользователя
             session_id: ID сессии
             text: Текст сообщения
-            file_id: ID файла
+            attachment: Вложение (если есть)
         """
         await self.log_message(
             tgid=tgid,
             session_id=session_id,
             direction=MESSAGE_DIRECTIONS["FROM_USER"],
             text=text,
-            file_id=file_id
+            attachment=attachment
+        )
+    
+    async def log_user_album(
+        self,
+        tgid: int,
+        session_id: int,
+        items: Sequence[tuple[Optional[str], Optional[Attachment]]],
+        media_group_id: str,
+    ) -> None:
+        """
+        Логирует альбом от пользователя
+        
+        Args:
+            tgid: Telegram ID пользователя
+            session_id: ID сессии
+            items: Пары (текст, вложение) в порядке сообщений альбома
+            media_group_id: ID альбома в Telegram
+        """
+        await self.log_album(
+            tgid=tgid,
+            session_id=session_id,
+            direction=MESSAGE_DIRECTIONS["FROM_USER"],
+            items=items,
+            media_group_id=media_group_id
         )
     
-    async def log_agent_message(self, tgid: int, session_id: int, text: Optional[str], file_id: Optional[str]) -> None:
+    async def log_agent_message(self, tgid: int, session_id: int, text: Optional[str], attachment: Optional[Attachment]) -> None:
         """
-        Логирует сообщение от агента
+        Логирует сообщение от агента. Ответ уже доставлен клиенту и пишется
+        в фоне, поэтому при пакетной записи ждём её, чтобы узнать об ошибке
         
         Args:
             tgid: Telegram ID пользователя
             session_id: ID сессии
             text: Текст сообщения
-            file_id: ID файла
+            attachment: Вложение (если есть)
         """
         await self.log_message(
             tgid=tgid,
             session_id=session_id,
             direction=MESSAGE_DIRECTIONS["FROM_AGENT"],
             text=text,
-            file_id=file_id
+            attachment=attachment,
+            wait=True
         )
@@ -2,13 +2,17 @@
 Сервис для отправки уведомлений
 """
 import asyncio
-from typing import Set, Optional
+from typing import TYPE_CHECKING, Set, Optional
 from aiogram import Bot
 from aiogram.types import InlineKeyboardButton
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 from .base_service import BaseService
 from config import get_admin_ids
 from utils.logger import get_logger
+from utils.outbound import Priority, outbound_priority
+
+if TYPE_CHECKING:
+    from utils.post_send import PostSendPipeline
 
 
 class NotificationService(BaseService):
@@ -35,25 +39,43 @@ class NotificationService(BaseService):
             username: Имя пользователя
             session_id: ID сессии
         """
-        self.logger.info(f"Отправка уведомления админам о новой сессии {session_id} для пользователя {tgid}")
+        self.logger.info("Отправка уведомления админам о новой сессии %s для пользователя %s", session_id, tgid)
         
         # Формируем текст уведомления
         uline = f"@{username}" if username else "(без username)"
         text = f"Новая сессия\nКлиент: #{tgid} {uline}"
-        self.logger.debug(f"Текст уведомления: {text}")
+        self.logger.debug("Текст уведомления: %s", text)
 
         # Создаем клавиатуру
         keyboard = self._create_session_keyboard(session_id)
-        self.logger.debug(f"Создана клавиатура для сессии {session_id}")
+        self.logger.debug("Создана клавиатура для сессии %s", session_id)
 
         # Получаем список админов
         admins = get_admin_ids()
-        self.logger.info(f"Отправка уведомления {len(admins)} админам: {admins}")
+        self.logger.info("Отправка уведомления %s админам: %s", len(admins), admins)
 
         # Отправляем уведомления параллельно
         await self._send_notifications_to_admins(admins, text, keyboard)
         
-        self.logger.info(f"Уведомления о сессии {session_id} отправлены всем админам")
+        self.logger.info("Уведомления о сессии %s отправлены всем админам", session_id)
+    
+    def schedule_new_session_notice(self, post_send: "PostSendPipeline", tgid: int, username: Optional[str], session_id: int) -> None:
+        """
+        Ставит уведомление админам о новой сессии в фоновые операции.
+        
+        Уведомления идут в самой медленной очереди отправки (сообщение в секунду
+        на чат админа), поэтому обработчик /start их не ждёт и не держит
+        транзакцию обновления; уходят они только после фиксации сессии
+        
+        Args:
+            post_send: Фоновые операции после отправки
+            tgid: Telegram ID пользователя
+            username: Имя пользователя
+            session_id: ID сессии
+        """
+        self._after_commit(lambda: post_send.submit(
+            "notify_new_session", lambda: self.notify_new_session(tgid, username, session_id)
+        ))
     
     def _create_session_keyboard(self, session_id: int) -> InlineKeyboardBuilder:
         """
@@ -74,20 +96,22 @@ class NotificationService(BaseService):
     
     async def _send_notifications_to_admins(self, admins: Set[int], text: str, keyboard: InlineKeyboardBuilder) -> None:
         """
-        Отправляет уведомления всем админам
+        Отправляет уведомления всем админам. Уведомления уходят после
+        ответов и обновлений панелей, в пределах лимитов Telegram
         
         Args:
             admins: Множество ID админов
             text: Текст уведомления
             keyboard: Клавиатура
         """
-        tasks = []
-        for admin_id in admins:
-            task = self._send_single_notification(admin_id, text, keyboard.as_markup())
-            tasks.append(task)
-        
-        # Выполняем все отправки параллельно
-        await asyncio.gather(*tasks, return_exceptions=True)
+        with outbound_priority(Priority.NOTIFICATION):
+            tasks = []
+            for admin_id in admins:
+                task = self._send_single_notification(admin_id, text, keyboard.as_markup())
+                tasks.append(task)
+            
+            # Отправки ставятся в очередь параллельно, темп задает очередь
+            await asyncio.gather(*tasks, return_exceptions=True)
     
     async def _send_single_notification(self, admin_id: int, text: str, keyboard) -> None:
         """
@@ -100,20 +124,20 @@ class NotificationService(BaseService):
         """
         try:
             await self.bot.send_message(admin_id, text, reply_markup=keyboard)
-            self.logger.info(f"Уведомление отправлено админу {admin_id}")
+            self.logger.info("Уведомление отправлено админу %s", admin_id)
         except Exception as e:
             # Добавляем контекстную информацию об ошибке
             error_msg = str(e).lower()
             if "blocked" in error_msg or "bot was blocked" in error_msg:
-                self.logger.warning(f"Админ {admin_id} заблокировал бота")
+                self.logger.warning("Админ %s заблокировал бота", admin_id)
             elif "chat not found" in error_msg:
-                self.logger.warning(f"Чат с админом {admin_id} не найден")
+                self.logger.warning("Чат с админом %s не найден", admin_id)
             elif "forbidden" in error_msg:
-                self.logger.warning(f"Нет прав для отправки сообщения админу {admin_id}")
+                self.logger.warning("Нет прав для отправки сообщения админу %s", admin_id)
             elif "message too long" in error_msg:
-                self.logger.error(f"Сообщение слишком длинное для админа {admin_id}")
+                self.logger.error("Сообщение слишком длинное для админа %s", admin_id)
             else:
-                self.logger.exception(f"Не удалось отправить уведомление админу {admin_id}: {e}")
+                self.logger.exception("Не удалось отправить уведомление админу %s: %s", admin_id, e)
     
     async def send_message_to_user(self, user_id: int, text: str, parse_mode: Optional[str] = None) -> None:
         """
@@ -126,20 +150,20 @@ class NotificationService(BaseService):
         """
         try:
             await self.bot.send_message(user_id, text, parse_mode=parse_mode)
-            self.logger.info(f"Сообщение отправлено пользователю {user_id}")
+            self.logger.info("Сообщение отправлено пользователю %s", user_id)
         except Exception as e:
             # Добавляем контекстную информацию об ошибке
             error_msg = str(e).lower()
             if "blocked" in error_msg or "bot was blocked" in error_msg:
-                self.logger.warning(f"Пользователь {user_id} заблокировал бота")
+                self.logger.warning("Пользователь %s заблокировал бота", user_id)
             elif "chat not found" in error_msg:
-                self.logger.warning(f"Чат с пользователем {user_id} не найден")
+                self.logger.warning("Чат с пользователем %s не найден", user_id)
             elif "forbidden" in error_msg:
-                self.logger.warning(f"Нет прав для отправки сообщения пользователю {user_id}")
+                self.logger.warning("Нет прав для отправки сообщения пользователю %s", user_id)
             elif "message too long" in error_msg:
-                self.logger.error(f"Сообщение слишком длинное для пользователя {user_id}")
+                self.logger.error("Сообщение слишком длинное для пользователя %s", user_id)
             else:
-                self.logger.error(f"Ошибка отправки сообщения пользователю {user_id}: {e}")
+                self.logger.error("Ошибка отправки сообщения пользователю %s: %s", user_id, e)
             raise
     
     async def send_photo_to_user(self, user_id: int, photo_file_id: str, caption: Optional[str] = None) -> None:
@@ -153,9 +177,9 @@ class NotificationService(BaseService):
         """
         try:
             await self.bot.send_photo(user_id, photo_file_id, caption=caption)
-            self.logger.info(f"Фото отправлено пользователю {user_id}")
+            self.logger.info("Фото отправлено пользователю %s", user_id)
         except Exception as e:
-            self.logger.error(f"Ошибка отправки фото пользователю {user_id}: {e}")
+            self.logger.error("Ошибка отправки фото пользователю %s: %s", user_id, e)
             raise
     
     async def send_document_to_user(self, user_id: int, document_file_id: str, caption: Optional[str] = None) -> None:
@@ -169,7 +193,7 @@ class NotificationService(BaseService):
         """
         try:
             await self.bot.send_document(user_id, document_file_id, caption=caption)
-            self.logger.info(f"Документ отправлен пользователю {user_id}")
+            self.logger.info("Документ отправлен пользователю %s", user_id)
         except Exception as e:
-            self.logger.error(f"Ошибка отправки документа пользователю {user_id}: {e}")
+            self.logger.error("Ошибка отправки документа пользователю %s: %s", user_id, e)
             raise
@@ -0,0 +1,70 @@
+"""
+Память чтений сервисов в пределах одного обновления
+"""
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Hashable, Iterator, Optional
+
+_current: ContextVar[Optional["RequestMemo"]] = ContextVar("request_memo", default=None)
+
+# Отличает отсутствие значения от сохранённого None
+MISSING = object()
+
+
+def current_memo() -> Optional["RequestMemo"]:
+    """Возвращает память текущего обновления, если она открыта"""
+    memo = _current.get()
+    return memo if memo is not None and not memo.closed else None
+
+
+class RequestMemo:
+    """
+    Результаты чтений по ключу (сервис, метод, аргументы).
+
+    Живёт, пока обрабатывается одно обновление: повторное чтение тех же
+    данных берётся из памяти, а запись, меняющая их, удаляет ключ.
+    Значения общие для всех вызовов, поэтому их нельзя изменять.
+    """
+
+    def __init__(self):
+        self.closed = False
+        self._values: dict[tuple[str, str, Hashable], Any] = {}
+
+    def get(self, service: str, method: str, args: Hashable) -> Any:
+        """Возвращает сохранённое значение или MISSING"""
+        return self._values.get((service, method, args), MISSING)
+
+    def put(self, service: str, method: str, args: Hashable, value: Any) -> None:
+        """Сохраняет значение до конца обновления"""
+        if not self.closed:
+            self._values[(service, method, args)] = value
+
+    def forget(self, service: str, method: str, args: Hashable) -> None:
+        """Удаляет значение, устаревшее после записи"""
+        self._values.pop((service, method, args), None)
+
+    def close(self) -> None:
+        """Очищает память; фоновые задачи, унаследовавшие её, больше ничего не сохранят"""
+        self.closed = True
+        self._values.clear()
+
+
+@contextmanager
+def request_memo() -> Iterator[RequestMemo]:
+    """
+    Открывает память чтений для текущего контекста.
+
+    Вложенный вызов использует уже открытую память.
+    """
+    memo = current_memo()
+    if memo is not None:
+        yield memo
+        return
+
+    memo = RequestMemo()
+    token = _current.set(memo)
+    try:
+        yield memo
+    finally:
+        _current.reset(token)
+        memo.close()
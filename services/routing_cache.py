@@ -0,0 +1,179 @@
+"""
+Кэш маршрутизации входящих сообщений клиентов
+"""
+import time
+from collections import OrderedDict
+from typing import NamedTuple, Optional
+
+from constants import ROUTING_CACHE_SIZE
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+
+class RoutingEntry(NamedTuple):
+    """Открытая сессия клиента и закреплённый за ней оператор"""
+    session_id: int
+    assigned_agent: Optional[int]
+    username: Optional[str]
+
+
+class RoutingCache:
+    """
+    Ограниченный LRU-кэш tgid -> открытая сессия.
+
+    Данные меняются только при /start, взятии и закрытии сессии,
+    поэтому сервисы обновляют кэш сами, а входящие сообщения
+    известных клиентов обходятся без запросов к БД. Изменения, сделанные
+    другими процессами бота, кэш не видит, поэтому при нескольких
+    процессах запись живёт не дольше ttl секунд с момента чтения из БД.
+    """
+
+    def __init__(self, max_size: int = ROUTING_CACHE_SIZE, ttl: float = 0):
+        """
+        Args:
+            max_size: Максимальное количество клиентов в кэше
+            ttl: Время жизни записи в секундах; 0 - без срока
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        # tgid -> (момент сохранения, сессия)
+        self._entries: OrderedDict[int, tuple[float, RoutingEntry]] = OrderedDict()
+        self._tgid_by_session: dict[int, int] = {}
+        # tgid -> [число незавершённых загрузок, число изменений во время загрузки]
+        self._loading: dict[int, list[int]] = {}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, tgid: int) -> Optional[RoutingEntry]:
+        """
+        Возвращает закэшированную сессию клиента
+
+        Args:
+            tgid: Telegram ID пользователя
+
+        Returns:
+            RoutingEntry или None, если клиента нет в кэше или запись устарела
+        """
+        cached = self._entries.get(tgid)
+        if cached is None:
+            return None
+        if self.ttl and time.monotonic() - cached[0] >= self.ttl:
+            self.invalidate(tgid)
+            return None
+        self._entries.move_to_end(tgid)
+        return cached[1]
+
+    def begin_load(self, tgid: int) -> int:
+        """
+        Отмечает начало чтения сессии клиента из БД
+
+        Args:
+            tgid: Telegram ID пользователя
+
+        Returns:
+            Токен, который нужно передать в put()
+        """
+        state = self._loading.setdefault(tgid, [0, 0])
+        state[0] += 1
+        return state[1]
+
+    def cancel_load(self, tgid: int) -> int:
+        """
+        Отмечает завершение чтения без сохранения в кэш
+
+        Args:
+            tgid: Telegram ID пользователя
+
+        Returns:
+            Текущее число изменений во время загрузки
+        """
+        state = self._loading[tgid]
+        state[0] -= 1
+        if state[0] == 0:
+            del self._loading[tgid]
+        return state[1]
+
+    def put(self, tgid: int, entry: RoutingEntry, token: Optional[int] = None) -> None:
+        """
+        Сохраняет открытую сессию клиента, вытесняя самые старые записи.
+
+        Если во время чтения из БД сессию клиента взяли или закрыли,
+        прочитанная запись могла устареть - такая запись не кэшируется.
+
+        Args:
+            tgid: Telegram ID пользователя
+            entry: Данные открытой сессии
+            token: Токен из begin_load(); без него запись - свежее изменение
+        """
+        if token is not None:
+            if self.cancel_load(tgid) != token:
+                logger.debug("Сессия клиента %s изменилась во время загрузки и не кэширована", tgid)
+                return
+        else:
+            self._mark_loads(tgid)
+
+        previous = self._entries.pop(tgid, None)
+        if previous is not None:
+            self._tgid_by_session.pop(previous[1].session_id, None)
+
+        self._entries[tgid] = (time.monotonic(), entry)
+        self._tgid_by_session[entry.session_id] = tgid
+
+        while len(self._entries) > self.max_size:
+            old_tgid, (_, old_entry) = self._entries.popitem(last=False)
+            self._tgid_by_session.pop(old_entry.session_id, None)
+            logger.debug("Клиент %s вытеснен из кэша маршрутизации", old_tgid)
+
+    def set_assigned_agent(self, session_id: int, agent_id: Optional[int]) -> None:
+        """
+        Обновляет оператора сессии, если она есть в кэше
+
+        Args:
+            session_id: ID сессии
+            agent_id: ID оператора
+        """
+        tgid = self._tgid_by_session.get(int(session_id))
+        self._mark_loads(tgid)
+        if tgid is None:
+            return
+        # Срок жизни записи не продлевается: остальные поля могли устареть
+        stored_at, entry = self._entries[tgid]
+        self._entries[tgid] = (stored_at, entry._replace(assigned_agent=agent_id))
+
+    def invalidate(self, tgid: int) -> None:
+        """
+        Удаляет клиента из кэша
+
+        Args:
+            tgid: Telegram ID пользователя
+        """
+        self._mark_loads(tgid)
+        cached = self._entries.pop(tgid, None)
+        if cached is not None:
+            self._tgid_by_session.pop(cached[1].session_id, None)
+
+    def invalidate_session(self, session_id: int) -> None:
+        """
+        Удаляет из кэша клиента, которому принадлежит сессия
+
+        Args:
+            session_id: ID сессии
+        """
+        tgid = self._tgid_by_session.pop(int(session_id), None)
+        self._mark_loads(tgid)
+        if tgid is not None:
+            self._entries.pop(tgid, None)
+
+    def _mark_loads(self, tgid: Optional[int]) -> None:
+        """
+        Помечает загрузки, которые могли прочитать данные до изменения;
+        если клиент сессии неизвестен - все идущие загрузки
+        """
+        if tgid is not None:
+            states = [self._loading[tgid]] if tgid in self._loading else []
+        else:
+            states = self._loading.values()
+        for state in states:
+            state[1] += 1
@@ -0,0 +1,145 @@
+"""
+Счётчики сессий, поддерживаемые в памяти процесса
+"""
+from typing import Iterable, Optional
+
+from constants import SESSION_STATUS
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+
+class SessionCounters:
+    """
+    Количество открытых и закрытых сессий по операторам.
+
+    Загружается из БД одним GROUP BY и дальше обновляется сервисом
+    сессий при открытии, взятии и закрытии, поэтому заголовки списков
+    сессий не требуют COUNT(*) на каждое нажатие. Изменения из других
+    процессов бота подтягиваются периодической сверкой с БД.
+    """
+
+    def __init__(self):
+        # assigned_agent -> число сессий (None - без оператора); None - ещё не загружено
+        self._open_by_agent: Optional[dict[Optional[int], int]] = None
+        self._closed_by_agent: dict[Optional[int], int] = {}
+        self._open_assigned = 0
+        self._closed_total = 0
+        # Число изменений, учтённых с момента создания
+        self._changes = 0
+
+    @property
+    def loaded(self) -> bool:
+        return self._open_by_agent is not None
+
+    def begin_load(self) -> int:
+        """
+        Отмечает начало загрузки счётчиков из БД
+
+        Returns:
+            Токен, который нужно передать в load()
+        """
+        return self._changes
+
+    def load(self, rows: Iterable[tuple[str, Optional[int], int]], token: int) -> bool:
+        """
+        Заменяет счётчики данными из БД.
+
+        Если во время загрузки сессии менялись, прочитанные данные
+        могли их не учесть - такие данные отбрасываются.
+
+        Args:
+            rows: Тройки (status, assigned_agent, количество)
+            token: Токен из begin_load()
+
+        Returns:
+            True, если счётчики загружены
+        """
+        if token != self._changes:
+            logger.debug("Счётчики сессий изменились во время загрузки")
+            return False
+
+        open_by_agent: dict[Optional[int], int] = {}
+        closed_by_agent: dict[Optional[int], int] = {}
+        for status, agent, count in rows:
+            target = open_by_agent if status == SESSION_STATUS["OPEN"] else closed_by_agent
+            target[int(agent) if agent is not None else None] = int(count)
+
+        if self.loaded and (open_by_agent != self._open_by_agent or closed_by_agent != self._closed_by_agent):
+            logger.info("Счётчики сессий расходились с БД и исправлены сверкой")
+
+        self._open_by_agent = open_by_agent
+        self._closed_by_agent = closed_by_agent
+        self._open_assigned = sum(count for agent, count in open_by_agent.items() if agent is not None)
+        self._closed_total = sum(closed_by_agent.values())
+        return True
+
+    def waiting(self) -> int:
+        """Количество открытых сессий без оператора"""
+        return (self._open_by_agent or {}).get(None, 0)
+
+    def assigned_to(self, agent_id: int) -> int:
+        """Количество открытых сессий оператора"""
+        return (self._open_by_agent or {}).get(int(agent_id), 0)
+
+    def assigned_to_others(self, agent_id: int) -> int:
+        """Количество открытых сессий других операторов"""
+        return max(0, self._open_assigned - self.assigned_to(agent_id))
+
+    def closed(self, agent_id: Optional[int] = None) -> int:
+        """
+        Возвращает количество закрытых сессий
+
+        Args:
+            agent_id: ID оператора (None - все сессии)
+
+        Returns:
+            Количество закрытых сессий
+        """
+        if agent_id is None:
+            return self._closed_total
+        return self._closed_by_agent.get(int(agent_id), 0)
+
+    def session_opened(self) -> None:
+        """Учитывает открытие новой сессии"""
+        self._changes += 1
+        if self._open_by_agent is not None:
+            self._add(self._open_by_agent, None, 1)
+
+    def session_assigned(self, agent_id: int) -> None:
+        """
+        Учитывает взятие сессии без оператора
+
+        Args:
+            agent_id: Оператор, взявший сессию
+        """
+        self._changes += 1
+        if self._open_by_agent is not None:
+            self._add(self._open_by_agent, None, -1)
+            self._add(self._open_by_agent, int(agent_id), 1)
+            self._open_assigned += 1
+
+    def session_closed(self, assigned_agent: Optional[int]) -> None:
+        """
+        Учитывает закрытие сессии
+
+        Args:
+            assigned_agent: Оператор, за которым была закреплена сессия
+        """
+        self._changes += 1
+        if self._open_by_agent is None:
+            return
+        key = int(assigned_agent) if assigned_agent is not None else None
+        self._add(self._open_by_agent, key, -1)
+        self._add(self._closed_by_agent, key, 1)
+        if key is not None:
+            self._open_assigned -= 1
+        self._closed_total += 1
+
+    @staticmethod
+    def _add(counts: dict[Optional[int], int], key: Optional[int], delta: int) -> None:
+        value = counts.get(key, 0) + delta
+        if value > 0:
+            counts[key] = value
+        else:
+            counts.pop(key, None)
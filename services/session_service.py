@@ -1,15 +1,44 @@
 """
 Сервис для управления сессиями
 """
+import asyncio
+from datetime import datetime
 from typing import Optional, Sequence, Any
 from .base_service import BaseService
+from .message_service import MessageService
+from .routing_cache import RoutingCache, RoutingEntry
+from .session_counters import SessionCounters
 from sql import texts
-from constants import SESSION_TYPES, SESSION_STATUS, CLOSED_PER_PAGE
+from utils.render_messages import SessionTranscript
+from constants import SESSION_TYPES, CLOSED_PER_PAGE, SESSIONS_PER_PAGE, SESSION_COUNTERS_RECONCILE_INTERVAL
 
 
 class SessionService(BaseService):
     """Сервис для управления сессиями чатов"""
     
+    def __init__(
+        self,
+        pool,
+        routing_cache: Optional[RoutingCache] = None,
+        counters: Optional[SessionCounters] = None,
+        message_service: Optional[MessageService] = None,
+    ):
+        """
+        Инициализация сервиса сессий
+        
+        Args:
+            pool: Пул соединений с БД
+            routing_cache: Кэш маршрутизации сообщений клиентов
+            counters: Счётчики сессий
+            message_service: Сервис сообщений (история сессии при взятии)
+        """
+        super().__init__(pool)
+        self.routing_cache = routing_cache if routing_cache is not None else RoutingCache()
+        self.counters = counters if counters is not None else SessionCounters()
+        self.message_service = message_service if message_service is not None else MessageService(pool)
+        self._counters_lock = asyncio.Lock()
+        self._reconcile_task: Optional[asyncio.Task] = None
+    
     async def create_session(self, tgid: int) -> int:
         """
         Создает новую сессию для пользователя
@@ -20,61 +49,107 @@ class SessionService(BaseService):
         Returns:
             ID созданной сессии
         """
-        self.logger.debug(f"Создание новой сессии для пользователя {tgid}")
+        self.logger.debug("Создание новой сессии для пользователя %s", tgid)
         
         try:
-            async with self.pool.acquire() as conn:
+            async with self._connection() as conn:
                 async with conn.cursor() as cursor:
                     await cursor.execute(texts.openCreate_session, (tgid,))
                     session_id = int(cursor.lastrowid)
-                    await conn.commit()
-            self.logger.info(f"Создана новая сессия {session_id} для пользователя {tgid}")
+                    await self._commit(conn)
+            self.logger.info("Создана новая сессия %s для пользователя %s", session_id, tgid)
             return session_id
         except Exception as e:
-            self.logger.error(f"Ошибка создания сессии для пользователя {tgid}: {e}")
+            self.logger.error("Ошибка создания сессии для пользователя %s: %s", tgid, e)
             raise
     
-    async def ensure_open_session(self, tgid: int) -> int:
+    async def ensure_open_session(self, tgid: int, username: Optional[str] = None) -> tuple[int, bool]:
         """
         Обеспечивает наличие открытой сессии для пользователя
         
         Args:
             tgid: Telegram ID пользователя
+            username: Имя пользователя в Telegram (для кэша маршрутизации)
             
         Returns:
-            ID открытой сессии
+            Кортеж (ID открытой сессии, создана ли она этим вызовом)
         """
-        self.logger.debug(f"Обеспечение открытой сессии для пользователя {tgid}")
+        self.logger.debug("Обеспечение открытой сессии для пользователя %s", tgid)
         
         try:
-            async with self.pool.acquire() as conn:
+            async with self._connection() as conn:
                 async with conn.cursor() as cursor:
-                    # Проверяем существующую сессию
-                    await cursor.execute(texts.find_open_session, (tgid,))
-                    row = await cursor.fetchone()
+                    # Вторую открытую сессию не даёт создать уникальный индекс по open_tgid.
+                    # При конфликте LAST_INSERT_ID(id) возвращает id уже открытой сессии,
+                    # а затронутых строк 0 вместо 1 у новой - всё за один запрос
+                    await cursor.execute(texts.upsert_open_session, (tgid,))
+                    session_id = int(cursor.lastrowid)
+                    created = cursor.rowcount == 1
                     
-                    if row and row[0]:
-                        session_id = int(row[0])
-                        self.logger.debug(f"Найдена существующая сессия {session_id} для пользователя {tgid}")
+                    if created:
+                        self.logger.info("Создана новая сессия %s для пользователя %s", session_id, tgid)
+                        # Привязываем сессию к пользователю
+                        await cursor.execute(texts.bind_current_session_to_user, (session_id, tgid))
                     else:
-                        # Создаем новую сессию
-                        await cursor.execute(texts.openCreate_session, (tgid,))
-                        session_id = int(cursor.lastrowid)
-                        self.logger.info(f"Создана новая сессия {session_id} для пользователя {tgid}")
-                    
-                    # Привязываем сессию к пользователю
-                    await cursor.execute(texts.bind_current_session_to_user, (session_id, tgid))
-                    await conn.commit()
+                        self.logger.debug("Найдена существующая сессия %s для пользователя %s", session_id, tgid)
+                    await self._commit(conn)
             
-            self.logger.debug(f"Сессия {session_id} привязана к пользователю {tgid}")
-            return session_id
+            # Новая сессия ещё ни за кем не закреплена, а про существующую
+            # кэш мог устареть - её перечитаем при следующем сообщении
+            cached = self.routing_cache.get(tgid)
+            if created:
+                def on_commit() -> None:
+                    self.routing_cache.put(tgid, RoutingEntry(session_id, None, username))
+                    self.counters.session_opened()
+                self._after_commit(on_commit)
+            elif cached is not None and cached.session_id != session_id:
+                self.routing_cache.invalidate(tgid)
+            
+            self.logger.debug("Сессия %s привязана к пользователю %s", session_id, tgid)
+            return session_id, created
         except Exception as e:
-            self.logger.error(f"Ошибка обеспечения сессии для пользователя {tgid}: {e}")
+            self.logger.error("Ошибка обеспечения сессии для пользователя %s: %s", tgid, e)
             raise
     
+    async def get_open_session_route(self, tgid: int) -> Optional[RoutingEntry]:
+        """
+        Получает открытую сессию клиента и её оператора, сначала из кэша
+        
+        Args:
+            tgid: Telegram ID пользователя
+            
+        Returns:
+            RoutingEntry или None, если открытой сессии нет
+        """
+        entry = self.routing_cache.get(tgid)
+        if entry is not None:
+            return entry
+        
+        # Взятие или закрытие сессии во время чтения не даст закэшировать устаревшую запись
+        token = self.routing_cache.begin_load(tgid)
+        try:
+            rows = await self._execute_query(texts.get_open_session_route, (tgid,))
+        except Exception as e:
+            self.routing_cache.cancel_load(tgid)
+            self.logger.error("Ошибка получения открытой сессии пользователя %s: %s", tgid, e)
+            raise
+        
+        if not rows:
+            self.routing_cache.cancel_load(tgid)
+            return None
+        
+        row = rows[0]
+        entry = RoutingEntry(
+            session_id=int(row[0]),
+            assigned_agent=(int(row[1]) if row[1] is not None else None),
+            username=row[2],
+        )
+        self.routing_cache.put(tgid, entry, token)
+        return entry
+    
     async def get_session_info(self, session_id: int) -> Optional[dict]:
         """
-        Получает информацию о сессии
+        Получает информацию о сессии; в пределах обновления читает БД один раз
         
         Args:
             session_id: ID сессии
@@ -82,8 +157,14 @@ class SessionService(BaseService):
         Returns:
             Словарь с информацией о сессии или None
         """
+        return await self._memoized(
+            "get_session_info", int(session_id), lambda: self._load_session_info(session_id)
+        )
+    
+    async def _load_session_info(self, session_id: int) -> Optional[dict]:
+        """Читает информацию о сессии из БД"""
         try:
-            async with self.pool.acquire() as conn:
+            async with self._connection() as conn:
                 async with conn.cursor() as cursor:
                     await cursor.execute(texts.get_session_view, (session_id,))
                     row = await cursor.fetchone()
@@ -98,7 +179,7 @@ class SessionService(BaseService):
                 "assigned_agent": (int(row[3]) if row[3] is not None else None),
             }
         except Exception as e:
-            self.logger.error(f"Ошибка получения информации о сессии {session_id}: {e}")
+            self.logger.error("Ошибка получения информации о сессии %s: %s", session_id, e)
             raise
     
     async def assign_session(self, session_id: int, agent_id: int) -> bool:
@@ -112,7 +193,7 @@ class SessionService(BaseService):
         Returns:
             True если назначение успешно, False иначе
         """
-        self.logger.info(f"Назначение сессии {session_id} оператору {agent_id}")
+        self.logger.info("Назначение сессии %s оператору %s", session_id, agent_id)
         
         try:
             changed = await self._execute_update(
@@ -120,12 +201,60 @@ class SessionService(BaseService):
                 (agent_id, session_id, agent_id)
             )
             success = changed == 1
-            self.logger.info(f"Назначение сессии {session_id} оператору {agent_id}: {'успешно' if success else 'неудачно'}")
+            self._forget("get_session_info", int(session_id))
+            if success:
+                def on_commit() -> None:
+                    self.routing_cache.set_assigned_agent(session_id, agent_id)
+                    self.counters.session_assigned(agent_id)
+                self._after_commit(on_commit)
+            self.logger.info("Назначение сессии %s оператору %s: %s", session_id, agent_id, 'успешно' if success else 'неудачно')
             return success
         except Exception as e:
-            self.logger.error(f"Ошибка назначения сессии {session_id} оператору {agent_id}: {e}")
+            self.logger.error("Ошибка назначения сессии %s оператору %s: %s", session_id, agent_id, e)
             raise
     
+    async def claim_session(self, session_id: int, agent_id: int) -> Optional[tuple[dict, SessionTranscript]]:
+        """
+        Берёт сессию оператором и сразу загружает её для панели
+        
+        Назначение и чтение заголовка с окном истории выполняются в одной
+        транзакции (в обработчике - на соединении единицы работы) двумя
+        запросами вместо трёх. Успех определяется по прочитанной строке,
+        поэтому повторное взятие своей сессии тоже успешно.
+        
+        Args:
+            session_id: ID сессии
+            agent_id: ID оператора
+            
+        Returns:
+            Кортеж (информация о сессии, история) или None, если сессия
+            закрыта, не найдена или занята другим оператором
+        """
+        self.logger.info("Взятие сессии %s оператором %s", session_id, agent_id)
+        
+        try:
+            async with self._transaction() as conn:
+                async with conn.cursor() as cursor:
+                    await cursor.execute(texts.claim_session, (agent_id, session_id))
+                    assigned = cursor.rowcount == 1
+                self._forget("get_session_info", int(session_id))
+                view = await self.message_service.get_session_view(session_id)
+        except Exception as e:
+            self.logger.error("Ошибка взятия сессии %s оператором %s: %s", session_id, agent_id, e)
+            raise
+        
+        if view is None or view[0]["status"] != "open" or view[0]["assigned_agent"] != agent_id:
+            self.logger.info("Сессия %s недоступна оператору %s", session_id, agent_id)
+            return None
+        
+        if assigned:
+            def on_commit() -> None:
+                self.routing_cache.set_assigned_agent(session_id, agent_id)
+                self.counters.session_assigned(agent_id)
+            self._after_commit(on_commit)
+        self.logger.info("Сессия %s взята оператором %s", session_id, agent_id)
+        return view
+    
     async def close_session(self, session_id: int, agent_id: int) -> bool:
         """
         Закрывает сессию агентом
@@ -137,26 +266,37 @@ class SessionService(BaseService):
         Returns:
             True если закрытие успешно, False иначе
         """
-        self.logger.info(f"Закрытие сессии {session_id} агентом {agent_id}")
+        self.logger.info("Закрытие сессии %s агентом %s", session_id, agent_id)
         
         try:
-            changed = await self._execute_update(
-                texts.close_session, 
-                (session_id, agent_id)
-            )
-            success = changed == 1
+            async with self._transaction() as conn:
+                async with conn.cursor() as cursor:
+                    # Блокируем строку, чтобы знать, за кем была сессия в момент закрытия
+                    await cursor.execute(texts.lock_open_session, (session_id,))
+                    row = await cursor.fetchone()
+                    if row:
+                        await cursor.execute(texts.close_session, (session_id,))
+            
+            success = row is not None
             if success:
-                self.logger.info(f"Сессия {session_id} закрыта агентом {agent_id}")
+                assigned_agent = row[0]
+                # До фиксации другое обновление ещё видит сессию открытой и может
+                # снова положить её в кэш, поэтому сбрасываем маршрут после COMMIT
+                def on_commit() -> None:
+                    self.routing_cache.invalidate_session(session_id)
+                    self.counters.session_closed(assigned_agent)
+                self._after_commit(on_commit)
+                self.logger.info("Сессия %s закрыта агентом %s", session_id, agent_id)
             else:
-                self.logger.warning(f"Не удалось закрыть сессию {session_id} агентом {agent_id}")
+                self.logger.warning("Не удалось закрыть сессию %s агентом %s", session_id, agent_id)
             return success
         except Exception as e:
-            self.logger.error(f"Ошибка закрытия сессии {session_id} агентом {agent_id}: {e}")
+            self.logger.error("Ошибка закрытия сессии %s агентом %s: %s", session_id, agent_id, e)
             raise
     
     async def count_sessions(self, kind: str, agent_id: Optional[int] = None) -> int:
         """
-        Подсчитывает количество сессий определенного типа
+        Возвращает количество открытых сессий определенного типа из счётчиков в памяти
         
         Args:
             kind: Тип сессии (toServe, processing_mine, processing)
@@ -165,87 +305,75 @@ class SessionService(BaseService):
         Returns:
             Количество сессий
         """
+        if kind not in SESSION_TYPES.values():
+            raise ValueError(f"kind must be one of: {list(SESSION_TYPES.values())}")
+        
+        if not self.counters.loaded:
+            await self.load_counters()
+        
         if kind == SESSION_TYPES["TO_SERVE"]:
-            # Оптимизированный запрос для ожидающих сессий
-            sql = "SELECT COUNT(*) FROM sessions s WHERE s.status = %s AND s.assigned_agent IS NULL"
-            params = (SESSION_STATUS['OPEN'],)
+            return self.counters.waiting()
         elif kind == SESSION_TYPES["PROCESSING_MINE"]:
-            # Оптимизированный запрос для моих сессий
-            sql = "SELECT COUNT(*) FROM sessions s WHERE s.status = %s AND s.assigned_agent = %s"
-            params = (SESSION_STATUS['OPEN'], agent_id)
-        elif kind == SESSION_TYPES["PROCESSING"]:
-            # Оптимизированный запрос для сессий других агентов
-            sql = "SELECT COUNT(*) FROM sessions s WHERE s.status = %s AND s.assigned_agent IS NOT NULL AND s.assigned_agent != %s"
-            params = (SESSION_STATUS['OPEN'], agent_id)
+            return self.counters.assigned_to(agent_id)
         else:
-            raise ValueError(f"kind must be one of: {list(SESSION_TYPES.values())}")
-        
-        try:
-            rows = await self._execute_query(sql, params)
-            return int(rows[0][0]) if rows else 0
-        except Exception as e:
-            self.logger.error(f"Ошибка подсчета сессий типа {kind}: {e}")
-            raise
+            return self.counters.assigned_to_others(agent_id)
     
-    async def fetch_sessions(self, kind: str, agent_id: Optional[int] = None) -> Sequence[tuple[Any, ...]]:
+    async def fetch_sessions(
+        self,
+        kind: str,
+        agent_id: Optional[int] = None,
+        cursor: Optional[tuple[datetime, int]] = None,
+        newer: bool = False,
+        limit: int = SESSIONS_PER_PAGE,
+    ) -> tuple[list[tuple[Any, ...]], bool]:
         """
-        Получает список сессий определенного типа
+        Получает страницу открытых сессий определенного типа по ключу (время открытия, id)
         
         Args:
             kind: Тип сессии
             agent_id: ID агента
+            cursor: Ключ (время открытия, id), от которого читается страница (None - первая страница)
+            newer: Читать сессии, открытые позже, иначе - открытые раньше
+            limit: Размер страницы
             
         Returns:
-            Список сессий
+            Сессии от новых к старым и признак того, что в направлении чтения есть ещё страница
         """
         if kind == SESSION_TYPES["TO_SERVE"]:
-            # Оптимизированный запрос для ожидающих сессий
-            sql = """
-                SELECT s.id AS session_id,
-                       s.tgid AS tgid,
-                       u.username
-                FROM sessions s
-                INNER JOIN users u ON u.tgid = s.tgid
-                WHERE s.status = %s AND s.assigned_agent IS NULL
-                ORDER BY COALESCE(u.last_message_at, s.opened_at) DESC, s.id DESC
-            """
-            params = (SESSION_STATUS['OPEN'],)
+            condition, params = texts.open_sessions_waiting, ()
         elif kind == SESSION_TYPES["PROCESSING_MINE"]:
-            # Оптимизированный запрос для моих сессий
-            sql = """
-                SELECT s.id AS session_id,
-                       s.tgid AS tgid,
-                       u.username
-                FROM sessions s
-                INNER JOIN users u ON u.tgid = s.tgid
-                WHERE s.status = %s AND s.assigned_agent = %s
-                ORDER BY COALESCE(u.last_message_at, s.opened_at) DESC, s.id DESC
-            """
-            params = (SESSION_STATUS['OPEN'], agent_id)
+            condition, params = texts.open_sessions_mine, (agent_id,)
         elif kind == SESSION_TYPES["PROCESSING"]:
-            # Оптимизированный запрос для сессий других агентов
-            sql = """
-                SELECT s.id AS session_id,
-                       s.tgid AS tgid,
-                       u.username
-                FROM sessions s
-                INNER JOIN users u ON u.tgid = s.tgid
-                WHERE s.status = %s AND s.assigned_agent IS NOT NULL AND s.assigned_agent != %s
-                ORDER BY COALESCE(u.last_message_at, s.opened_at) DESC, s.id DESC
-            """
-            params = (SESSION_STATUS['OPEN'], agent_id)
+            condition, params = texts.open_sessions_others, (agent_id,)
         else:
             raise ValueError(f"kind must be one of: {list(SESSION_TYPES.values())}")
         
+        seek, order = "", "DESC"
+        if cursor is not None:
+            seek = texts.open_sessions_after if newer else texts.open_sessions_before
+            order = "ASC" if newer else "DESC"
+            opened_at, sid = cursor
+            params += (opened_at, opened_at, sid)
+        
+        # Лишняя строка показывает, есть ли следующая страница, без отдельного COUNT
+        sql = texts.fetch_open_sessions.format(condition=condition, seek=seek, order=order)
+        params += (limit + 1,)
+        
         try:
-            return await self._execute_query(sql, params)
+            rows = list(await self._execute_query(sql, params))
         except Exception as e:
-            self.logger.error(f"Ошибка получения сессий типа {kind}: {e}")
+            self.logger.error("Ошибка получения сессий типа %s: %s", kind, e)
             raise
+        
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        if newer:
+            rows.reverse()
+        return rows, has_more
     
     async def count_closed_sessions(self, only_mine: bool, agent_id: Optional[int]) -> int:
         """
-        Подсчитывает количество закрытых сессий
+        Возвращает количество закрытых сессий из счётчиков в памяти
         
         Args:
             only_mine: Только мои сессии
@@ -254,35 +382,103 @@ class SessionService(BaseService):
         Returns:
             Количество закрытых сессий
         """
-        try:
-            if only_mine:
-                rows = await self._execute_query(texts.count_closed_mine, (agent_id,))
-            else:
-                rows = await self._execute_query(texts.count_closed_all)
-            return int(rows[0][0]) if rows else 0
-        except Exception as e:
-            self.logger.error(f"Ошибка подсчета закрытых сессий: {e}")
-            raise
+        if not self.counters.loaded:
+            await self.load_counters()
+        return self.counters.closed(agent_id if only_mine else None)
+    
+    async def load_counters(self, force: bool = False) -> None:
+        """
+        Загружает счётчики сессий из БД одним запросом
+        
+        Args:
+            force: Перечитать счётчики, даже если они уже загружены (сверка)
+        """
+        async with self._counters_lock:
+            if self.counters.loaded and not force:
+                return
+            try:
+                token = self.counters.begin_load()
+                rows = await self._execute_query(texts.count_sessions_by_agent)
+                if self.counters.load(rows, token):
+                    self.logger.debug(
+                        "Счётчики сессий загружены: ожидают %s, закрыто %s",
+                        self.counters.waiting(), self.counters.closed()
+                    )
+            except Exception as e:
+                self.logger.error("Ошибка загрузки счётчиков сессий: %s", e)
+                raise
+    
+    def start_counters_reconcile(self, interval: float = SESSION_COUNTERS_RECONCILE_INTERVAL) -> None:
+        """
+        Запускает периодическую сверку счётчиков с БД
+        
+        Args:
+            interval: Период сверки в секундах
+        """
+        if self._reconcile_task is None:
+            self._reconcile_task = asyncio.create_task(self._reconcile_counters(interval))
+            self.logger.info("Сверка счётчиков сессий запущена с периодом %s с", interval)
+    
+    async def _reconcile_counters(self, interval: float) -> None:
+        """Периодически перечитывает счётчики, подтягивая изменения других процессов"""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.load_counters(force=True)
+            except Exception as e:
+                self.logger.error("Ошибка сверки счётчиков сессий: %s", e)
     
-    async def fetch_closed_sessions(self, page: int, only_mine: bool, agent_id: Optional[int]) -> Sequence[tuple[Any, ...]]:
+    async def close(self) -> None:
+        """Останавливает сверку счётчиков"""
+        if self._reconcile_task is not None:
+            self._reconcile_task.cancel()
+            try:
+                await self._reconcile_task
+            except asyncio.CancelledError:
+                pass
+            self._reconcile_task = None
+    
+    async def fetch_closed_sessions(
+        self,
+        only_mine: bool,
+        agent_id: Optional[int],
+        cursor: Optional[tuple[datetime, int]] = None,
+        newer: bool = False,
+        limit: int = CLOSED_PER_PAGE,
+    ) -> tuple[list[tuple[Any, ...]], bool]:
         """
-        Получает список закрытых сессий с пагинацией
+        Получает страницу закрытых сессий по ключу (closed_at, id)
         
         Args:
-            page: Номер страницы
             only_mine: Только мои сессии
             agent_id: ID агента
+            cursor: Ключ (closed_at, id), от которого читается страница (None - первая страница)
+            newer: Читать сессии, закрытые позже курсора, иначе - раньше
+            limit: Размер страницы
             
         Returns:
-            Список закрытых сессий
+            Сессии от новых к старым и признак того, что в направлении чтения есть ещё страница
         """
-        offset = (page - 1) * CLOSED_PER_PAGE
+        if cursor is None:
+            query = texts.fetch_closed_mine if only_mine else texts.fetch_closed_all
+            key: tuple = ()
+        else:
+            if newer:
+                query = texts.fetch_closed_mine_after if only_mine else texts.fetch_closed_all_after
+            else:
+                query = texts.fetch_closed_mine_before if only_mine else texts.fetch_closed_all_before
+            closed_at, sid = cursor
+            key = (closed_at, closed_at, sid)
+        params = ((agent_id,) if only_mine else ()) + key + (limit + 1,)
         
         try:
-            if only_mine:
-                return await self._execute_query(texts.fetch_closed_mine, (agent_id, CLOSED_PER_PAGE, offset))
-            else:
-                return await self._execute_query(texts.fetch_closed_all, (CLOSED_PER_PAGE, offset))
+            rows = list(await self._execute_query(query, params))
         except Exception as e:
-            self.logger.error(f"Ошибка получения закрытых сессий: {e}")
+            self.logger.error("Ошибка получения закрытых сессий: %s", e)
             raise
+        
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        if cursor is not None and newer:
+            rows.reverse()
+        return rows, has_more
@@ -0,0 +1,162 @@
+"""
+Кэш отрендеренных историй сессий
+"""
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Optional
+
+from constants import TRANSCRIPT_CACHE_SIZE
+from utils.logger import get_logger
+from utils.render_messages import SessionTranscript
+
+logger = get_logger(__name__)
+
+
+class TranscriptCache:
+    """
+    Ограниченный LRU-кэш session_id -> SessionTranscript.
+
+    Новые сообщения дописываются в уже собранную историю, поэтому
+    панель сессии перестраивается из БД только при промахе кэша.
+    Сообщения, записанные другими процессами бота, сюда не дописываются,
+    поэтому при нескольких процессах история живёт не дольше ttl секунд
+    с момента чтения из БД.
+    """
+
+    def __init__(self, max_size: int = TRANSCRIPT_CACHE_SIZE, ttl: float = 0):
+        """
+        Args:
+            max_size: Максимальное количество сессий в кэше
+            ttl: Время жизни истории в секундах; 0 - без срока
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        # session_id -> (момент сохранения, история)
+        self._transcripts: OrderedDict[int, tuple[float, SessionTranscript]] = OrderedDict()
+        # session_id -> [число незавершённых загрузок, число пропущенных дописываний]
+        self._loading: dict[int, list[int]] = {}
+
+    def __len__(self) -> int:
+        return len(self._transcripts)
+
+    def get(self, session_id: int) -> Optional[SessionTranscript]:
+        """
+        Возвращает закэшированную историю сессии
+
+        Args:
+            session_id: ID сессии
+
+        Returns:
+            SessionTranscript или None при промахе
+        """
+        session_id = int(session_id)
+        transcript = self._fresh(session_id)
+        if transcript is not None:
+            self._transcripts.move_to_end(session_id)
+        return transcript
+
+    def begin_load(self, session_id: int) -> int:
+        """
+        Отмечает начало пересборки истории из БД
+
+        Args:
+            session_id: ID сессии
+
+        Returns:
+            Токен, который нужно передать в put()
+        """
+        state = self._loading.setdefault(int(session_id), [0, 0])
+        state[0] += 1
+        return state[1]
+
+    def cancel_load(self, session_id: int) -> int:
+        """
+        Отмечает завершение пересборки истории без сохранения в кэш
+
+        Args:
+            session_id: ID сессии
+
+        Returns:
+            Текущее число пропущенных дописываний
+        """
+        session_id = int(session_id)
+        state = self._loading[session_id]
+        state[0] -= 1
+        if state[0] == 0:
+            del self._loading[session_id]
+        return state[1]
+
+    def put(self, session_id: int, transcript: SessionTranscript, token: Optional[int] = None) -> None:
+        """
+        Сохраняет историю сессии, вытесняя самые старые записи.
+
+        Если во время пересборки в сессию дописывались сообщения,
+        прочитанная история могла их не увидеть - такая история не кэшируется.
+
+        Args:
+            session_id: ID сессии
+            transcript: Собранная история
+            token: Токен из begin_load()
+        """
+        session_id = int(session_id)
+        if token is not None:
+            stale = self.cancel_load(session_id) != token
+            if stale:
+                logger.debug("История сессии %s устарела во время загрузки и не кэширована", session_id)
+                return
+
+        self._transcripts[session_id] = (time.monotonic(), transcript)
+        self._transcripts.move_to_end(session_id)
+
+        while len(self._transcripts) > self.max_size:
+            old_session_id, _ = self._transcripts.popitem(last=False)
+            logger.debug("История сессии %s вытеснена из кэша", old_session_id)
+
+    def append(
+        self,
+        session_id: int,
+        mid: int,
+        direction: str,
+        text: Optional[str],
+        file_id: Optional[str],
+        dt: datetime,
+        media_group_id: Optional[str] = None,
+    ) -> None:
+        """
+        Дописывает сообщение в историю, если она уже есть в кэше
+
+        Args:
+            session_id: ID сессии
+            mid: ID сообщения в БД
+            direction: Направление сообщения
+            text: Текст сообщения
+            file_id: ID файла
+            dt: Время сообщения
+            media_group_id: ID альбома, если сообщение из альбома
+        """
+        session_id = int(session_id)
+        transcript = self._fresh(session_id)
+        if transcript is not None:
+            transcript.append(mid, direction, text, file_id, dt, media_group_id)
+        elif session_id in self._loading:
+            self._loading[session_id][1] += 1
+
+    def invalidate(self, session_id: int) -> None:
+        """
+        Удаляет историю сессии из кэша
+
+        Args:
+            session_id: ID сессии
+        """
+        self._transcripts.pop(int(session_id), None)
+
+    def _fresh(self, session_id: int) -> Optional[SessionTranscript]:
+        """Возвращает историю, если она есть и не устарела; устаревшую удаляет"""
+        cached = self._transcripts.get(session_id)
+        if cached is None:
+            return None
+        if self.ttl and time.monotonic() - cached[0] >= self.ttl:
+            del self._transcripts[session_id]
+            return None
+        return cached[1]
@@ -0,0 +1,158 @@
+"""
+Единица работы: одно соединение с БД и одна транзакция на обновление
+"""
+import asyncio
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from typing import AsyncIterator, Callable, Iterator, Optional
+
+
+from .backends import Connection, Pool, outside_transaction
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+_current: ContextVar[Optional["UnitOfWork"]] = ContextVar("unit_of_work", default=None)
+
+
+def current_unit_of_work() -> Optional["UnitOfWork"]:
+    """Возвращает единицу работы текущего обновления, если она есть"""
+    return _current.get()
+
+
+class UnitOfWork:
+    """
+    Общее соединение для всех запросов сервисов в рамках одного обновления.
+
+    Соединение берётся из пула при первом запросе, все запросы выполняются
+    в одной транзакции, которая фиксируется в finish(). Доступ к соединению
+    сериализуется: фоновые задачи, запущенные из обработчика, наследуют
+    контекст и могут обратиться к нему одновременно с обработчиком.
+    После finish() единица работы закрыта, и сервисы снова берут
+    соединения из пула.
+    """
+
+    def __init__(self, pool: Pool):
+        """
+        Args:
+            pool: Пул соединений с БД
+        """
+        self.pool = pool
+        self.closed = False
+        self._conn: Optional[Connection] = None
+        self._lock = asyncio.Lock()
+        self._owner: Optional[asyncio.Task] = None
+        self._after_commit: list[Callable[[], None]] = []
+        self._after_rollback: list[Callable[[], None]] = []
+
+    def owns(self, conn: Connection) -> bool:
+        """Проверяет, что соединение принадлежит этой единице работы"""
+        return conn is not None and conn is self._conn
+
+    @asynccontextmanager
+    async def connection(self) -> AsyncIterator[Optional[Connection]]:
+        """
+        Выдаёт общее соединение на время блока.
+
+        Вложенные обращения из той же задачи получают соединение без
+        повторной блокировки. Если единица работы уже закрыта, выдаёт None.
+        """
+        task = asyncio.current_task()
+        if self._owner is task:
+            yield self._conn
+            return
+
+        async with self._lock:
+            if self.closed:
+                yield None
+                return
+            if self._conn is None:
+                self._conn = await self.pool.acquire()
+                await self._conn.begin()
+            self._owner = task
+            try:
+                yield self._conn
+            finally:
+                self._owner = None
+
+    def after_commit(self, callback: Callable[[], None]) -> None:
+        """Откладывает callback до успешной фиксации транзакции"""
+        self._after_commit.append(callback)
+
+    def after_rollback(self, callback: Callable[[], None]) -> None:
+        """Откладывает callback до отката транзакции"""
+        self._after_rollback.append(callback)
+
+    async def finish(self, commit: bool = True) -> None:
+        """
+        Фиксирует или откатывает транзакцию и возвращает соединение в пул
+
+        Args:
+            commit: Зафиксировать транзакцию, иначе - откатить
+        """
+        committed = False
+        async with self._lock:
+            self.closed = True
+            conn, self._conn = self._conn, None
+            try:
+                if conn is not None:
+                    if commit:
+                        await conn.commit()
+                    else:
+                        await conn.rollback()
+                committed = commit
+            except Exception:
+                # Соединение в неизвестном состоянии транзакции в пул не возвращаем
+                conn.close()
+                raise
+            finally:
+                if conn is not None:
+                    self.pool.release(conn)
+                self._run(self._after_commit if committed else self._after_rollback)
+
+    @staticmethod
+    def _run(callbacks: list[Callable[[], None]]) -> None:
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                logger.error("Ошибка обработчика завершения транзакции: %s", e)
+
+
+@asynccontextmanager
+async def unit_of_work(pool: Pool) -> AsyncIterator[UnitOfWork]:
+    """
+    Открывает единицу работы для текущего контекста.
+
+    Транзакция фиксируется при нормальном выходе из блока
+    и откатывается при исключении.
+    """
+    uow = UnitOfWork(pool)
+    token = _current.set(uow)
+    try:
+        yield uow
+    except BaseException:
+        await uow.finish(commit=False)
+        raise
+    else:
+        await uow.finish(commit=True)
+    finally:
+        _current.reset(token)
+
+
+@contextmanager
+def outside_unit_of_work() -> Iterator[None]:
+    """
+    Отвязывает текущий контекст от единицы работы обновления.
+
+    Нужен фоновым задачам, которые переживают обновление: их запросы идут
+    через соединения пула в своих транзакциях и не задерживают COMMIT
+    обновления. Транзакция SQLite, открытая обновлением, тоже не
+    выдаётся таким задачам: иначе их запись откатилась бы вместе с ним.
+    """
+    token = _current.set(None)
+    try:
+        with outside_transaction():
+            yield
+    finally:
+        _current.reset(token)
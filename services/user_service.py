@@ -17,16 +17,16 @@ class UserService(BaseService):
             tgid: Telegram ID пользователя
             username: Имя пользователя в Telegram
         """
-        self.logger.debug(f"Добавление пользователя в БД: tgid={tgid}, username=@{username}")
+        self.logger.debug("Добавление пользователя в БД: tgid=%s, username=@%s", tgid, username)
         
         try:
-            async with self.pool.acquire() as conn:
+            async with self._connection() as conn:
                 async with conn.cursor() as cursor:
                     await cursor.execute(texts.add_user, (tgid, username))
-                    await conn.commit()
-            self.logger.debug(f"Пользователь {tgid} добавлен в БД")
+                    await self._commit(conn)
+            self.logger.debug("Пользователь %s добавлен в БД", tgid)
         except Exception as e:
-            self.logger.error(f"Ошибка добавления пользователя {tgid}: {e}")
+            self.logger.error("Ошибка добавления пользователя %s: %s", tgid, e)
             raise
     
     async def get_user_session_id(self, tgid: int) -> Optional[int]:
@@ -40,13 +40,13 @@ class UserService(BaseService):
             ID открытой сессии или None
         """
         try:
-            async with self.pool.acquire() as conn:
+            async with self._connection() as conn:
                 async with conn.cursor() as cursor:
                     await cursor.execute(texts.find_open_session, (tgid,))
                     row = await cursor.fetchone()
                     return int(row[0]) if row and row[0] is not None else None
         except Exception as e:
-            self.logger.error(f"Ошибка получения сессии пользователя {tgid}: {e}")
+            self.logger.error("Ошибка получения сессии пользователя %s: %s", tgid, e)
             raise
     
     async def has_open_session(self, tgid: int) -> bool:
@@ -60,13 +60,13 @@ class UserService(BaseService):
             True если есть открытая сессия, False иначе
         """
         try:
-            async with self.pool.acquire() as conn:
+            async with self._connection() as conn:
                 async with conn.cursor() as cursor:
                     await cursor.execute(texts.find_open_session, (tgid,))
                     row = await cursor.fetchone()
                     return bool(row)
         except Exception as e:
-            self.logger.error(f"Ошибка проверки открытой сессии для пользователя {tgid}: {e}")
+            self.logger.error("Ошибка проверки открытой сессии для пользователя %s: %s", tgid, e)
             raise
     
     async def update_user_session(self, tgid: int, session_id: int) -> None:
@@ -77,14 +77,14 @@ class UserService(BaseService):
             tgid: Telegram ID пользователя
             session_id: ID сессии
         """
-        self.logger.debug(f"Обновление сессии пользователя {tgid} на {session_id}")
+        self.logger.debug("Обновление сессии пользователя %s на %s", tgid, session_id)
         
         try:
-            async with self.pool.acquire() as conn:
+            async with self._connection() as conn:
                 async with conn.cursor() as cursor:
                     await cursor.execute(texts.bind_current_session_to_user, (session_id, tgid))
-                    await conn.commit()
-            self.logger.debug(f"Сессия {session_id} привязана к пользователю {tgid}")
+                    await self._commit(conn)
+            self.logger.debug("Сессия %s привязана к пользователю %s", session_id, tgid)
         except Exception as e:
-            self.logger.error(f"Ошибка обновления сессии пользователя {tgid}: {e}")
+            self.logger.error("Ошибка обновления сессии пользователя %s: %s", tgid, e)
             raise
@@ -0,0 +1,127 @@
+"""
+Версионированные миграции схемы БД.
+
+Каждая миграция применяется один раз, номер применённой версии
+записывается в таблицу schema_version. Новые миграции добавляются
+только в конец списка, уже выпущенные не меняются.
+"""
+from typing import NamedTuple
+
+from sql import texts
+
+
+class Migration(NamedTuple):
+    """Одна миграция схемы"""
+    version: int
+    description: str
+    statements: tuple[str, ...]
+
+
+create_schema_version_table = """
+CREATE TABLE IF NOT EXISTS schema_version (
+  version INT UNSIGNED NOT NULL,
+  description VARCHAR(255) NOT NULL,
+  applied_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  CONSTRAINT schema_version_pk PRIMARY KEY (version)
+) ENGINE=InnoDB
+  DEFAULT CHARSET=utf8mb4
+  COLLATE=utf8mb4_unicode_ci;
+"""
+
+get_schema_version = """
+SELECT COALESCE(MAX(version), 0) FROM schema_version
+"""
+
+add_schema_version = """
+INSERT INTO schema_version (version, description) VALUES (%s, %s)
+"""
+
+# Блокировка, чтобы несколько процессов не мигрировали одновременно
+acquire_migration_lock = "SELECT GET_LOCK('onyxchat_schema_migration', %s)"
+release_migration_lock = "SELECT RELEASE_LOCK('onyxchat_schema_migration')"
+
+
+MIGRATIONS: list[Migration] = [
+    Migration(1, "Базовая схема", (
+        texts.create_users_table,
+        texts.create_orders_table,
+        texts.create_messages_table,
+        texts.create_sessions_table,
+        texts.create_fsm_storage_table,
+    )),
+    Migration(2, "Составной индекс истории сессии", (
+        # fetch_session_messages*: WHERE tgid, current_session_id ORDER BY created_at, id;
+        # idx_user(tgid) - префикс нового индекса и больше не нужен
+        """
+        ALTER TABLE messages
+          ADD INDEX idx_messages_session (tgid, current_session_id, created_at, id),
+          DROP INDEX idx_user
+        """,
+    )),
+    Migration(3, "Составные индексы списков сессий", (
+        # Открытые списки и счётчики: WHERE status, assigned_agent;
+        # закрытые "мои": WHERE status, assigned_agent ORDER BY closed_at, id;
+        # закрытые "все": WHERE status ORDER BY closed_at, id;
+        # поиск открытой сессии клиента: WHERE tgid, status ORDER BY opened_at.
+        # Старые одиночные индексы стали префиксами новых
+        """
+        ALTER TABLE sessions
+          ADD INDEX idx_sessions_status_agent (status, assigned_agent, closed_at, id),
+          ADD INDEX idx_sessions_status_closed (status, closed_at, id),
+          ADD INDEX idx_sessions_user_status (tgid, status, opened_at),
+          DROP INDEX idx_sessions_status,
+          DROP INDEX idx_sessions_user
+        """,
+    )),
+    Migration(4, "Тип вложения сообщения", (
+        # Тип выбирает метод отправки вложения без пробных запросов;
+        # у старых записей он NULL, и вложение отправляется как раньше
+        """
+        ALTER TABLE messages
+          ADD COLUMN content_type VARCHAR(16) NULL AFTER file_id,
+          ADD COLUMN file_unique_id VARCHAR(64) NULL AFTER content_type
+        """,
+    )),
+    Migration(5, "Альбомы сообщений", (
+        # Сообщения одного альбома выводятся в истории одной строкой,
+        # в том числе после пересборки истории из БД
+        """
+        ALTER TABLE messages
+          ADD COLUMN media_group_id VARCHAR(32) NULL AFTER file_unique_id
+        """,
+    )),
+    Migration(6, "Одна открытая сессия на клиента", (
+        # Гонка /start могла открыть клиенту несколько сессий: оставляем самую раннюю.
+        # Группировка не даёт MySQL слить подзапрос с обновляемой таблицей
+        """
+        UPDATE sessions
+        SET status = 'closed',
+            closed_at = CURRENT_TIMESTAMP
+        WHERE status = 'open'
+          AND id NOT IN (
+            SELECT keep_id FROM (
+              SELECT MIN(id) AS keep_id FROM sessions
+              WHERE status = 'open'
+              GROUP BY tgid
+            ) AS open_sessions
+          )
+        """,
+        # open_tgid = tgid только у открытой сессии, у закрытых NULL - уникальный
+        # индекс по нему запрещает вторую открытую сессию и служит ключом для upsert
+        """
+        ALTER TABLE sessions
+          ADD COLUMN open_tgid BIGINT UNSIGNED AS (CASE WHEN status = 'open' THEN tgid END) STORED,
+          ADD UNIQUE INDEX uq_sessions_open_tgid (open_tgid)
+        """,
+    )),
+    Migration(7, "Индекс страниц открытых сессий", (
+        # Списки открытых сессий сортировались по COALESCE(u.last_message_at, s.opened_at)
+        # через JOIN, и каждая страница читала и сортировала все подходящие сессии.
+        # Страницы листаются по неизменному ключу (opened_at, id): сессия не переезжает
+        # между страницами, пока оператор их листает, а индекс сразу ведёт к странице
+        """
+        ALTER TABLE sessions
+          ADD INDEX idx_sessions_status_opened (status, assigned_agent, opened_at, id)
+        """,
+    )),
+]
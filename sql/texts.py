@@ -56,6 +56,18 @@ CREATE TABLE IF NOT EXISTS sessions (
   COLLATE=utf8mb4_unicode_ci;
 """
 
+create_fsm_storage_table = """
+CREATE TABLE IF NOT EXISTS fsm_storage (
+  storage_key VARCHAR(255) NOT NULL,
+  state VARCHAR(255) NULL,
+  data JSON NULL,
+  updated_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+  CONSTRAINT fsm_storage_key_pk PRIMARY KEY (storage_key)
+) ENGINE=InnoDB
+  DEFAULT CHARSET=utf8mb4
+  COLLATE=utf8mb4_unicode_ci;
+"""
+
 create_orders_table = """
 CREATE TABLE IF NOT EXISTS orders (
   id BIGINT UNSIGNED AUTO_INCREMENT PRIMARY KEY,
@@ -73,14 +85,26 @@ CREATE TABLE IF NOT EXISTS orders (
 """
 
 log_message = """
-INSERT INTO messages (tgid, current_session_id, direction, text, file_id)
-VALUES (%s, %s, %s, %s, %s)
+INSERT INTO messages (tgid, current_session_id, direction, text, file_id, content_type, file_unique_id, media_group_id, created_at)
+VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
 """
 
+log_messages_batch = """
+INSERT INTO messages (tgid, current_session_id, direction, text, file_id, content_type, file_unique_id, media_group_id, created_at)
+VALUES {values}
+"""
+
+log_message_values = "(%s, %s, %s, %s, %s, %s, %s, %s, %s)"
+
 openCreate_session = """
 INSERT INTO sessions (tgid) VALUES (%s)
 """
 
+upsert_open_session = """
+INSERT INTO sessions (tgid) VALUES (%s)
+ON DUPLICATE KEY UPDATE id = LAST_INSERT_ID(id)
+"""
+
 bind_current_session_to_user = """
 UPDATE users
 SET current_session_id = %s
@@ -94,6 +118,17 @@ ORDER BY opened_at ASC
 LIMIT 1
 """
 
+get_open_session_route = """
+SELECT s.id             AS session_id,
+       s.assigned_agent AS assigned_agent,
+       u.username       AS username
+FROM sessions s
+JOIN users u ON u.tgid = s.tgid
+WHERE s.tgid = %s AND s.status = 'open'
+ORDER BY s.opened_at ASC
+LIMIT 1
+"""
+
 close_session = """
 UPDATE sessions
 SET status = 'closed',
@@ -107,6 +142,32 @@ SET assigned_agent = %s
 WHERE id = %s AND status = 'open' AND (assigned_agent IS NULL or assigned_agent = %s) 
 """
 
+claim_session = """
+UPDATE sessions
+SET assigned_agent = %s
+WHERE id = %s AND status = 'open' AND assigned_agent IS NULL
+"""
+
+get_session_view_with_messages = """
+SELECT s.id             AS session_id,
+       s.tgid           AS tgid,
+       u.username       AS username,
+       s.assigned_agent AS assigned_agent,
+       s.status         AS status,
+       m.id, m.direction, m.text, m.file_id, m.media_group_id, m.created_at
+FROM sessions s
+JOIN users u ON u.tgid = s.tgid
+LEFT JOIN (
+  SELECT id, direction, text, file_id, media_group_id, created_at
+  FROM messages
+  WHERE tgid = (SELECT tgid FROM sessions WHERE id = %s)
+    AND current_session_id = %s
+  ORDER BY created_at DESC, id DESC
+  LIMIT %s
+) m ON 1 = 1
+WHERE s.id = %s
+"""
+
 get_session_view = """
 SELECT s.id            AS session_id,
        s.tgid          AS tgid,
@@ -118,26 +179,80 @@ WHERE s.id = %s
 """
 
 fetch_session_messages = """
-SELECT id, direction, text, file_id, created_at
+SELECT id, direction, text, file_id, media_group_id, created_at
+FROM messages
+WHERE tgid = %s
+  AND current_session_id = %s
+ORDER BY created_at DESC, id DESC
+LIMIT %s
+"""
+
+fetch_session_messages_before = """
+SELECT id, direction, text, file_id, media_group_id, created_at
+FROM messages
+WHERE tgid = %s
+  AND current_session_id = %s
+  AND (created_at < %s OR (created_at = %s AND id < %s))
+ORDER BY created_at DESC, id DESC
+LIMIT %s
+"""
+
+fetch_session_messages_after = """
+SELECT id, direction, text, file_id, media_group_id, created_at
 FROM messages
 WHERE tgid = %s
   AND current_session_id = %s
-ORDER BY created_at ASC
+  AND (created_at > %s OR (created_at = %s AND id > %s))
+ORDER BY created_at ASC, id ASC
+LIMIT %s
 """
 
 get_message_file = """
-SELECT file_id, current_session_id FROM messages
+SELECT file_id, content_type, current_session_id FROM messages
 WHERE id = %s
 """
 
-count_closed_all = """
-SELECT COUNT(*) FROM sessions
-WHERE status = 'closed'
+fetch_session_attachments = """
+SELECT id, file_id, content_type
+FROM messages
+WHERE tgid = %s
+  AND current_session_id = %s
+  AND file_id IS NOT NULL
+ORDER BY created_at DESC, id DESC
+LIMIT %s
 """
 
-count_closed_mine = """
-SELECT COUNT(*) FROM sessions
-WHERE status='closed' AND assigned_agent=%s
+fetch_open_sessions = """
+SELECT s.id AS session_id,
+       s.tgid AS tgid,
+       u.username,
+       s.opened_at
+FROM sessions s
+INNER JOIN users u ON u.tgid = s.tgid
+WHERE s.status = 'open' AND {condition}{seek}
+ORDER BY s.opened_at {order}, s.id {order}
+LIMIT %s
+"""
+
+open_sessions_waiting = "s.assigned_agent IS NULL"
+open_sessions_mine = "s.assigned_agent = %s"
+open_sessions_others = "s.assigned_agent IS NOT NULL AND s.assigned_agent != %s"
+
+open_sessions_before = """
+  AND (s.opened_at < %s OR (s.opened_at = %s AND s.id < %s))"""
+
+open_sessions_after = """
+  AND (s.opened_at > %s OR (s.opened_at = %s AND s.id > %s))"""
+
+lock_open_session = """
+SELECT assigned_agent FROM sessions
+WHERE id = %s AND status = 'open'
+FOR UPDATE
+"""
+
+count_sessions_by_agent = """
+SELECT status, assigned_agent, COUNT(*) FROM sessions
+GROUP BY status, assigned_agent
 """
 
 fetch_closed_all = """
@@ -149,7 +264,33 @@ FROM sessions s
 JOIN users u ON u.tgid = s.tgid
 WHERE s.status='closed'
 ORDER BY s.closed_at DESC, s.id DESC
-LIMIT %s OFFSET %s
+LIMIT %s
+"""
+
+fetch_closed_all_before = """
+SELECT s.id      AS session_id,
+       s.tgid    AS tgid,
+       u.username,
+       s.closed_at
+FROM sessions s
+JOIN users u ON u.tgid = s.tgid
+WHERE s.status='closed'
+  AND (s.closed_at < %s OR (s.closed_at = %s AND s.id < %s))
+ORDER BY s.closed_at DESC, s.id DESC
+LIMIT %s
+"""
+
+fetch_closed_all_after = """
+SELECT s.id      AS session_id,
+       s.tgid    AS tgid,
+       u.username,
+       s.closed_at
+FROM sessions s
+JOIN users u ON u.tgid = s.tgid
+WHERE s.status='closed'
+  AND (s.closed_at > %s OR (s.closed_at = %s AND s.id > %s))
+ORDER BY s.closed_at ASC, s.id ASC
+LIMIT %s
 """
 
 fetch_closed_mine = """
@@ -161,5 +302,48 @@ FROM sessions s
 JOIN users u ON u.tgid = s.tgid
 WHERE s.status='closed' AND s.assigned_agent=%s
 ORDER BY s.closed_at DESC, s.id DESC
-LIMIT %s OFFSET %s
+LIMIT %s
+"""
+
+fetch_closed_mine_before = """
+SELECT s.id      AS session_id,
+       s.tgid    AS tgid,
+       u.username,
+       s.closed_at
+FROM sessions s
+JOIN users u ON u.tgid = s.tgid
+WHERE s.status='closed' AND s.assigned_agent=%s
+  AND (s.closed_at < %s OR (s.closed_at = %s AND s.id < %s))
+ORDER BY s.closed_at DESC, s.id DESC
+LIMIT %s
+"""
+
+fetch_closed_mine_after = """
+SELECT s.id      AS session_id,
+       s.tgid    AS tgid,
+       u.username,
+       s.closed_at
+FROM sessions s
+JOIN users u ON u.tgid = s.tgid
+WHERE s.status='closed' AND s.assigned_agent=%s
+  AND (s.closed_at > %s OR (s.closed_at = %s AND s.id > %s))
+ORDER BY s.closed_at ASC, s.id ASC
+LIMIT %s
+"""
+
+fsm_get = """
+SELECT state, data FROM fsm_storage
+WHERE storage_key=%s
+"""
+
+fsm_set_state = """
+INSERT INTO fsm_storage(storage_key, state, data)
+VALUES (%s, %s, %s)
+ON DUPLICATE KEY UPDATE state=VALUES(state)
+"""
+
+fsm_set_data = """
+INSERT INTO fsm_storage(storage_key, state, data)
+VALUES (%s, %s, %s)
+ON DUPLICATE KEY UPDATE data=VALUES(data)
 """
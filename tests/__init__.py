@@ -0,0 +1,9 @@
+"""
+Тесты на встроенном SQLite: конфигурация бота не нужна
+"""
+import os
+
+# config проверяет обязательные переменные при импорте сервисов
+os.environ.setdefault("TOKEN", "123456:TEST")
+os.environ.setdefault("ADMINS_ID", "1")
+os.environ.setdefault("DB_BACKEND", "sqlite")
@@ -0,0 +1,82 @@
+"""
+Запись ответа оператора: повтор после ошибки не дублирует сообщение
+"""
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from services.backends import create_sqlite_pool
+from services.backends.sqlite import SQLiteConnection, SQLiteCursor
+from services.base_service import CommitOutcomeUnknown
+from services.database_service import DatabaseService
+from services.message_service import MessageService
+from utils.post_send import PostSendPipeline
+
+
+class AgentReplyLoggingTest(unittest.IsolatedAsyncioTestCase):
+    """log_reply из PostSendPipeline на SQLite"""
+
+    async def asyncSetUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.pool = await create_sqlite_pool(os.path.join(self.tmp.name, "test.db"), 2)
+        await DatabaseService(self.pool).migrate()
+        self.service = MessageService(self.pool)
+        self.pipeline = PostSendPipeline(retry_delay=0)
+        self.failures = []
+
+    async def asyncTearDown(self):
+        self.pool.close()
+        await self.pool.wait_closed()
+        self.tmp.cleanup()
+
+    async def _log_reply(self) -> None:
+        async def on_failure(error: Exception) -> None:
+            self.failures.append(error)
+
+        self.pipeline.submit(
+            "log_reply", lambda: self.service.log_agent_message(1, 1, "ответ", None), key=1, on_failure=on_failure
+        )
+        await self.pipeline.join()
+
+    async def _rows(self) -> list:
+        async with self.pool.acquire() as conn:
+            async with conn.cursor() as cursor:
+                await cursor.execute("SELECT text FROM messages")
+                return [row[0] for row in await cursor.fetchall()]
+
+    async def test_error_after_insert_is_retried_once(self):
+        execute = SQLiteCursor.execute
+        failed = []
+
+        async def fail_after_insert(cursor, query, args=None):
+            result = await execute(cursor, query, args)
+            if "INSERT INTO messages" in query and not failed:
+                failed.append(query)
+                raise RuntimeError("Lock wait timeout exceeded")
+            return result
+
+        with mock.patch.object(SQLiteCursor, "execute", fail_after_insert):
+            await self._log_reply()
+
+        self.assertEqual(len(failed), 1)
+        self.assertEqual(await self._rows(), ["ответ"])
+        self.assertEqual(self.failures, [])
+
+    async def test_ambiguous_commit_is_not_retried(self):
+        commit = SQLiteConnection.commit
+
+        async def commit_then_fail(conn):
+            await commit(conn)
+            raise RuntimeError("Lost connection to MySQL server during query")
+
+        with mock.patch.object(SQLiteConnection, "commit", commit_then_fail):
+            await self._log_reply()
+
+        self.assertEqual(await self._rows(), ["ответ"])
+        self.assertEqual(len(self.failures), 1)
+        self.assertIsInstance(self.failures[0], CommitOutcomeUnknown)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -19,10 +19,17 @@ CHAT_ASSIGNED_TO_YOU = "Чат закреплён за вами ✅"
 FAILED_TO_CLOSE_SESSION = "Не удалось закрыть сессию"
 SESSION_CLOSED_SUCCESSFUL = "Сессия закрыта"
 ATTACHMENT_NOT_FOUND = "Вложение не найдено"
+NO_ATTACHMENTS = "В сессии нет вложений"
 
 # handlers/messages/admin_reply_handlers
 CLIENT_NOT_FOUND = "Пользователь не найден"
 FAILED_TO_SEND_MESSAGE = "Не удалось отправить сообщение: {exception}"
+REPLY_NOT_SAVED = "Сообщение доставлено клиенту, но не сохранено в истории сессии"
+REPLY_SAVE_UNCONFIRMED = "Сообщение доставлено клиенту, но его сохранение в истории сессии не подтвердилось"
+
+# handlers/messages/query_stats
+QUERY_STATS_EMPTY = "Статистика запросов пока пуста"
+QUERY_STATS_TITLE = "Топ-{count} запросов по суммарному времени"
 
 # handlers/messages/start
 WELCOME_TEXT_ONYX = "Привет, папа!"
@@ -63,6 +70,9 @@ CLOSE_ATTACHMENT = "Закрыть вложение"
 
 # keyboards/messages_keyboard/session_view
 CLOSE_SESSION = "Закрыть сессию"
+OLDER_MESSAGES = "‹ Старее"
+NEWER_MESSAGES = "Новее ›"
+OPEN_ALL_ATTACHMENTS = "Все вложения"
 
 # middlewares/log
 TEXT_BEFORE_START = "Сначала используйте /start"
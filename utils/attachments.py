@@ -0,0 +1,151 @@
+"""
+Вложения сообщений: тип содержимого, отправка нужным методом Bot API
+и упаковка нескольких вложений в альбомы
+"""
+from typing import NamedTuple, Optional, Sequence
+
+from aiogram import Bot
+from aiogram.types import (
+    InputMediaAudio,
+    InputMediaDocument,
+    InputMediaPhoto,
+    InputMediaVideo,
+    Message,
+)
+
+from constants import MEDIA_GROUP_MAX_SIZE
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+
+class Attachment(NamedTuple):
+    """Вложение сообщения, как оно хранится в messages"""
+    file_id: str
+    file_unique_id: Optional[str]
+    content_type: Optional[str]
+
+
+class StoredAttachment(NamedTuple):
+    """Вложение из истории сессии"""
+    mid: int
+    file_id: str
+    content_type: Optional[str]
+
+
+# Тип содержимого -> (метод бота, имя параметра с файлом). У анимации
+# Telegram заполняет и document, поэтому она проверяется раньше
+_SENDERS = {
+    "photo": ("send_photo", "photo"),
+    "animation": ("send_animation", "animation"),
+    "document": ("send_document", "document"),
+    "voice": ("send_voice", "voice"),
+    "video": ("send_video", "video"),
+    "audio": ("send_audio", "audio"),
+    "video_note": ("send_video_note", "video_note"),
+    "sticker": ("send_sticker", "sticker"),
+}
+
+# Тип содержимого -> (класс элемента альбома, вид альбома). Фото и видео
+# можно смешивать в одном альбоме, документы и аудио - только с такими же
+_MEDIA = {
+    "photo": (InputMediaPhoto, "visual"),
+    "video": (InputMediaVideo, "visual"),
+    "document": (InputMediaDocument, "document"),
+    "audio": (InputMediaAudio, "audio"),
+}
+
+
+def extract_attachment(message: Message) -> Optional[Attachment]:
+    """
+    Извлекает вложение из сообщения
+
+    Args:
+        message: Сообщение Telegram
+
+    Returns:
+        Вложение или None, если сообщение без файла
+    """
+    if message.photo:
+        # Самый большой размер фото - последний
+        media = message.photo[-1]
+        return Attachment(media.file_id, media.file_unique_id, "photo")
+    for content_type in _SENDERS:
+        media = getattr(message, content_type, None)
+        if media is not None:
+            return Attachment(media.file_id, media.file_unique_id, content_type)
+    return None
+
+
+async def send_attachment(bot: Bot, chat_id: int, file_id: str, content_type: Optional[str], reply_markup=None) -> Message:
+    """
+    Отправляет вложение методом, подходящим его типу
+
+    Args:
+        bot: Экземпляр бота
+        chat_id: Чат получателя
+        file_id: ID файла в Telegram
+        content_type: Тип содержимого; None - запись без типа (до миграции 4)
+        reply_markup: Клавиатура под вложением
+
+    Returns:
+        Отправленное сообщение
+    """
+    sender = _SENDERS.get(content_type)
+    if sender is not None:
+        method, field = sender
+        return await getattr(bot, method)(chat_id, **{field: file_id}, reply_markup=reply_markup)
+
+    # Тип старых записей неизвестен: пробуем как фото, затем как документ
+    try:
+        return await bot.send_photo(chat_id, file_id, reply_markup=reply_markup)
+    except Exception as e:
+        logger.debug("Вложение без типа не отправилось как фото, пробуем как документ: %s", e)
+    return await bot.send_document(chat_id, file_id, reply_markup=reply_markup)
+
+
+def group_attachments(attachments: Sequence[StoredAttachment]) -> list[list[StoredAttachment]]:
+    """
+    Делит вложения на минимальное число отправок с сохранением порядка
+
+    Соседние вложения одного вида собираются в альбомы до
+    MEDIA_GROUP_MAX_SIZE элементов; голосовые, стикеры, анимации и
+    вложения без типа отправляются по одному.
+
+    Returns:
+        Список отправок; отправка из одного вложения - обычное сообщение
+    """
+    groups: list[list[StoredAttachment]] = []
+    current_kind = None
+    for attachment in attachments:
+        media = _MEDIA.get(attachment.content_type)
+        kind = media[1] if media else None
+        if kind is not None and kind == current_kind and len(groups[-1]) < MEDIA_GROUP_MAX_SIZE:
+            groups[-1].append(attachment)
+        else:
+            groups.append([attachment])
+            current_kind = kind
+    return groups
+
+
+async def send_attachments(bot: Bot, chat_id: int, attachments: Sequence[StoredAttachment]) -> int:
+    """
+    Отправляет вложения альбомами, где это возможно
+
+    Args:
+        bot: Экземпляр бота
+        chat_id: Чат получателя
+        attachments: Вложения в хронологическом порядке
+
+    Returns:
+        Количество запросов к Bot API
+    """
+    groups = group_attachments(attachments)
+    for group in groups:
+        if len(group) == 1:
+            await send_attachment(bot, chat_id, group[0].file_id, group[0].content_type)
+            continue
+        media = [_MEDIA[attachment.content_type][0](media=attachment.file_id) for attachment in group]
+        await bot.send_media_group(chat_id, media)
+    logger.debug("Отправлено вложений: %s, запросов: %s", len(attachments), len(groups))
+    return len(groups)
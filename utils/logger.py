@@ -1,11 +1,17 @@
 """
 Централизованная система логгирования для onyxChat
 """
+import atexit
 import logging
+import os
+import queue
 import sys
 import warnings
+from logging.handlers import QueueHandler, QueueListener
 from typing import Optional
 
+from dotenv import load_dotenv
+
 
 class ColoredFormatter(logging.Formatter):
     """Цветной форматтер для логов с эмодзи"""
@@ -28,22 +34,66 @@ class ColoredFormatter(logging.Formatter):
         name = config['name']
         reset = self.RESET
         
-        # Применяем цвет и эмодзи к уровню логирования
-        record.levelname = f"{color}{emoji} {name}{reset}"
+        # Запись может разделяться несколькими обработчиками, поэтому меняем копию
+        record = logging.makeLogRecord(record.__dict__)
         
         # Применяем цвет к сообщению для важных уровней
-        if record.levelname in ['ERROR', 'CRITICAL', 'WARNING']:
-            record.msg = f"{color}{record.msg}{reset}"
+        if record.levelno >= logging.WARNING:
+            record.msg = f"{color}{record.getMessage()}{reset}"
+            record.args = None
+        
+        # Применяем цвет и эмодзи к уровню логирования
+        record.levelname = f"{color}{emoji} {name}{reset}"
         
         return super().format(record)
 
 
+class DeferredQueueHandler(QueueHandler):
+    """
+    Кладёт запись в очередь как есть.
+    
+    Стандартный QueueHandler форматирует сообщение ещё в вызывающем потоке;
+    здесь подстановка аргументов и вывод целиком выполняются в потоке
+    QueueListener. Поэтому в аргументы логов не стоит передавать объекты,
+    которые меняются сразу после вызова.
+    """
+    
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+def _parse_level(value: str, default: int) -> int:
+    """Преобразует имя или номер уровня логирования"""
+    value = value.strip().upper()
+    if value.isdigit():
+        return int(value)
+    level = logging.getLevelName(value)
+    return level if isinstance(level, int) else default
+
+
+def _parse_module_levels(value: str) -> dict[str, int]:
+    """Разбирает строку вида "services=DEBUG,aiogram.event=INFO" """
+    levels = {}
+    for item in value.split(","):
+        name, sep, level = item.partition("=")
+        if sep and name.strip():
+            levels[name.strip()] = _parse_level(level, logging.INFO)
+    return levels
+
+
 class Logger:
     """Централизованный логгер для всего проекта"""
     
     _instance: Optional['Logger'] = None
     _initialized = False
     
+    # Уровни внешних библиотек по умолчанию, переопределяются через LOG_LEVELS
+    LIBRARY_LEVELS = {
+        'aiogram': logging.WARNING,
+        'aiomysql': logging.ERROR,            # Только ошибки
+        'aiomysql.cursors': logging.ERROR,    # Отключаем предупреждения курсоров
+    }
+    
     def __new__(cls) -> 'Logger':
         if cls._instance is None:
             cls._instance = super().__new__(cls)
@@ -51,11 +101,15 @@ class Logger:
     
     def __init__(self):
         if not self._initialized:
+            self.listener: Optional[QueueListener] = None
             self._setup_logging()
             Logger._initialized = True
     
     def _setup_logging(self) -> None:
         """Настройка логгирования"""
+        # Логгер настраивается до config.py, поэтому .env читаем здесь
+        load_dotenv()
+        
         # Отключаем предупреждения MySQL
         warnings.filterwarnings('ignore', category=Warning, module='aiomysql')
         
@@ -67,7 +121,7 @@ class Logger:
         
         # Настраиваем root logger
         root_logger = logging.getLogger()
-        root_logger.setLevel(logging.DEBUG)
+        root_logger.setLevel(_parse_level(os.getenv("LOG_LEVEL", "INFO"), logging.INFO))
         
         # Удаляем существующие обработчики
         for handler in root_logger.handlers[:]:
@@ -75,43 +129,41 @@ class Logger:
         
         # Создаем консольный обработчик
         console_handler = logging.StreamHandler(sys.stdout)
-        console_handler.setLevel(logging.DEBUG)
         console_handler.setFormatter(formatter)
         console_handler.stream.reconfigure(encoding='utf-8')
         
-        # Добавляем обработчик
-        root_logger.addHandler(console_handler)
-        
-        # Настраиваем логгеры для внешних библиотек
-        logging.getLogger('aiogram').setLevel(logging.WARNING)
-        logging.getLogger('aiomysql').setLevel(logging.ERROR)  # Только ошибки
-        logging.getLogger('aiomysql.cursors').setLevel(logging.ERROR)  # Отключаем предупреждения курсоров
+        # Вывод в консоль выполняется в фоновом потоке, чтобы не блокировать event loop
+        if os.getenv("LOG_QUEUE", "1").lower() in ("1", "true", "yes"):
+            log_queue: queue.SimpleQueue = queue.SimpleQueue()
+            root_logger.addHandler(DeferredQueueHandler(log_queue))
+            self.listener = QueueListener(log_queue, console_handler, respect_handler_level=True)
+            self.listener.start()
+            atexit.register(self.stop)
+        else:
+            root_logger.addHandler(console_handler)
         
-        # Настраиваем специальные логгеры для наших модулей
+        # Настраиваем уровни внешних библиотек и модулей приложения
         self._setup_module_loggers()
     
     def _setup_module_loggers(self) -> None:
-        """Настройка логгеров для конкретных модулей"""
-        # Основные модули приложения
-        app_loggers = [
-            'main',
-            'services.user_service',
-            'services.session_service', 
-            'services.message_service',
-            'services.notification_service',
-            'services.database_service',
-            'handlers.messages.start',
-            'handlers.messages.admin_reply_handlers',
-            'handlers.callbacks.messages_handler',
-            'handlers.callbacks.users_handler',
-            'middlewares.log',
-            'middlewares.databaseAdd',
-            'utils.refresh'
-        ]
+        """
+        Настройка уровней для конкретных модулей.
         
-        for logger_name in app_loggers:
-            logger = logging.getLogger(logger_name)
-            logger.setLevel(logging.INFO)
+        LOG_LEVELS задает уровни через запятую, например
+        "services=DEBUG,SessionService=DEBUG,aiogram.event=INFO".
+        Сервисы логируют под именем своего класса.
+        """
+        levels = dict(self.LIBRARY_LEVELS)
+        levels.update(_parse_module_levels(os.getenv("LOG_LEVELS", "")))
+        
+        for logger_name, level in levels.items():
+            logging.getLogger(logger_name).setLevel(level)
+    
+    def stop(self) -> None:
+        """Дописывает очередь логов и останавливает фоновый поток"""
+        if self.listener is not None:
+            self.listener.stop()
+            self.listener = None
     
     def get_logger(self, name: str) -> logging.Logger:
         """Получить логгер для модуля"""
@@ -0,0 +1,330 @@
+"""
+Метрики процесса в текстовом формате Prometheus
+
+Счётчики, gauge и гистограммы задержек хранятся в памяти процесса
+и отдаются локальным HTTP-эндпоинтом /metrics. Все обновления метрик
+выполняются в потоке event loop, поэтому блокировки не нужны.
+"""
+import re
+import time
+from typing import Callable, Iterable, Optional
+
+import aiomysql
+from aiohttp import web
+
+from constants import METRICS_LATENCY_BUCKETS, METRICS_PREFIX, METRICS_STATEMENT_CACHE_SIZE
+from sql import migrations, texts
+from utils.logger import get_logger
+from utils.query_stats import QUERY_STATS
+
+logger = get_logger(__name__)
+
+
+def _escape(value: str) -> str:
+    """Экранирует значение метки по правилам текстового формата"""
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: tuple[str, ...], values: tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric:
+    """Общая часть метрик: имя, описание и имена меток"""
+
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        self.name = f"{METRICS_PREFIX}_{name}"
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+
+    def _key(self, labels: tuple) -> tuple[str, ...]:
+        if len(labels) != len(self.labelnames):
+            raise ValueError(f"{self.name} ожидает метки {self.labelnames}, получено {labels}")
+        return tuple(str(value) for value in labels)
+
+    def samples(self) -> list[str]:
+        raise NotImplementedError
+
+    def render(self) -> list[str]:
+        return [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.kind}",
+            *self.samples(),
+        ]
+
+
+class Counter(_Metric):
+    """Монотонно растущий счётчик"""
+
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: dict[tuple[str, ...], float] = {}
+
+    def inc(self, *labels, amount: float = 1) -> None:
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self) -> list[str]:
+        return [
+            f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+            for key, value in sorted(self._values.items())
+        ]
+
+
+class Gauge(_Metric):
+    """Текущее значение; может вычисляться функцией в момент чтения"""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: dict[tuple[str, ...], float] = {}
+        self._function: Optional[Callable[[], float]] = None
+
+    def set(self, value: float, *labels) -> None:
+        self._values[self._key(labels)] = value
+
+    def set_function(self, function: Optional[Callable[[], float]]) -> None:
+        """Задает функцию, значение которой отдается при каждом чтении (только без меток)"""
+        self._function = function
+
+    def samples(self) -> list[str]:
+        if self._function is not None:
+            try:
+                return [f"{self.name} {_format_value(self._function())}"]
+            except Exception as e:
+                logger.warning("Не удалось получить значение %s: %s", self.name, e)
+                return []
+        return [
+            f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+            for key, value in sorted(self._values.items())
+        ]
+
+
+class Histogram(_Metric):
+    """Гистограмма задержек с фиксированными границами корзин"""
+
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Iterable[str] = (),
+        buckets: tuple[float, ...] = METRICS_LATENCY_BUCKETS,
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # Метки -> [счётчики корзин, сумма, количество]
+        self._values: dict[tuple[str, ...], list] = {}
+
+    def observe(self, value: float, *labels) -> None:
+        key = self._key(labels)
+        state = self._values.get(key)
+        if state is None:
+            state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+        counts = state[0]
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                counts[i] += 1
+                break
+        state[1] += value
+        state[2] += 1
+
+    def samples(self) -> list[str]:
+        lines = []
+        for key, (counts, total, count) in sorted(self._values.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                le = _format_labels(self.labelnames, key, f'le="{_format_value(bound)}"')
+                lines.append(f"{self.name}_bucket{le} {cumulative}")
+            le = _format_labels(self.labelnames, key, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{le} {count}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    """Набор метрик процесса"""
+
+    def __init__(self):
+        self._metrics: list[_Metric] = []
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Iterable[str] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Iterable[str] = ()) -> Gauge:
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Iterable[str] = ()) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames))
+
+    def render(self) -> str:
+        """Возвращает все метрики в текстовом формате Prometheus 0.0.4"""
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+UPDATES = REGISTRY.counter("updates_total", "Обработанные обновления", ("type",))
+UPDATE_ERRORS = REGISTRY.counter("update_errors_total", "Обновления, завершившиеся исключением", ("type", "error"))
+UPDATE_DURATION = REGISTRY.histogram("update_duration_seconds", "Время обработки обновления", ("type",))
+HANDLER_DURATION = REGISTRY.histogram("handler_duration_seconds", "Время работы обработчика", ("handler",))
+SQL_DURATION = REGISTRY.histogram("sql_duration_seconds", "Время выполнения SQL-запроса", ("statement",))
+SQL_ERRORS = REGISTRY.counter("sql_errors_total", "SQL-запросы, завершившиеся ошибкой", ("statement",))
+BOT_API_DURATION = REGISTRY.histogram("bot_api_duration_seconds", "Время запроса к Bot API", ("method",))
+BOT_API_ERRORS = REGISTRY.counter("bot_api_errors_total", "Запросы к Bot API, завершившиеся ошибкой", ("method", "error"))
+UPDATE_QUEUE_WAIT = REGISTRY.histogram("update_queue_wait_seconds", "Ожидание очереди чата и лимита параллельной обработки", ("type",))
+UPDATES_QUEUED = REGISTRY.gauge("updates_queued", "Обновления, ожидающие начала обработки")
+UPDATES_ACTIVE = REGISTRY.gauge("updates_active", "Обновления в обработке")
+OUTBOUND_WAIT = REGISTRY.histogram("outbound_wait_seconds", "Ожидание лимита отправки сообщения", ("priority",))
+OUTBOUND_QUEUED = REGISTRY.gauge("outbound_queued", "Сообщения в очереди на отправку")
+OUTBOUND_RETRIES = REGISTRY.counter("outbound_retries_total", "Повторы после 429 Too Many Requests", ("method",))
+POST_SEND_PENDING = REGISTRY.gauge("post_send_pending", "Фоновые операции после ответа оператора в работе")
+POST_SEND_RETRIES = REGISTRY.counter("post_send_retries_total", "Повторы фоновых операций после ответа оператора", ("job",))
+POST_SEND_FAILURES = REGISTRY.counter("post_send_failures_total", "Фоновые операции, не выполненные после всех попыток", ("job",))
+POOL_SIZE = REGISTRY.gauge("db_pool_size", "Открытые соединения пула БД")
+POOL_MAX_SIZE = REGISTRY.gauge("db_pool_max_size", "Максимальный размер пула БД")
+POOL_FREE = REGISTRY.gauge("db_pool_free_connections", "Свободные соединения пула БД")
+POOL_PENDING = REGISTRY.gauge("db_pool_pending_acquires", "Ожидающие соединения из пула БД")
+
+
+def _statement_patterns() -> list[tuple[str, re.Pattern]]:
+    """Собирает запросы из sql/texts.py и sql/migrations.py; шаблоны с {} сравниваются по маске"""
+    patterns = []
+    for module in (texts, migrations):
+        for name, value in vars(module).items():
+            if name.startswith("_") or not isinstance(value, str):
+                continue
+            parts = re.split(r"\{\w+\}", value)
+            regex = ".*?".join(re.escape(part) for part in parts)
+            patterns.append((name, re.compile(regex, re.DOTALL)))
+    return patterns
+
+
+_STATEMENT_PATTERNS = _statement_patterns()
+_statement_names: dict[str, str] = {}
+
+
+def statement_name(query: str) -> str:
+    """
+    Возвращает имя запроса из sql/texts.py для метки метрик
+
+    Args:
+        query: Текст выполняемого запроса
+
+    Returns:
+        Имя переменной с запросом или "other" для запросов вне sql/
+    """
+    name = _statement_names.get(query)
+    if name is not None:
+        return name
+    name = next((name for name, pattern in _STATEMENT_PATTERNS if pattern.fullmatch(query)), "other")
+    if len(_statement_names) < METRICS_STATEMENT_CACHE_SIZE:
+        _statement_names[query] = name
+    return name
+
+
+def observe_query(query: str, args, duration: float, rows: int, failed: bool = False) -> None:
+    """
+    Записывает выполненный запрос в метрики и статистику запросов
+
+    Args:
+        query: Текст запроса в том виде, в каком он записан в sql/
+        args: Параметры запроса
+        duration: Время выполнения в секундах
+        rows: Количество возвращенных или измененных строк
+        failed: Запрос завершился ошибкой
+    """
+    name = statement_name(query)
+    if failed:
+        SQL_ERRORS.inc(name)
+    SQL_DURATION.observe(duration, name)
+    QUERY_STATS.record(query, args, duration, rows)
+
+
+class TimedCursor(aiomysql.Cursor):
+    """
+    Курсор, записывающий время каждого запроса в гистограмму по имени
+    запроса и в статистику нормализованных запросов
+    """
+
+    async def execute(self, query, args=None):
+        start = time.perf_counter()
+        rows, failed = 0, True
+        try:
+            result = await super().execute(query, args)
+            rows, failed = self.rowcount, False
+            return result
+        finally:
+            observe_query(query, args, time.perf_counter() - start, rows, failed)
+
+
+def _pending_acquires(pool: aiomysql.Pool) -> int:
+    # Встроенный пул SQLite считает ожидающих сам
+    if hasattr(pool, "pending_acquires"):
+        return pool.pending_acquires
+    # aiomysql не отдаёт очередь ожидания наружу: считаем задачи, ждущие
+    # условие пула, его блокировку, и открываемые сейчас соединения
+    cond = pool._cond
+    waiting = len(cond._waiters) + len(getattr(cond._lock, "_waiters", None) or ())
+    return waiting + pool._acquiring
+
+
+def register_pool(pool: aiomysql.Pool) -> None:
+    """Подключает gauge размера и загрузки пула соединений"""
+    POOL_SIZE.set_function(lambda: pool.size)
+    POOL_MAX_SIZE.set_function(lambda: pool.maxsize)
+    POOL_FREE.set_function(lambda: pool.freesize)
+    POOL_PENDING.set_function(lambda: _pending_acquires(pool))
+
+
+async def _metrics_view(request: web.Request) -> web.Response:
+    return web.Response(
+        text=REGISTRY.render(),
+        headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"},
+    )
+
+
+async def start_metrics_server(host: str, port: int) -> web.AppRunner:
+    """
+    Запускает HTTP-сервер метрик
+
+    Args:
+        host: Адрес, на котором слушает сервер
+        port: Порт сервера
+
+    Returns:
+        Runner сервера; остановка - await runner.cleanup()
+    """
+    app = web.Application()
+    app.router.add_get("/metrics", _metrics_view)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, host=host, port=port)
+    await site.start()
+    logger.info("Метрики доступны на http://%s:%s/metrics", host, port)
+    return runner
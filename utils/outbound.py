@@ -0,0 +1,280 @@
+"""
+Очередь исходящих запросов к Bot API
+
+Telegram ограничивает бота примерно 30 сообщениями в секунду в целом
+и одним сообщением в секунду в один чат; при превышении он отвечает
+429 с retry_after. Диспетчер подключается middleware сессии бота,
+поэтому через него проходит каждая отправка и правка сообщения:
+запрос ждёт жетона в общем ведре и в ведре своего чата, очередь
+разбирается по приоритетам, а TelegramRetryAfter повторяется после
+паузы, которую назвал Telegram.
+"""
+import asyncio
+import enum
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterator, Optional
+
+from aiogram import Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import Response, TelegramMethod
+
+from constants import (
+    OUTBOUND_CHAT_BUCKETS_MAX,
+    OUTBOUND_MAX_RETRIES,
+    OUTBOUND_MAX_RETRY_AFTER,
+)
+from utils import metrics
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+
+class Priority(enum.IntEnum):
+    """Очередность исходящих запросов: меньше - раньше"""
+    REPLY = 0           # ответы операторов и клиентам
+    REFRESH = 1         # фоновые обновления панелей
+    NOTIFICATION = 2    # уведомления админам
+
+
+_priority: ContextVar[Priority] = ContextVar("outbound_priority", default=Priority.REPLY)
+
+# Методы, на которые действуют лимиты сообщений
+_LIMITED_PREFIXES = ("send", "copy", "forward", "edit")
+_UNLIMITED_METHODS = frozenset({"sendChatAction"})
+
+
+@contextmanager
+def outbound_priority(priority: Priority) -> Iterator[None]:
+    """Задает приоритет запросов к Bot API внутри блока"""
+    token = _priority.set(priority)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+class TokenBucket:
+    """Ведро жетонов: rate жетонов в секунду, не больше capacity про запас"""
+
+    __slots__ = ("rate", "capacity", "tokens", "updated", "blocked_until")
+
+    def __init__(self, rate: float, capacity: float, now: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = now
+        self.blocked_until = 0.0
+
+    def wait_time(self, now: float) -> float:
+        """Возвращает, сколько секунд ждать следующего жетона"""
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        if now > self.updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self) -> None:
+        self.tokens -= 1
+
+    def block(self, until: float) -> None:
+        """Запрещает выдачу жетонов до момента until (после 429 от Telegram)"""
+        self.blocked_until = max(self.blocked_until, until)
+        self.tokens = 0
+
+    def idle(self, now: float) -> bool:
+        """Ведро полное и не заблокировано: его можно забыть"""
+        return now >= self.blocked_until and self.wait_time(now) == 0 and self.tokens >= self.capacity
+
+
+class _Waiter:
+    __slots__ = ("chat_id", "future")
+
+    def __init__(self, chat_id: Optional[int], future: asyncio.Future):
+        self.chat_id = chat_id
+        self.future = future
+
+
+class OutboundDispatcher(BaseRequestMiddleware):
+    """
+    Middleware сессии бота, выдающий исходящим сообщениям жетоны
+    общего и початового лимитов в порядке приоритета.
+
+    Пока очередь пуста и жетоны есть, запрос уходит сразу. Иначе он
+    встает в очередь своего приоритета, и фоновая задача выдает жетоны:
+    первым - самому приоритетному запросу, чей чат уже может получить
+    сообщение, так что занятый чат не задерживает остальные.
+    """
+
+    def __init__(
+        self,
+        global_rate: float,
+        global_burst: float,
+        chat_rate: float,
+        chat_burst: float,
+        max_retries: int = OUTBOUND_MAX_RETRIES,
+        max_retry_after: float = OUTBOUND_MAX_RETRY_AFTER,
+    ):
+        """
+        Args:
+            global_rate: Сообщений в секунду на весь бот; 0 - без ограничения
+            global_burst: Сообщений, которые можно отправить подряд сверх global_rate
+            chat_rate: Сообщений в секунду в один чат; 0 - без ограничения
+            chat_burst: Сообщений подряд в один чат
+            max_retries: Повторов запроса после TelegramRetryAfter
+            max_retry_after: Пауза, дольше которой запрос не повторяется
+        """
+        self.global_rate = global_rate
+        self.global_burst = global_burst
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self.max_retry_after = max_retry_after
+        self._global: Optional[TokenBucket] = None
+        self._chats: dict[int, TokenBucket] = {}
+        self._lanes: list[deque[_Waiter]] = [deque() for _ in Priority]
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def queued(self) -> int:
+        """Запросы, ожидающие жетона"""
+        return sum(len(lane) for lane in self._lanes)
+
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType,
+        bot: Bot,
+        method: TelegramMethod,
+    ) -> Response:
+        name = getattr(method, "__api_method__", "")
+        if not name.startswith(_LIMITED_PREFIXES) or name in _UNLIMITED_METHODS:
+            return await make_request(bot, method)
+
+        chat_id = getattr(method, "chat_id", None)
+        # Лимиты считаются по чату; @username встречается редко и считается отдельным чатом
+        chat_key = chat_id if isinstance(chat_id, int) else None
+        priority = _priority.get()
+        retries = 0
+        while True:
+            await self._acquire(chat_key, priority)
+            try:
+                return await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                retries += 1
+                if retries > self.max_retries or e.retry_after > self.max_retry_after:
+                    logger.error("Telegram ограничил %s в чат %s на %s с, запрос не повторяется", name, chat_id, e.retry_after)
+                    raise
+                logger.warning("Telegram ограничил %s в чат %s на %s с, повтор %s", name, chat_id, e.retry_after, retries)
+                metrics.OUTBOUND_RETRIES.inc(name)
+                self._block(chat_key, e.retry_after)
+
+    async def close(self) -> None:
+        """Останавливает выдачу жетонов; ожидающие запросы отменяются"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        for lane in self._lanes:
+            while lane:
+                lane.popleft().future.cancel()
+
+    def _bucket(self, chat_id: Optional[int], now: float) -> Optional[TokenBucket]:
+        if chat_id is None:
+            return None
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) >= OUTBOUND_CHAT_BUCKETS_MAX:
+                self._chats = {key: value for key, value in self._chats.items() if not value.idle(now)}
+            # Без лимита ведро всё равно нужно, чтобы выдержать паузу после 429
+            bucket = self._chats[chat_id] = TokenBucket(self.chat_rate or float("inf"), self.chat_burst, now)
+        return bucket
+
+    def _global_bucket(self, now: float, create: bool = False) -> Optional[TokenBucket]:
+        if self._global is None and (self.global_rate or create):
+            self._global = TokenBucket(self.global_rate or float("inf"), self.global_burst, now)
+        return self._global
+
+    def _block(self, chat_id: Optional[int], retry_after: float) -> None:
+        now = time.monotonic()
+        bucket = self._bucket(chat_id, now) or self._global_bucket(now, create=True)
+        bucket.block(now + retry_after)
+
+    def _try_take(self, chat_id: Optional[int], now: float) -> float:
+        """Берет жетоны общего ведра и ведра чата; возвращает 0 или сколько ждать"""
+        global_bucket = self._global_bucket(now)
+        chat_bucket = self._bucket(chat_id, now)
+        wait = max(
+            global_bucket.wait_time(now) if global_bucket is not None else 0.0,
+            chat_bucket.wait_time(now) if chat_bucket is not None else 0.0,
+        )
+        if wait == 0:
+            if global_bucket is not None:
+                global_bucket.take()
+            if chat_bucket is not None:
+                chat_bucket.take()
+        return wait
+
+    async def _acquire(self, chat_id: Optional[int], priority: Priority) -> None:
+        now = time.monotonic()
+        if not self.queued and self._try_take(chat_id, now) == 0:
+            metrics.OUTBOUND_WAIT.observe(0.0, priority.name.lower())
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        self._lanes[priority].append(_Waiter(chat_id, future))
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+        self._wakeup.set()
+        await future
+        metrics.OUTBOUND_WAIT.observe(time.monotonic() - now, priority.name.lower())
+
+    def _grant(self, now: float) -> float:
+        """
+        Выдает жетон первому готовому запросу в порядке приоритета
+
+        Returns:
+            0, если жетон выдан, иначе - сколько ждать до следующей попытки
+        """
+        global_bucket = self._global_bucket(now)
+        if global_bucket is not None:
+            wait = global_bucket.wait_time(now)
+            if wait > 0:
+                return wait
+
+        next_wait = float("inf")
+        for lane in self._lanes:
+            i = 0
+            while i < len(lane):
+                waiter = lane[i]
+                if waiter.future.done():
+                    # Ожидание отменено вместе с обработчиком
+                    del lane[i]
+                    continue
+                wait = self._try_take(waiter.chat_id, now)
+                if wait == 0:
+                    del lane[i]
+                    waiter.future.set_result(None)
+                    return 0.0
+                next_wait = min(next_wait, wait)
+                i += 1
+        return next_wait
+
+    async def _run(self) -> None:
+        """Выдает жетоны ожидающим запросам, пока очередь не опустеет"""
+        while self.queued:
+            self._wakeup.clear()
+            wait = self._grant(time.monotonic())
+            if wait == 0 or not self.queued:
+                continue
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), wait)
+            except asyncio.TimeoutError:
+                pass
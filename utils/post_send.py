@@ -0,0 +1,142 @@
+"""
+Фоновые операции после доставки сообщения клиенту
+"""
+import asyncio
+from typing import Awaitable, Callable, Hashable, Optional
+
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError
+
+from constants import POST_SEND_CLOSE_TIMEOUT, POST_SEND_MAX_ATTEMPTS, POST_SEND_RETRY_DELAY
+from services.base_service import CommitOutcomeUnknown
+from services.unit_of_work import outside_unit_of_work
+from utils import metrics
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+# Ошибки, после которых повтор не нужен: сообщение уже удалено, бот заблокирован,
+# запись могла зафиксироваться и повтор её продублирует
+PERMANENT_ERRORS = (TelegramBadRequest, TelegramForbiddenError, CommitOutcomeUnknown)
+
+
+class PostSendPipeline:
+    """
+    Выполняет побочные действия ответа оператора в фоне.
+
+    Обработчик ответа ждёт только доставки сообщения клиенту; запись в БД,
+    обновление панели и удаление сообщения оператора ставятся сюда; так же
+    /start ставит сюда уведомления админам после приветствия клиенту.
+    Операции с одним ключом выполняются строго по порядку (запись ответа
+    раньше обновления панели, ответы одной сессии - в порядке отправки),
+    с разными ключами - параллельно. Упавшая операция повторяется до
+    max_attempts раз с растущей паузой, кроме ошибок из PERMANENT_ERRORS
+    (в том числе ошибки COMMIT); окончательная ошибка пишется в лог
+    и метрики и передаётся в on_failure. Операции идут вне единицы работы
+    обновления, в своих транзакциях.
+    """
+
+    def __init__(self, max_attempts: int = POST_SEND_MAX_ATTEMPTS, retry_delay: float = POST_SEND_RETRY_DELAY):
+        """
+        Args:
+            max_attempts: Попыток одной операции
+            retry_delay: Пауза перед первым повтором, секунд
+        """
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self._tasks: set[asyncio.Task] = set()
+        self._tails: dict[Hashable, asyncio.Task] = {}
+
+    @property
+    def pending(self) -> int:
+        """Операции, которые ещё не завершились"""
+        return len(self._tasks)
+
+    def submit(
+        self,
+        name: str,
+        job: Callable[[], Awaitable[None]],
+        key: Optional[Hashable] = None,
+        on_failure: Optional[Callable[[Exception], Awaitable[None]]] = None,
+    ) -> None:
+        """
+        Ставит операцию в очередь
+
+        Args:
+            name: Имя операции для логов и метрик
+            job: Операция; вызывается заново при каждой попытке
+            key: Операции с одним ключом выполняются по порядку
+            on_failure: Вызывается с последней ошибкой, если все попытки исчерпаны
+        """
+        previous = self._tails.get(key) if key is not None else None
+        task = asyncio.create_task(self._run(name, job, previous, on_failure))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        if key is not None:
+            self._tails[key] = task
+            task.add_done_callback(lambda done: self._release(key, done))
+
+    async def join(self) -> None:
+        """Ждёт завершения всех операций, в том числе поставленных во время ожидания"""
+        while self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    async def close(self, timeout: float = POST_SEND_CLOSE_TIMEOUT) -> None:
+        """Даёт операциям завершиться и отменяет оставшиеся по истечении timeout"""
+        if not self._tasks:
+            return
+        done, pending = await asyncio.wait(set(self._tasks), timeout=timeout)
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+        logger.info(
+            "Фоновые операции ответов остановлены: завершено %s, отменено %s", len(done), len(pending)
+        )
+
+    async def _run(
+        self,
+        name: str,
+        job: Callable[[], Awaitable[None]],
+        previous: Optional[asyncio.Task],
+        on_failure: Optional[Callable[[Exception], Awaitable[None]]],
+    ) -> None:
+        if previous is not None:
+            # Ошибка предыдущей операции уже обработана в её задаче
+            await asyncio.wait([previous])
+
+        with outside_unit_of_work():
+            error = await self._attempt(name, job)
+            if error is None:
+                return
+
+            metrics.POST_SEND_FAILURES.inc(name)
+            logger.error("Фоновая операция %s не выполнена: %s", name, error)
+            if on_failure is not None:
+                try:
+                    await on_failure(error)
+                except Exception as e:
+                    logger.error("Ошибка обработки сбоя операции %s: %s", name, e)
+
+    async def _attempt(self, name: str, job: Callable[[], Awaitable[None]]) -> Optional[Exception]:
+        """Выполняет операцию с повторами; возвращает последнюю ошибку или None"""
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                await job()
+                return None
+            except PERMANENT_ERRORS as e:
+                return e
+            except Exception as e:
+                if attempt == self.max_attempts:
+                    return e
+                delay = self.retry_delay * 2 ** (attempt - 1)
+                metrics.POST_SEND_RETRIES.inc(name)
+                logger.warning(
+                    "Фоновая операция %s не удалась (попытка %s из %s), повтор через %.1f с: %s",
+                    name, attempt, self.max_attempts, delay, e
+                )
+                await asyncio.sleep(delay)
+        return None
+
+    def _release(self, key: Hashable, task: asyncio.Task) -> None:
+        """Убирает ключ, если после завершившейся операции новых не поставлено"""
+        if self._tails.get(key) is task:
+            del self._tails[key]
@@ -0,0 +1,205 @@
+"""
+Статистика SQL-запросов и журнал медленных запросов
+
+Запросы группируются по нормализованному тексту: пробелы схлопываются,
+литералы и плейсхолдеры заменяются на ?, а повторяющиеся списки значений
+многострочных INSERT сворачиваются. Для каждой группы хранятся количество,
+суммарное и максимальное время, число строк и последние замеры для p50/p95.
+"""
+import re
+from collections import deque
+from typing import Any, NamedTuple
+
+from constants import (
+    QUERY_STATS_MAX_STATEMENTS,
+    QUERY_STATS_SAMPLE_SIZE,
+    SLOW_QUERY_THRESHOLD,
+)
+from utils.logger import get_logger
+
+# Отдельный логгер, чтобы уровень журнала медленных запросов задавался через LOG_LEVELS
+slow_logger = get_logger("slow_query")
+
+_OTHER_STATEMENTS = "<прочие запросы>"
+
+_WHITESPACE = re.compile(r"\s+")
+_STRING_LITERAL = re.compile(r"'(?:[^'\\]|\\.|'')*'")
+_NUMBER_LITERAL = re.compile(r"\b\d+(?:\.\d+)?\b")
+_PLACEHOLDER = re.compile(r"%\(\w+\)s|%s")
+_VALUE_LIST = r"\( ?\?(?: ?, ?\?)* ?\)"
+_VALUE_LISTS = re.compile(rf"({_VALUE_LIST})(?: ?, ?{_VALUE_LIST})+")
+
+
+def normalize_sql(query: str) -> str:
+    """
+    Приводит текст запроса к виду, общему для всех его вызовов
+
+    Args:
+        query: Текст запроса с плейсхолдерами
+
+    Returns:
+        Нормализованный текст запроса
+    """
+    sql = _WHITESPACE.sub(" ", query).strip()
+    sql = _STRING_LITERAL.sub("?", sql)
+    sql = _PLACEHOLDER.sub("?", sql)
+    sql = _NUMBER_LITERAL.sub("?", sql)
+    return _VALUE_LISTS.sub(r"\1, ...", sql)
+
+
+def _redact_value(value: Any) -> str:
+    if value is None:
+        return "NULL"
+    if isinstance(value, (str, bytes)):
+        return f"{type(value).__name__}[{len(value)}]"
+    return type(value).__name__
+
+
+def redact_params(params: Any) -> str:
+    """
+    Описывает параметры запроса без их значений: только типы и длины строк
+
+    Args:
+        params: Параметры запроса (кортеж, список, словарь или None)
+
+    Returns:
+        Строка вида "(int, str[12], NULL)"
+    """
+    if params is None:
+        return "()"
+    if isinstance(params, dict):
+        return "{" + ", ".join(f"{key}: {_redact_value(value)}" for key, value in params.items()) + "}"
+    if isinstance(params, (tuple, list)):
+        return "(" + ", ".join(_redact_value(value) for value in params) + ")"
+    return f"({_redact_value(params)})"
+
+
+class StatementSummary(NamedTuple):
+    """Сводка по одному нормализованному запросу"""
+    sql: str
+    count: int
+    total: float
+    p50: float
+    p95: float
+    max: float
+    rows: int
+
+
+class _StatementStats:
+    """Накопленные замеры одного нормализованного запроса"""
+
+    __slots__ = ("count", "total", "max", "rows", "samples")
+
+    def __init__(self, sample_size: int):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.rows = 0
+        self.samples: deque[float] = deque(maxlen=sample_size)
+
+    def add(self, duration: float, rows: int) -> None:
+        self.count += 1
+        self.total += duration
+        self.max = max(self.max, duration)
+        self.rows += max(rows, 0)
+        self.samples.append(duration)
+
+    def summary(self, sql: str) -> StatementSummary:
+        ordered = sorted(self.samples)
+        return StatementSummary(
+            sql=sql,
+            count=self.count,
+            total=self.total,
+            p50=_percentile(ordered, 0.50),
+            p95=_percentile(ordered, 0.95),
+            max=self.max,
+            rows=self.rows,
+        )
+
+
+def _percentile(ordered: list[float], q: float) -> float:
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class QueryStats:
+    """
+    Агрегаты по нормализованным SQL-запросам процесса.
+
+    Перцентили считаются по последним sample_size замерам каждого запроса.
+    Запросы дольше slow_threshold секунд пишутся в логгер slow_query
+    с обезличенными параметрами.
+    """
+
+    def __init__(
+        self,
+        slow_threshold: float = SLOW_QUERY_THRESHOLD,
+        sample_size: int = QUERY_STATS_SAMPLE_SIZE,
+        max_statements: int = QUERY_STATS_MAX_STATEMENTS,
+    ):
+        """
+        Args:
+            slow_threshold: Порог медленного запроса в секундах
+            sample_size: Количество последних замеров для перцентилей
+            max_statements: Максимум различных запросов; остальные учитываются вместе
+        """
+        self.slow_threshold = slow_threshold
+        self.sample_size = sample_size
+        self.max_statements = max_statements
+        self._stats: dict[str, _StatementStats] = {}
+        self._normalized: dict[str, str] = {}
+
+    def _normalize(self, query: str) -> str:
+        sql = self._normalized.get(query)
+        if sql is None:
+            sql = normalize_sql(query)
+            if len(self._normalized) < self.max_statements * 4:
+                self._normalized[query] = sql
+        return sql
+
+    def record(self, query: str, params: Any, duration: float, rows: int) -> None:
+        """
+        Учитывает выполненный запрос
+
+        Args:
+            query: Текст запроса
+            params: Параметры запроса (в журнал попадают только их типы)
+            duration: Время выполнения в секундах
+            rows: Количество возвращенных или измененных строк
+        """
+        sql = self._normalize(query)
+        stats = self._stats.get(sql)
+        if stats is None:
+            if len(self._stats) >= self.max_statements:
+                sql = _OTHER_STATEMENTS
+                stats = self._stats.get(sql)
+            if stats is None:
+                stats = self._stats[sql] = _StatementStats(self.sample_size)
+        stats.add(duration, rows)
+
+        if duration >= self.slow_threshold:
+            slow_logger.warning(
+                "Медленный запрос: %.1f мс, строк %s: %s; параметры: %s",
+                duration * 1000, rows, sql, redact_params(params)
+            )
+
+    def top(self, limit: int) -> list[StatementSummary]:
+        """
+        Возвращает запросы с наибольшим суммарным временем
+
+        Args:
+            limit: Количество запросов
+
+        Returns:
+            Сводки, отсортированные по убыванию суммарного времени
+        """
+        ordered = sorted(self._stats.items(), key=lambda item: item[1].total, reverse=True)
+        return [stats.summary(sql) for sql, stats in ordered[:limit]]
+
+    def reset(self) -> None:
+        """Сбрасывает накопленную статистику"""
+        self._stats.clear()
+
+
+QUERY_STATS = QueryStats()
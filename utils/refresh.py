@@ -1,18 +1,35 @@
+import asyncio
+
+from aiogram.exceptions import TelegramBadRequest
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.storage.base import StorageKey
 
+from constants import PANEL_REFRESH_INTERVAL
 from keyboards import back
 from keyboards.messages_keyboard import session_view
 from services import ServiceContainer
+from services.unit_of_work import outside_unit_of_work
 from states import AdminChat
-from utils import render_messages
 from utils.logger import get_logger
+from utils.outbound import Priority, outbound_priority
 
 logger = get_logger(__name__)
 
-async def refresh_session_view(bot, storage, services: ServiceContainer, operator_id: int, state: FSMContext | None = None):
-    """Обновляет просмотр сессии для оператора"""
-    logger.debug(f"Обновление просмотра сессии для оператора {operator_id}")
+async def refresh_session_view(
+    bot,
+    storage,
+    services: ServiceContainer,
+    operator_id: int,
+    state: FSMContext | None = None,
+    raise_errors: bool = False,
+):
+    """
+    Обновляет просмотр сессии для оператора
+
+    raise_errors: не глотать ошибку правки панели, чтобы вызывающий
+    (фоновые операции ответа) мог её повторить
+    """
+    logger.debug("Обновление просмотра сессии для оператора %s", operator_id)
     
     # Получаем FSM контекст
     fsm = state or _create_fsm_context(bot, storage, operator_id)
@@ -20,7 +37,7 @@ async def refresh_session_view(bot, storage, services: ServiceContainer, operato
     # Проверяем состояние оператора
     current_state = await fsm.get_state()
     if current_state != "AdminChat:active":
-        logger.debug(f"Оператор {operator_id} не в активном состоянии, пропускаем обновление")
+        logger.debug("Оператор %s не в активном состоянии, пропускаем обновление", operator_id)
         return
 
     # Получаем данные панели
@@ -29,26 +46,38 @@ async def refresh_session_view(bot, storage, services: ServiceContainer, operato
     session_id = int(data.get("session_id") or 0)
     
     if not panel or not session_id:
-        logger.debug(f"Нет панели или session_id для оператора {operator_id}")
+        logger.debug("Нет панели или session_id для оператора %s", operator_id)
+        return
+    
+    if panel.get("history"):
+        logger.debug("Оператор %s листает историю, пропускаем обновление", operator_id)
         return
 
     # Обновляем панель
-    await _update_panel(bot, services, session_id, panel, current_state, operator_id)
+    await _update_panel(bot, services, session_id, panel, current_state, operator_id, raise_errors)
 
 
 def _create_fsm_context(bot, storage, operator_id: int) -> FSMContext:
     """Создает FSM контекст для оператора"""
     key = StorageKey(bot_id=bot.id, chat_id=operator_id, user_id=operator_id)
     fsm = FSMContext(storage=storage, key=key)
-    logger.debug(f"Создан новый FSM контекст для оператора {operator_id}")
+    logger.debug("Создан новый FSM контекст для оператора %s", operator_id)
     return fsm
 
 
-async def _update_panel(bot, services: ServiceContainer, session_id: int, panel: dict, current_state: str, operator_id: int):
+async def _update_panel(
+    bot,
+    services: ServiceContainer,
+    session_id: int,
+    panel: dict,
+    current_state: str,
+    operator_id: int,
+    raise_errors: bool = False,
+):
     """Обновляет панель сессии"""
     chat_id = panel["chat_id"]
     message_id = panel["message_id"]
-    logger.debug(f"Обновление панели: chat_id={chat_id}, message_id={message_id}")
+    logger.debug("Обновление панели: chat_id=%s, message_id=%s", chat_id, message_id)
 
     session_service = services.session_service
     message_service = services.message_service
@@ -56,32 +85,96 @@ async def _update_panel(bot, services: ServiceContainer, session_id: int, panel:
     # Получаем информацию о сессии
     info = await session_service.get_session_info(session_id)
     if not info:
-        logger.warning(f"Сессия {session_id} не найдена для обновления панели оператора {operator_id}")
+        logger.warning("Сессия %s не найдена для обновления панели оператора %s", session_id, operator_id)
         return
 
     # Получаем сообщения и рендерим
-    msgs = await message_service.get_session_messages(info["tgid"], session_id)
-    text, attachments = render_messages.render_session_text(
-        info["username"], 
-        info["assigned_agent"], 
-        msgs
-    )
-    logger.debug(f"Рендеринг панели: {len(msgs)} сообщений, {len(attachments)} вложений")
-
-    # Обновляем сообщение
+    transcript = await message_service.get_session_transcript(info["tgid"], session_id)
+    page = transcript.render(info["username"], info["assigned_agent"])
+    logger.debug("Рендеринг панели: %s сообщений, %s вложений", len(transcript.entries), len(page.attachments))
+
+    # Обновляем сообщение: после ответов операторам и клиентам
     try:
-        await bot.edit_message_text(
-            chat_id=chat_id,
-            message_id=message_id,
-            text=text,
-            reply_markup=session_view.session_view_kb(
-                session_id, 
-                taken=bool(info["assigned_agent"]), 
-                opened=bool(current_state), 
-                attachments=attachments
-            ),
-            disable_web_page_preview=True
-        )
-        logger.info(f"Панель сессии {session_id} обновлена для оператора {operator_id}")
+        with outbound_priority(Priority.REFRESH):
+            await bot.edit_message_text(
+                chat_id=chat_id,
+                message_id=message_id,
+                text=page.text,
+                reply_markup=session_view.session_view_kb(
+                    session_id, 
+                    taken=bool(info["assigned_agent"]), 
+                    opened=bool(current_state), 
+                    attachments=page.attachments,
+                    older=page.older,
+                    newer=page.newer,
+                ),
+                disable_web_page_preview=True
+            )
+        logger.info("Панель сессии %s обновлена для оператора %s", session_id, operator_id)
+    except TelegramBadRequest as e:
+        if "message is not modified" in str(e):
+            # Панель уже показывает то же самое
+            logger.debug("Панель сессии %s оператора %s не изменилась", session_id, operator_id)
+            return
+        if raise_errors:
+            raise
+        logger.warning("Не удалось обновить панель сессии %s для оператора %s: %s", session_id, operator_id, e)
     except Exception as e:
-        logger.warning(f"Не удалось обновить панель сессии {session_id} для оператора {operator_id}: {e}")
+        if raise_errors:
+            raise
+        logger.warning("Не удалось обновить панель сессии %s для оператора %s: %s", session_id, operator_id, e)
+
+
+class PanelRefreshScheduler:
+    """
+    Откладывает и склеивает обновления панелей операторов.
+
+    У оператора одна панель (panel_msg в FSM), поэтому ключом служит ID
+    оператора: пока обновление ждёт своей очереди, новые запросы к нему
+    присоединяются, и панель редактируется не чаще раза в interval секунд.
+    Обновления выполняются в фоне, вне обработки апдейта.
+    """
+
+    def __init__(self, bot, storage, services: ServiceContainer, interval: float = PANEL_REFRESH_INTERVAL):
+        self.bot = bot
+        self.storage = storage
+        self.services = services
+        self.interval = interval
+        self._pending: dict[int, asyncio.Task] = {}
+        self._last_refresh: dict[int, float] = {}
+
+    def schedule(self, operator_id: int) -> None:
+        """Запрашивает обновление панели оператора"""
+        if operator_id in self._pending:
+            logger.debug("Обновление панели оператора %s уже запланировано", operator_id)
+            return
+        self._pending[operator_id] = asyncio.create_task(self._refresh_later(operator_id))
+
+    async def close(self) -> None:
+        """Отменяет запланированные обновления"""
+        tasks = list(self._pending.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._pending.clear()
+        logger.info("Планировщик обновления панелей остановлен, отменено обновлений: %s", len(tasks))
+
+    async def _refresh_later(self, operator_id: int) -> None:
+        """Ждёт окончания интервала и обновляет панель"""
+        loop = asyncio.get_running_loop()
+        try:
+            delay = self._last_refresh.get(operator_id, float("-inf")) + self.interval - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        finally:
+            # Запросы, пришедшие во время редактирования, запланируют следующее
+            self._pending.pop(operator_id, None)
+
+        self._last_refresh[operator_id] = loop.time()
+        try:
+            # Задача создана внутри чужого обновления: его соединение, транзакция
+            # и память чтений ей не принадлежат
+            with outside_unit_of_work(), self.services.request_scope():
+                await refresh_session_view(self.bot, self.storage, self.services, operator_id)
+        except Exception as e:
+            logger.error("Ошибка фонового обновления панели оператора %s: %s", operator_id, e)
@@ -1,4 +1,29 @@
+from collections import deque
 from datetime import datetime
+from typing import NamedTuple
+
+from constants import PANEL_TEXT_LIMIT, TRANSCRIPT_MESSAGE_LIMIT
+
+_CURSOR_FORMAT = "%Y%m%d%H%M%S"
+
+
+class TranscriptEntry(NamedTuple):
+    """Одно сообщение истории (или альбом), подготовленное к выводу"""
+    mid: int
+    created_at: datetime
+    line: str
+    attachments: tuple[int, ...]
+    media_group_id: str | None
+    # Ключ (created_at, id) последнего сообщения записи: у альбома он не совпадает с первым
+    last: tuple[datetime, int]
+
+
+class TranscriptPage(NamedTuple):
+    """Текст панели сессии и курсоры для листания истории"""
+    text: str
+    attachments: list[tuple[int, int]]
+    older: str | None
+    newer: str | None
 
 
 def _format_datetime(dt: datetime) -> str:
@@ -6,43 +31,159 @@ def _format_datetime(dt: datetime) -> str:
     return dt.strftime("%H:%M %d.%m.%Y")
 
 
-def render_session_text(
-    username: str | None, 
-    assigned_agent: int | None, 
-    msgs: list[tuple[int, str, str | None, str | None, datetime]]
-) -> tuple[str, list[tuple[int, int]]]:
-    """Рендерит текст сессии с сообщениями и вложениями"""
-    # Формируем заголовок
+def _attachments_label(first: int, count: int) -> str:
+    """Подпись вложений записи: номер вложения или диапазон номеров альбома"""
+    if count == 1:
+        return f"🖼 Вложение {first}"
+    return f"🖼 Вложения {first}–{first + count - 1} (альбом)"
+
+
+def _clip(text: str) -> str:
+    """Обрезает длинный текст сообщения для панели"""
+    if len(text) > TRANSCRIPT_MESSAGE_LIMIT:
+        return text[:TRANSCRIPT_MESSAGE_LIMIT] + "…"
+    return text
+
+
+def _telegram_length(text: str) -> int:
+    """Длина текста в UTF-16 единицах, как её считает Telegram"""
+    return len(text.encode("utf-16-le")) // 2
+
+
+def encode_cursor(created_at: datetime, mid: int) -> str:
+    """Кодирует ключ (created_at, id) для callback_data"""
+    return f"{created_at.strftime(_CURSOR_FORMAT)}:{mid}"
+
+
+def decode_cursor(created_at: str, mid: str) -> tuple[datetime, int]:
+    """Декодирует ключ (created_at, id) из callback_data"""
+    return datetime.strptime(created_at, _CURSOR_FORMAT), int(mid)
+
+
+def render_header(username: str | None, assigned_agent: int | None) -> str:
+    """Рендерит заголовок сессии"""
     header_parts = []
     if username:
         header_parts.append(f"👤 Клиент: @{username}")
     else:
         header_parts.append("👤 Клиент: (без username)")
-    
+
     if assigned_agent:
         header_parts.append(f"👨‍💼 Оператор: {assigned_agent}")
-    
-    header_text = "\n".join(header_parts)
-
-    # Обрабатываем сообщения
-    lines = []
-    attachments = []
-    attachment_counter = 1
-    
-    for mid, direction, text, file_id, dt in msgs:
+
+    return "\n".join(header_parts)
+
+
+class SessionTranscript:
+    """
+    Окно истории сессии, которое можно дополнять по одному сообщению.
+
+    Хранит не больше max_entries последних сообщений; при выводе
+    показывает столько из них, сколько помещается в одно сообщение Telegram.
+    """
+
+    def __init__(self, max_entries: int | None = None, has_older: bool = False, has_newer: bool = False, from_oldest: bool = False):
+        """
+        Args:
+            max_entries: Сколько сообщений держать в окне (None - без ограничения)
+            has_older: Есть ли в БД сообщения старше окна
+            has_newer: Есть ли в БД сообщения новее окна
+            from_oldest: Заполнять текст начиная со старых сообщений (при листании вперёд)
+        """
+        self.entries: deque[TranscriptEntry] = deque(maxlen=max_entries)
+        self.has_older = has_older
+        self.has_newer = has_newer
+        self.from_oldest = from_oldest
+
+    def append(
+        self,
+        mid: int,
+        direction: str,
+        text: str | None,
+        file_id: str | None,
+        dt: datetime,
+        media_group_id: str | None = None,
+    ) -> None:
+        """Добавляет строку одного сообщения; сообщения одного альбома попадают в одну строку"""
+        last = self.entries[-1] if self.entries else None
+        if media_group_id and last is not None and last.media_group_id == media_group_id:
+            # Подпись у альбома обычно одна, но Telegram разрешает её у любого элемента
+            line = f"{last.line}{_clip(text)} " if text else last.line
+            attachments = last.attachments + ((mid,) if file_id else ())
+            self.entries[-1] = last._replace(line=line, attachments=attachments, last=(dt, mid))
+            return
+
         side = "🟢 Клиент" if direction == "fromUser" else "🔵 Оператор"
-        timestamp = _format_datetime(dt)
-        
-        if file_id and not text:
-            # Сообщение с вложением
-            lines.append(f"({timestamp}) {side}: 🖼 Вложение {attachment_counter}")
-            attachments.append((attachment_counter, mid))
-            attachment_counter += 1
+        prefix = f"({_format_datetime(dt)}) {side}: "
+
+        if self.entries.maxlen is not None and len(self.entries) == self.entries.maxlen:
+            self.has_older = True
+
+        if media_group_id:
+            # Первое сообщение альбома, номера вложений проставляются при выводе
+            line = f"{prefix}{_clip(text)} " if text else prefix
+            attachments = (mid,) if file_id else ()
+            self.entries.append(TranscriptEntry(mid, dt, line, attachments, media_group_id, (dt, mid)))
+        elif file_id and not text:
+            # Сообщение с вложением, номер проставляется при выводе
+            self.entries.append(TranscriptEntry(mid, dt, prefix, (mid,), None, (dt, mid)))
         else:
             # Обычное текстовое сообщение
-            message_text = text or '-'
-            lines.append(f"({timestamp}) {side}: {message_text}")
-    
-    # Формируем итоговый текст
-    body = "\n".join(lines) if lines else "Пока нет сообщений."
-    return f"{header_text}\n\n{body}", attachments
\ No newline at end of file
+            self.entries.append(TranscriptEntry(mid, dt, prefix + _clip(text or '-'), (), None, (dt, mid)))
+
+    def render(self, username: str | None, assigned_agent: int | None, limit: int = PANEL_TEXT_LIMIT) -> TranscriptPage:
+        """Рендерит текст сессии с заголовком, укладываясь в лимит длины"""
+        header_text = render_header(username, assigned_agent)
+        budget = limit - _telegram_length(header_text) - 2
+
+        entries = list(self.entries)
+        # Оценка сверху: номера вложений не больше их общего числа
+        total_attachments = sum(len(entry.attachments) for entry in entries)
+        ordered = entries if self.from_oldest else reversed(entries)
+        selected: list[TranscriptEntry] = []
+        used = 0
+        for entry in ordered:
+            cost = _telegram_length(entry.line) + 1
+            if entry.attachments:
+                cost += _telegram_length(_attachments_label(total_attachments, len(entry.attachments)))
+            if selected and used + cost > budget:
+                break
+            selected.append(entry)
+            used += cost
+        if not self.from_oldest:
+            selected.reverse()
+
+        truncated = len(selected) < len(entries)
+        has_older = self.has_older or (truncated and not self.from_oldest)
+        has_newer = self.has_newer or (truncated and self.from_oldest)
+
+        lines = []
+        attachments = []
+        for entry in selected:
+            if entry.attachments:
+                first = len(attachments) + 1
+                lines.append(entry.line + _attachments_label(first, len(entry.attachments)))
+                attachments.extend((first + i, mid) for i, mid in enumerate(entry.attachments))
+            else:
+                lines.append(entry.line)
+
+        body = "\n".join(lines) if lines else "Пока нет сообщений."
+        older = encode_cursor(selected[0].created_at, selected[0].mid) if has_older and selected else None
+        newer = encode_cursor(*selected[-1].last) if has_newer and selected else None
+        return TranscriptPage(f"{header_text}\n\n{body}", attachments, older, newer)
+
+
+def build_transcript(
+    msgs: list[tuple[int, str, str | None, str | None, str | None, datetime]],
+    max_entries: int | None = None,
+    has_older: bool = False,
+    has_newer: bool = False,
+    from_oldest: bool = False,
+) -> SessionTranscript:
+    """Собирает историю сессии из строк сообщений в хронологическом порядке"""
+    transcript = SessionTranscript(max_entries, has_older=has_older, has_newer=has_newer, from_oldest=from_oldest)
+    for mid, direction, text, file_id, media_group_id, dt in msgs:
+        transcript.append(mid, direction, text, file_id, dt, media_group_id)
+    # append помечает переполнение окна, но лишние строки обычно уже отсечены запросом
+    transcript.has_older = has_older or (max_entries is not None and len(msgs) > max_entries)
+    return transcript